@@ -0,0 +1,105 @@
+"""Gathernomics - Columnar Filter Engine Benchmark.
+
+Compares the row engine with the columnar engine on a StatsCan data CSV,
+checking that both produce the same rows.  Without a CSV, a synthetic
+cube shaped like the GDP table is generated.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import argparse
+import csv
+import os
+import os.path as path
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from gathernomics.filters import GDPFilter  # noqa: E402
+from gathernomics.filters.columnar import ColumnarScanEngine  # noqa: E402
+from gathernomics.filters.scan import ScanEngine  # noqa: E402
+from gathernomics.models.factor import TemporalFrequency  # noqa: E402
+
+HEADER = [
+    "REF_DATE", "GEO", "DGUID", "Seasonal adjustment", "Prices",
+    "North American Industry Classification System (NAICS)", "UOM",
+    "UOM_ID", "SCALAR_FACTOR", "SCALAR_ID", "VECTOR", "COORDINATE", "VALUE",
+    "STATUS", "SYMBOL", "TERMINATED", "DECIMALS"
+]
+ADJUSTMENTS = ["Seasonally adjusted at annual rates", "Trading-day adjusted"]
+PRICES = ["Chained (2007) dollars", "2007 constant prices", "Current prices"]
+INDUSTRIES = ["All industries"] + ["Industry {}".format(i) for i in range(60)]
+
+
+def generate_cube(csv_path: str, rows: int):
+    random.seed(0)
+    with open(csv_path, "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(HEADER)
+        for i in range(rows):
+            writer.writerow([
+                "{}-{:02d}".format(1997 + (i // 12) % 22, 1 + i % 12),
+                "Canada", "2016A000011124",
+                random.choice(ADJUSTMENTS), random.choice(PRICES),
+                random.choice(INDUSTRIES), "Dollars", "81", "millions", "6",
+                "v{}".format(i % 5000), "1.1.{}".format(i % 61),
+                str(random.randint(0, 2000000)), "", "", "", "0"])
+
+
+def make_filters(csv_path: str, count: int) -> list:
+    return [GDPFilter(csv_path=csv_path,
+                      category="gdp", indicator="gdp-{}".format(i),
+                      frequency=TemporalFrequency.MONTHLY)
+            for i in range(count)]
+
+
+def time_engine(engine_cls, csv_path: str, count: int, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = engine_cls(make_filters(csv_path, count)).Run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def main(*argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", help="StatsCan data CSV of the GDP table",
+                        default=None)
+    parser.add_argument("--rows", type=int, default=500000,
+                        help="Rows of the synthetic cube")
+    parser.add_argument("--filters", type=int, default=1,
+                        help="Filters run over the CSV at once")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args(argv)
+
+    csv_path = options.csv
+    if csv_path is None:
+        handle, csv_path = tempfile.mkstemp(suffix=".csv")
+        os.close(handle)
+        generate_cube(csv_path, options.rows)
+    try:
+        row_time, row_results = time_engine(
+            ScanEngine, csv_path, options.filters, options.repeat)
+        columnar_time, columnar_results = time_engine(
+            ColumnarScanEngine, csv_path, options.filters, options.repeat)
+    finally:
+        if options.csv is None:
+            os.remove(csv_path)
+    if row_results != columnar_results:
+        print("Engines disagree")
+        return 1
+    print("Rows kept: {}".format(sum(len(rows) for rows in row_results)))
+    print("Row engine:      {:.3f}s".format(row_time))
+    print("Columnar engine: {:.3f}s ({:.2f}x)".format(
+        columnar_time, row_time / columnar_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
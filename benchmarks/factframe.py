@@ -0,0 +1,75 @@
+"""Gathernomics - Fact Frame Benchmark.
+
+Measures the memory taken by each fact of a synthetic daily series held
+as the dicts filters produce, and held in a FactFrame.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import argparse
+from datetime import date as Date
+import os.path as path
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from gathernomics.factframe import FactFrame  # noqa: E402
+from gathernomics.filters.parsecache import ParseCache  # noqa: E402
+from gathernomics.models.factor import TemporalFrequency  # noqa: E402
+
+INDICATORS = ["exchange-rate-{}".format(i) for i in range(20)]
+
+
+def make_facts(count: int) -> list:
+    """Facts as filters produce them, sharing dates and strings."""
+    random.seed(0)
+    cache = ParseCache()
+    start = Date(1990, 1, 1).toordinal()
+    dates = {}
+    facts = []
+    for i in range(count):
+        ordinal = start + i // len(INDICATORS)
+        if ordinal not in dates:
+            dates[ordinal] = Date.fromordinal(ordinal)
+        facts.append({
+            "value": random.randint(0, 2 ** 40),
+            "indicator": cache.String(INDICATORS[i % len(INDICATORS)]),
+            "category": cache.String("exchange"),
+            "date": dates[ordinal],
+            "frequency": TemporalFrequency.MONTHLY
+        })
+    return facts
+
+
+def measure(build) -> tuple:
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main(*argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facts", type=int, default=1000000,
+                        help="Facts of the series")
+    options = parser.parse_args(argv)
+
+    facts, dict_size = measure(lambda: make_facts(options.facts))
+    frame, frame_size = measure(lambda: FactFrame.FromFacts(facts))
+    if list(frame.Facts()) != facts:
+        print("Frame facts differ")
+        return 1
+    print("Facts: {}".format(options.facts))
+    print("Dicts:     {:.1f} bytes per fact".format(
+        dict_size / options.facts))
+    print("FactFrame: {:.1f} bytes per fact ({:.1f}x smaller)".format(
+        frame_size / options.facts, dict_size / frame_size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,114 @@
+"""Gathernomics - Parse Cache Benchmark.
+
+Measures the time to turn a kept row into a fact with the filters' parse
+cache, and with every REF_DATE and SCALAR_FACTOR parsed again for each
+row, over synthetic monthly and daily series.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import argparse
+from datetime import date as Date
+from datetime import datetime as DateTime
+from datetime import timedelta as TimeDelta
+import os.path as path
+import random
+import sys
+import time
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from gathernomics.filters import GDPFilter  # noqa: E402
+from gathernomics.models.factor import TemporalFrequency  # noqa: E402
+from gathernomics.utils import scalar_multiplier, tryint  # noqa: E402
+
+SCALARS = ["units", "thousands", "millions"]
+
+
+class DailyFilter(GDPFilter):
+    """GDP Filter over a table with daily reference dates."""
+    def getDate(self, row: dict) -> Date:
+        return DateTime.strptime(row["REF_DATE"], "%Y-%m-%d").date()
+
+
+def monthly_dates(count: int) -> list:
+    return ["{}-{:02d}".format(1997 + i // 12, 1 + i % 12)
+            for i in range(count)]
+
+
+def daily_dates(count: int) -> list:
+    start = Date(1997, 1, 1)
+    return [(start + TimeDelta(days=i)).isoformat() for i in range(count)]
+
+
+def make_rows(dates: list, rows: int) -> list:
+    """Kept rows of a table, each series listing every date in turn."""
+    random.seed(0)
+    return [{
+        "REF_DATE": dates[i % len(dates)],
+        "SCALAR_FACTOR": SCALARS[(i // len(dates)) % len(SCALARS)],
+        "VALUE": str(random.randint(0, 2000000))
+    } for i in range(rows)]
+
+
+def uncached_transform(table_filter, row: dict) -> dict:
+    """Transform a row parsing everything again, as before the cache."""
+    return {
+        "value": tryint(row["VALUE"]) *
+        scalar_multiplier.__wrapped__(row["SCALAR_FACTOR"]),
+        "indicator": table_filter.getIndicator(row),
+        "category": table_filter.getCategory(row),
+        "date": table_filter.getDate(row),
+        "frequency": table_filter.getFrequency(row)
+    }
+
+
+def time_transform(make_filter, rows: list, cached: bool, repeat: int):
+    best = None
+    for _ in range(repeat):
+        table_filter = make_filter()
+        start = time.perf_counter()
+        if cached:
+            facts = [table_filter.transformRow(row) for row in rows]
+        else:
+            facts = [uncached_transform(table_filter, row) for row in rows]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, facts
+
+
+def main(*argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000,
+                        help="Kept rows of each table")
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args(argv)
+
+    tables = [
+        ("Monthly", GDPFilter, monthly_dates(264)),
+        ("Daily", DailyFilter, daily_dates(7305))
+    ]
+    for name, filter_cls, dates in tables:
+        rows = make_rows(dates, options.rows)
+
+        def make_filter():
+            return filter_cls(csv_path=None, category="gdp", indicator="gdp",
+                              frequency=TemporalFrequency.MONTHLY)
+        uncached_time, uncached_facts = time_transform(
+            make_filter, rows, False, options.repeat)
+        cached_time, cached_facts = time_transform(
+            make_filter, rows, True, options.repeat)
+        if cached_facts != uncached_facts:
+            print("{}: facts differ".format(name))
+            return 1
+        print("{} ({} dates, {} rows)".format(name, len(dates), len(rows)))
+        print("  Uncached: {:.2f}us per row".format(
+            uncached_time / len(rows) * 1e6))
+        print("  Cached:   {:.2f}us per row ({:.2f}x)".format(
+            cached_time / len(rows) * 1e6, uncached_time / cached_time))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:]))
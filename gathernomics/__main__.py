@@ -6,17 +6,25 @@ See LICENSE for information
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import csv
+from functools import partial
 import getpass
 import logging
 from pprint import pprint
 import sys
-from typing import List
+from typing import List, Tuple
 
+from gathernomics.cache import DownloadCache
 from gathernomics.config import GathernomicsConfig
-from gathernomics.defaults import DEFAULT_DATEBASE_NAME
+from gathernomics.delta import (
+    DeltaState, IncrementalIngestor, LocalDeltaSource, StatsCanDeltaSource)
+from gathernomics.defaults import (
+    DEFAULT_DATEBASE_NAME, DEFAULT_JOBS, DEFAULT_POOL_SIZE,
+    DEFAULT_WRITE_BATCH_ROWS, DEFAULT_WRITERS)
 from gathernomics.descriptor import TableDescriptor
-from gathernomics.downloader import StatsCanTableDownloader
+from gathernomics.downloader import DownloadError, StatsCanTableDownloader
+from gathernomics.factframe import FactFrame
 from gathernomics.models.base import ModelBase
 from gathernomics.filters import (
     ConsumptionFilter,
@@ -28,7 +36,23 @@ from gathernomics.filters import (
     GDPFilter,
     GovernmentExpenditureFilter,
     CaptialFilter, ImportExportFilter)
+from gathernomics.filters.columnar import (
+    ColumnarScanEngine, columnar_available)
+from gathernomics.filters.daterange import DateRange, ref_date
+from gathernomics.filters.index import IndexedScanEngine
+from gathernomics.filters.mmapscan import MmapScanEngine
+from gathernomics.filters.parallel import ParallelScanEngine, process_pool
+from gathernomics.filters.scan import ScanEngine
+from gathernomics.filters.selectivity import SelectivityStats
+from gathernomics.metadata import TableMetadata
 from gathernomics.models.factor import TemporalFrequency
+from gathernomics.pipeline import (
+    IncompleteTableError, RowPipeline, iter_frames)
+from gathernomics.planner import TableGroup, plan_tables
+from gathernomics.utils import coalese, positive_int
+from gathernomics.writers import (
+    COMPRESSIONS, OUTPUT_FORMATS, PARTITION_FIELDS, RowWriter, make_writer,
+    output_compression)
 
 # Initialize logger.
 logger = logging.getLogger(name=__name__)
@@ -105,11 +129,134 @@ def parse_args(args: List[str]) -> argparse.Namespace:
 
     parser.add_argument(
         "--output",
-        help="Location of output csv file",
+        help="Location of output file",
         type=str,
         default=None,
         dest="output_path")
 
+    parser.add_argument(
+        "--output-format",
+        help="Format of the output file (default: csv)",
+        choices=sorted(OUTPUT_FORMATS),
+        default="csv",
+        dest="output_format")
+
+    parser.add_argument(
+        "--partition",
+        help=("Write a file per category and indicator, or per category, "
+              "indicator and frequency, to the --output directory"),
+        choices=sorted(PARTITION_FIELDS),
+        default=None,
+        dest="partition")
+
+    parser.add_argument(
+        "--compress",
+        help=("Compress the output as it is written (default: by the "
+              "suffix of --output, .gz, .xz or .bz2)"),
+        choices=sorted(COMPRESSIONS),
+        default=None,
+        dest="compress")
+
+    parser.add_argument(
+        "--compress-level",
+        help="Compression level, gzip and bz2 1-9, xz 0-9",
+        type=int,
+        default=None,
+        dest="compress_level")
+
+    parser.add_argument(
+        "--compress-buffer",
+        help="Bytes of output gathered before they are compressed",
+        type=positive_int,
+        default=None,
+        dest="compress_buffer")
+
+    parser.add_argument(
+        "-j", "--jobs",
+        help="Number of tables to download and filter concurrently",
+        type=positive_int,
+        default=None,
+        dest="jobs")
+
+    parser.add_argument(
+        "--chunk-size",
+        help="Size in bytes of the chunks used when downloading tables",
+        type=positive_int,
+        default=None,
+        dest="chunk_size")
+
+    parser.add_argument(
+        "--no-cache",
+        help="Always download tables, ignoring the download cache",
+        action="store_false",
+        dest="use_cache")
+
+    parser.add_argument(
+        "--no-extract",
+        help="Read data CSVs straight out of the zip instead of extracting",
+        action="store_false",
+        dest="extract")
+
+    # Filter Engines
+    engines = parser.add_mutually_exclusive_group()
+    engines.add_argument(
+        "--columnar",
+        help="Filter tables with the NumPy columnar engine",
+        action="store_true")
+
+    engines.add_argument(
+        "--index",
+        help="Filter extracted tables through persisted dimension indexes",
+        action="store_true")
+
+    engines.add_argument(
+        "--mmap",
+        help="Memory map extracted tables, only parsing candidate lines",
+        action="store_true")
+
+    engines.add_argument(
+        "--processes",
+        help="Number of processes filtering each large extracted table",
+        type=positive_int,
+        default=None,
+        dest="processes")
+
+    parser.add_argument(
+        "--since",
+        help="Only keep data of this date (YYYY, YYYY-mm or YYYY-mm-DD) "
+             "and later",
+        type=ref_date,
+        default=None,
+        dest="since")
+
+    parser.add_argument(
+        "--until",
+        help="Only keep data of this date (YYYY, YYYY-mm or YYYY-mm-DD) "
+             "and earlier",
+        type=ref_date,
+        default=None,
+        dest="until")
+
+    parser.add_argument(
+        "--incremental",
+        help="Only fetch the series StatsCan changed since the last run",
+        action="store_true")
+
+    parser.add_argument(
+        "--delta-dir",
+        help="Read changed series from saved WDS responses in a directory",
+        type=str,
+        default=None,
+        dest="delta_dir")
+
+    parser.add_argument(
+        "--comp-dir-budget",
+        help="Bytes the compression directory may use before old zips "
+             "are evicted",
+        type=positive_int,
+        default=None,
+        dest="budget")
+
     # Database Related
     parser.add_argument(
         "-d", "--db-name",
@@ -146,10 +293,23 @@ def parse_args(args: List[str]) -> argparse.Namespace:
         default=None,
         dest="db_port")
 
-    return parser.parse_args(args=args)
-
-
-def prepare_filter(table, ctx):
+    options = parser.parse_args(args=args)
+    if options.incremental and (
+            options.columnar or options.index or options.mmap or
+            options.processes is not None):
+        # Full pulls observe every row of a single pass over the table.
+        parser.error("--incremental cannot be used with --columnar, "
+                     "--index, --mmap or --processes")
+    try:
+        output_compression(
+            options.output_path, options.output_format, options.partition,
+            options.compress, options.compress_level, options.compress_buffer)
+    except ValueError as e:
+        parser.error(str(e))
+    return options
+
+
+def prepare_filter(table, ctx, date_range: DateRange = None):
     table_filter_cls = {
         "gdp": GDPFilter,
         "consumption": ConsumptionFilter,
@@ -164,58 +324,283 @@ def prepare_filter(table, ctx):
     }.get(table.data_filter)
     if table_filter_cls is None:
         return None
+    if ctx.data_csv_path is not None:
+        csv_path, zip_member = ctx.data_csv_path, None
+    else:
+        csv_path, zip_member = ctx.zip_filepath, ctx.data_csv_member
     table_filter = table_filter_cls(
-        csv_path=ctx.data_csv_path,
+        csv_path=csv_path,
         category=table.category,
         indicator=table.indicator,
         frequency=table.frequency)
+    table_filter.zip_member = zip_member
+    table_filter.source_hash = ctx.zip_sha256
+    table_filter.vectors = table.vectors
+    table_filter.date_range = date_range
     return table_filter
 
 
-def dump_rows_to_csv(outpath, rows):
-    keys = list(rows[0].keys())
-    logger.debug("Dumping output to csv file %s", outpath)
-    with open(outpath, "w") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=keys)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
-        logger.debug("> Done")
+def load_metadata(ctx) -> TableMetadata:
+    """Load the MetaData CSV of a downloaded table, if it has one."""
+    if ctx.meta_csv_path is not None:
+        meta_path, meta_member = ctx.meta_csv_path, None
+    elif ctx.meta_csv_member is not None:
+        meta_path, meta_member = ctx.zip_filepath, ctx.meta_csv_member
+    else:
+        return None
+    try:
+        return TableMetadata.Load(meta_path, meta_member)
+    except (OSError, ValueError, csv.Error) as e:
+        logger.warning("Failed to read metadata of %s: %s", ctx.name, str(e))
+        return None
 
 
-def main(*argv):
-    """Gathernomics Main Function."""
-    options = parse_args(argv)
-    init_logging(options)
-    init_db_connection(options)
-    config = GathernomicsConfig(options.config_path)
-    downloader = StatsCanTableDownloader()
-    tables_data = config.GetTablesData()
-    rows = []
-    for table_data in tables_data:
+def load_tables(config: GathernomicsConfig) -> List[TableDescriptor]:
+    tables = []
+    for table_data in config.GetTablesData():
         table = TableDescriptor.CreateFromDict(table_data)
         if table is None:
             continue
         if not table.enabled:
             logger.debug("Skipping disabled table %s", table.name)
             continue
-        ctx = downloader.DownloadTable(table)
-        if ctx is None:
-            logger.debug("Failed to load, skipping")
-            continue
-        table_filter = prepare_filter(table, ctx)
+        tables.append(table)
+    return tables
+
+
+def ingest_group(downloader: StatsCanTableDownloader,
+                 group: TableGroup, observer=None, engine=None,
+                 selectivity: SelectivityStats = None,
+                 date_range: DateRange = None, emit=None) -> List[list]:
+    """Download a Source Table Once and Run All of Its Filters.
+
+    If given, `observer' is called with every row of the data CSV and the
+    rows it produced for each table of the group (None where the table's
+    filter rejected it).  `engine' runs the filters when there is no
+    observer, see make_engine.  `selectivity' keeps the rejection rates
+    of the filters' checks between runs.  If given, only the rows within
+    `date_range' are kept.
+
+    If given, `emit' is called with the index of a table of the group and
+    a FactFrame of its rows, as they are produced, and the rows returned
+    are empty.
+
+    Raises DownloadError if the source table cannot be downloaded.
+    """
+    ctx = downloader.DownloadTable(group)
+    if ctx is None:
+        raise DownloadError("Failed to download {}".format(group.name))
+    try:
+        return filter_group(
+            ctx, group, observer, engine, selectivity, date_range, emit)
+    finally:
+        downloader.Release(ctx)
+
+
+def filter_group(ctx, group: TableGroup, observer=None, engine=None,
+                 selectivity: SelectivityStats = None,
+                 date_range: DateRange = None, emit=None) -> List[list]:
+    results = [[] for _ in group.tables]
+    metadata = load_metadata(ctx)
+    table_filters = []
+    for table in group.tables:
+        table_filter = prepare_filter(table, ctx, date_range)
         if table_filter is None:
             logger.warning(
                 "Cannot filter table %s, no filter for %s",
                 table.name, table.data_filter)
-            continue
-        table_rows = list(table_filter)
-        rows.extend(table_rows)
-    logger.debug("Total rows %d", len(rows))
+        else:
+            table_filter.metadata = metadata
+            if selectivity is not None:
+                table_filter.selectivity = selectivity.Get(table_filter)
+        table_filters.append(table_filter)
+    active_filters = [table_filter for table_filter in table_filters
+                      if table_filter is not None]
+    active_indices = [i for i, table_filter in enumerate(table_filters)
+                      if table_filter is not None]
+
+    def observe(row, facts):
+        group_facts = [None] * len(group.tables)
+        for i, fact in zip(active_indices, facts):
+            group_facts[i] = fact
+        observer(row, group_facts)
+
+    if engine is not None and observer is None:
+        filtered_rows = engine(active_filters)
+    else:
+        scan = ScanEngine(
+            active_filters,
+            observer=observe if observer is not None else None)
+        if emit is not None:
+            # Hand over the rows of every table as the scan produces them.
+            for j, rows in scan.Batches(DEFAULT_WRITE_BATCH_ROWS):
+                emit(active_indices[j], FactFrame.FromFacts(rows))
+            if selectivity is not None:
+                for table_filter in active_filters:
+                    selectivity.Put(table_filter)
+            return results
+        filtered_rows = scan.Streams()
+    for i, table_filter, rows in zip(
+            active_indices, active_filters, filtered_rows):
+        if emit is None:
+            results[i] = list(rows)
+        else:
+            for frame in iter_frames(rows, DEFAULT_WRITE_BATCH_ROWS):
+                emit(i, frame)
+        if selectivity is not None:
+            selectivity.Put(table_filter)
+    return results
+
+
+def make_engine(options: argparse.Namespace, executor=None):
+    """Make Scan Engine.
+
+    Returns the scan engine selected by the options, as a function taking
+    the filters of a group and returning their rows, or None for the
+    default ScanEngine.  `executor' is the process pool of parallel scans.
+    The engine options are exclusive, see parse_args.
+    """
+    if executor is not None:
+        return lambda filters: ParallelScanEngine(
+            filters, executor=executor).Run()
+    if options.index:
+        return lambda filters: IndexedScanEngine(filters).Run()
+    if options.columnar:
+        if columnar_available():
+            return lambda filters: ColumnarScanEngine(filters).Run()
+        logger.warning("NumPy is not installed, not using columnar engine")
+    if options.mmap:
+        return lambda filters: MmapScanEngine(filters).Run()
+    return None
+
+
+def ingest_tables(options: argparse.Namespace,
+                  downloader: StatsCanTableDownloader,
+                  tables: List[TableDescriptor], jobs: int,
+                  writer: RowWriter = None) -> Tuple[int, List[str]]:
+    processes = coalese(options.processes, 1)
+    if processes > 1:
+        with process_pool(processes) as executor:
+            return ingest_groups(
+                options, downloader, tables, jobs,
+                make_engine(options, executor), writer)
+    return ingest_groups(
+        options, downloader, tables, jobs, make_engine(options), writer)
+
+
+def ingest_groups(options: argparse.Namespace,
+                  downloader: StatsCanTableDownloader,
+                  tables: List[TableDescriptor], jobs: int,
+                  engine=None,
+                  writer: RowWriter = None) -> Tuple[int, List[str]]:
+    """Ingest Tables.
+
+    Streams the rows of the tables to `writer', if given, in config order
+    so the output is deterministic.  Returns the number of rows and the
+    names of the tables which failed, none of whose rows are written.
+    Raises IncompleteTableError if a table fails after some of its rows
+    were written.
+    """
+    logger.debug("Ingesting %d tables with %d jobs", len(tables), jobs)
+    groups = plan_tables(tables)
+    selectivity = SelectivityStats()
+    date_range = None
+    if options.since is not None or options.until is not None:
+        date_range = DateRange(options.since, options.until)
+    ingestor = None
+    if options.incremental:
+        if options.delta_dir is not None:
+            source = LocalDeltaSource(options.delta_dir)
+        else:
+            source = StatsCanDeltaSource(downloader.http)
+        ingestor = IncrementalIngestor(
+            source, DeltaState(), lambda table: prepare_filter(
+                table, downloader.Context(table.name, table.url), date_range),
+            date_range)
+    positions = {id(table): i for i, table in enumerate(tables)}
+    pipeline = RowPipeline(len(tables))
+    failed = set()
+
+    def ingest(group: TableGroup):
+        indices = [positions[id(table)] for table in group.tables]
+        try:
+            if ingestor is not None:
+                group_rows = ingestor.IngestGroup(group, partial(
+                    ingest_group, downloader, group, engine=engine,
+                    selectivity=selectivity, date_range=date_range))
+                for i, rows in zip(indices, group_rows):
+                    for frame in iter_frames(rows, DEFAULT_WRITE_BATCH_ROWS):
+                        pipeline.Put(i, frame)
+            else:
+                ingest_group(
+                    downloader, group, engine=engine,
+                    selectivity=selectivity, date_range=date_range,
+                    emit=lambda j, frame: pipeline.Put(indices[j], frame))
+        except Exception as e:
+            logger.error(
+                "Failed to ingest tables %s: %s",
+                ", ".join(table.name for table in group.tables), str(e))
+            failed.update(id(table) for table in group.tables)
+            for i in indices:
+                pipeline.Fail(i)
+        finally:
+            for i in indices:
+                pipeline.Finish(i)
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(ingest, group) for group in groups]
+        try:
+            for frame in pipeline.Batches():
+                if writer is not None:
+                    writer.WriteFrame(frame)
+                count += len(frame)
+        except IncompleteTableError as e:
+            logger.error("Table %s failed after some of its rows were "
+                         "written", tables[e.index].name)
+            raise
+        finally:
+            # Release producers still waiting if the writer failed.
+            pipeline.Close()
+        for future in futures:
+            # Raises whatever escaped a producer, rather than losing it.
+            future.result()
+    return count, [table.name for table in tables if id(table) in failed]
 
-    if options.output_path is not None:
-        dump_rows_to_csv(options.output_path, rows)
 
+def main(*argv):
+    """Gathernomics Main Function."""
+    options = parse_args(argv)
+    init_logging(options)
+    init_db_connection(options)
+    config = GathernomicsConfig(options.config_path)
+    jobs = coalese(options.jobs, DEFAULT_JOBS)
+    cache = DownloadCache() if options.use_cache else None
+    downloader = StatsCanTableDownloader(
+        chunk_size=options.chunk_size, cache=cache, extract=options.extract,
+        pool_size=max(jobs, DEFAULT_POOL_SIZE), budget=options.budget)
+    tables = load_tables(config)
+    writer = make_writer(options.output_path, options.output_format,
+                         options.partition, max(jobs, DEFAULT_WRITERS),
+                         options.compress, options.compress_level,
+                         options.compress_buffer)
+    try:
+        with downloader:
+            count, failed = ingest_tables(
+                options, downloader, tables, jobs, writer)
+    except IncompleteTableError:
+        if writer is not None:
+            logger.error("Removing incomplete output %s", writer.output_path)
+            writer.Abort()
+        return 1
+    finally:
+        if writer is not None:
+            writer.Close()
+    logger.debug("Total rows %d", count)
+    if failed:
+        logger.error("Failed to ingest %d of %d tables: %s",
+                     len(failed), len(tables), ", ".join(failed))
+        return 1
     return 0
 
 
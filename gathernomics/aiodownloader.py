@@ -0,0 +1,358 @@
+"""Gathernomics - Asynchronous Data Downloader.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import asyncio
+import http.client
+import io
+import logging
+import os.path as path
+import ssl
+from urllib.parse import urljoin, urlsplit
+
+from gathernomics.defaults import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_RESUME_ATTEMPTS)
+from gathernomics.downloader import (
+    CorruptCacheError, IncompleteDownloadError, StatsCanTableDownloader)
+from gathernomics.models.sourcetbl import SourceTableType
+from gathernomics.utils import coalese, tryint
+
+logger = logging.getLogger(name=__name__)
+
+MAX_REDIRECTS = 5
+
+
+class AsyncHttpError(Exception):
+    pass
+
+
+class AsyncHttpResponse(object):
+    """Response of a single HTTP/1.1 request.
+
+    The body is read on demand, either in full with `read' or in chunks
+    with `stream'.  The connection is not reused and must be closed.
+    """
+    def __init__(self, status: int, headers: http.client.HTTPMessage,
+                 reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 has_body: bool = True):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        encoding = coalese(headers.get("Transfer-Encoding"), "").lower()
+        self._chunked = has_body and "chunked" in encoding
+        if not has_body:
+            self._remaining = 0
+        elif self._chunked:
+            self._remaining = None
+        else:
+            length = headers.get("Content-Length")
+            self._remaining = tryint(length) if length is not None else None
+
+    async def readBlock(self, size: int) -> bytes:
+        return await asyncio.wait_for(
+            self._reader.read(size), DEFAULT_READ_TIMEOUT)
+
+    async def readChunks(self, chunk_size: int):
+        while True:
+            line = await asyncio.wait_for(
+                self._reader.readline(), DEFAULT_READ_TIMEOUT)
+            size = int(line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                # Skip the trailers.
+                while line not in (b"\r\n", b"\n", b""):
+                    line = await asyncio.wait_for(
+                        self._reader.readline(), DEFAULT_READ_TIMEOUT)
+                return
+            while size > 0:
+                chunk = await self.readBlock(min(size, chunk_size))
+                if not chunk:
+                    raise AsyncHttpError("Connection closed mid chunk")
+                size -= len(chunk)
+                yield chunk
+            await asyncio.wait_for(
+                self._reader.readline(), DEFAULT_READ_TIMEOUT)
+
+    async def stream(self, chunk_size: int):
+        """Yield the body in chunks of at most `chunk_size' bytes.
+
+        Raises AsyncHttpError if the connection closes before the
+        Content-Length of the body was received.
+        """
+        if self._chunked:
+            async for chunk in self.readChunks(chunk_size):
+                yield chunk
+            return
+        while self._remaining is None or self._remaining > 0:
+            size = chunk_size
+            if self._remaining is not None:
+                size = min(size, self._remaining)
+            chunk = await self.readBlock(size)
+            if not chunk:
+                if self._remaining is None:
+                    return  # The body runs to the end of the connection.
+                raise AsyncHttpError(
+                    "Connection closed {} bytes before the end of the "
+                    "body".format(self._remaining))
+            if self._remaining is not None:
+                self._remaining -= len(chunk)
+            yield chunk
+
+    async def read(self) -> bytes:
+        body = bytearray()
+        async for chunk in self.stream(65536):
+            body.extend(chunk)
+        return bytes(body)
+
+    def close(self):
+        self._writer.close()
+
+
+async def open_request(method: str, url: str, headers: dict = None,
+                       redirects: int = MAX_REDIRECTS) -> AsyncHttpResponse:
+    """Send a Request and Read the Response Head.
+
+    Uses a new connection for every request, which the server is asked to
+    close.  Redirects are followed up to `redirects' times.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise AsyncHttpError("Unsupported URL {}".format(url))
+    https = parts.scheme == "https"
+    port = coalese(parts.port, 443 if https else 80)
+    target = coalese(parts.path, "") or "/"
+    if parts.query:
+        target = "{}?{}".format(target, parts.query)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(
+            parts.hostname, port,
+            ssl=ssl.create_default_context() if https else None),
+        DEFAULT_CONNECT_TIMEOUT)
+    try:
+        request_headers = {
+            "Host": parts.netloc,
+            "User-Agent": "gathernomics",
+            "Accept-Encoding": "identity",
+            "Connection": "close"
+        }
+        request_headers.update(coalese(headers, {}))
+        lines = ["{} {} HTTP/1.1".format(method, target)]
+        lines.extend("{}: {}".format(key, value)
+                     for key, value in request_headers.items())
+        writer.write("{}\r\n\r\n".format("\r\n".join(lines)).encode("latin-1"))
+        await asyncio.wait_for(writer.drain(), DEFAULT_READ_TIMEOUT)
+        head = await asyncio.wait_for(
+            reader.readuntil(b"\r\n\r\n"), DEFAULT_READ_TIMEOUT)
+    except BaseException:
+        writer.close()
+        raise
+    status_line, _, header_block = head.partition(b"\r\n")
+    status_parts = status_line.decode("latin-1").split(None, 2)
+    if len(status_parts) < 2 or not status_parts[0].startswith("HTTP/"):
+        writer.close()
+        raise AsyncHttpError("Malformed status line {!r}".format(status_line))
+    status = tryint(status_parts[1])
+    response_headers = http.client.parse_headers(io.BytesIO(header_block))
+    has_body = (method != "HEAD" and status not in (204, 304) and
+                not 100 <= status < 200)
+    response = AsyncHttpResponse(
+        status, response_headers, reader, writer, has_body)
+    location = response_headers.get("Location")
+    if status in (301, 302, 303, 307, 308) and location is not None:
+        response.close()
+        if redirects <= 0:
+            raise AsyncHttpError("Too many redirects for {}".format(url))
+        logger.debug("> Redirected to %s", location)
+        return await open_request(
+            method, urljoin(url, location), headers, redirects - 1)
+    return response
+
+
+class AsyncStatsCanTableDownloader(StatsCanTableDownloader):
+    """StatsCan Table Downloader for asyncio.
+
+    Downloads tables concurrently on a single event loop instead of a
+    thread per table, sharing the compression directory, download cache
+    and resume logic of StatsCanTableDownloader.  At most `concurrency'
+    requests are in flight at once, each on a connection of its own, so
+    the connection pool of StatsCanTableDownloader is never made.  All
+    file work (the partial download and its sidecar, the cache, the
+    compression directory and extraction) runs in the loop's default
+    executor, never on the loop itself.
+    """
+    def __init__(self, *args, concurrency: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._concurrency = coalese(concurrency, DEFAULT_POOL_SIZE)
+        self._semaphore = None
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created on first use, so it belongs to the running loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.runBlocking(self.Cleanup)
+
+    @staticmethod
+    async def runBlocking(func, *args):
+        """Run a function doing file work in the default executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    def acquireParts(self, part_files: tuple):
+        for file_path in part_files:
+            self.storage.Acquire(file_path)
+
+    def releaseParts(self, part_files: tuple):
+        for file_path in part_files:
+            self.storage.Release(file_path)
+
+    async def downloadZipFileAsync(self, ctx) -> str:
+        zip_path = await self.runBlocking(self.zipPath, ctx)
+        part_path = self.partPath(ctx)
+        entry = None
+        if self.cache is not None:
+            entry = await self.runBlocking(self.cache.Get, ctx.url)
+        logger.debug(
+            "Downloading StatsCan table from %s", ctx.url)
+        part_files = (part_path, "{}.json".format(part_path))
+        await self.runBlocking(self.acquireParts, part_files)
+        try:
+            return await self.downloadWithResumeAsync(
+                ctx, entry, zip_path, part_path)
+        finally:
+            await self.runBlocking(self.releaseParts, part_files)
+
+    async def downloadWithResumeAsync(self, ctx, entry, zip_path: str,
+                                      part_path: str) -> str:
+        for attempt in range(1, DEFAULT_RESUME_ATTEMPTS + 1):
+            headers, offset = await self.runBlocking(
+                self.requestHeaders, ctx, entry, part_path)
+            try:
+                async with self.semaphore:
+                    response = await open_request("GET", ctx.url, headers)
+                    try:
+                        return await self.saveResponseAsync(
+                            ctx, response, entry, zip_path, part_path, offset)
+                    finally:
+                        response.close()
+            except CorruptCacheError:
+                entry = None
+            except (OSError, asyncio.TimeoutError, AsyncHttpError,
+                    asyncio.IncompleteReadError,
+                    IncompleteDownloadError) as e:
+                logger.warning(
+                    "> Download of table %s interrupted (attempt %d/%d): %s",
+                    ctx.name, attempt, DEFAULT_RESUME_ATTEMPTS, str(e))
+        logger.warning("> Giving up on table %s", ctx.name)
+        return None
+
+    async def saveResponseAsync(self, ctx, response, entry, zip_path: str,
+                                part_path: str, offset: int) -> str:
+        if response.status == 304 and entry is not None:
+            return await self.runBlocking(self.useCachedZip, ctx, entry)
+        expected = await self.runBlocking(
+            self.checkResponse,
+            ctx, response.status, response.headers, offset, part_path)
+        if expected is None:
+            return None
+        offset, total_length = expected
+        sha256 = await self.runBlocking(
+            self.beginPart,
+            ctx, response.headers, part_path, offset, total_length)
+        zip_size = offset
+        part_file = await self.runBlocking(
+            open, part_path, "ab" if offset > 0 else "wb")
+        try:
+            async for chunk in response.stream(self.chunk_size):
+                await self.runBlocking(
+                    self.writeChunk, part_file, sha256, chunk)
+                zip_size += len(chunk)
+        finally:
+            await self.runBlocking(part_file.close)
+        logger.debug("> Done downloading")
+        return await self.runBlocking(
+            self.finishPart,
+            ctx, response.headers, sha256, zip_size, total_length,
+            zip_path, part_path)
+
+    @staticmethod
+    def writeChunk(part_file, sha256, chunk: bytes):
+        sha256.update(chunk)
+        part_file.write(chunk)
+
+    async def Head(self, url: str) -> http.client.HTTPMessage:
+        """Headers of a URL, or None if the request failed."""
+        try:
+            async with self.semaphore:
+                response = await open_request("HEAD", url)
+                response.close()
+        except (OSError, asyncio.TimeoutError, AsyncHttpError) as e:
+            logger.warning("HEAD request to %s failed: %s", url, str(e))
+            return None
+        if response.status != 200:
+            logger.warning(
+                "HEAD request to %s failed (HTTP %d)", url, response.status)
+            return None
+        return response.headers
+
+    async def IsModified(self, table_descriptor) -> bool:
+        """Whether a table changed since it was last downloaded.
+
+        Compares the validators of the cached download with those the
+        server reports.  Tables without a cached download, or whose
+        server gave no validators, count as modified.
+        """
+        entry = None
+        if self.cache is not None:
+            entry = await self.runBlocking(
+                self.cache.Get, table_descriptor.url)
+        if entry is None:
+            return True
+        headers = await self.Head(table_descriptor.url)
+        if headers is None:
+            return True
+        etag = headers.get("ETag")
+        if etag is not None and entry.etag is not None:
+            return etag != entry.etag
+        last_modified = headers.get("Last-Modified")
+        if last_modified is not None and entry.last_modified is not None:
+            return last_modified != entry.last_modified
+        length = tryint(coalese(headers.get("Content-Length"), "0"))
+        return length == 0 or length != entry.size
+
+    async def DownloadTable(self, table_descriptor):
+        if table_descriptor.source != SourceTableType.STATSCAN:
+            logger.debug(
+                "Cannot download %s using AsyncStatsCanTableDownloader",
+                table_descriptor.name)
+            return None
+        ctx = self.Context(table_descriptor.name, table_descriptor.url)
+        self._contexts.append(ctx)
+        zip_file = await self.downloadZipFileAsync(ctx)
+        if zip_file is None or not await self.runBlocking(
+                path.isfile, zip_file):
+            await self.runBlocking(self.Release, ctx)
+            return None
+        if self.extract:
+            data_path, _ = await self.runBlocking(self.extractZipFile, ctx)
+        else:
+            data_path, _ = await self.runBlocking(self.openZipFile, ctx)
+        if data_path is None:
+            await self.runBlocking(self.Release, ctx)
+            return None
+        return ctx
@@ -0,0 +1,169 @@
+"""Gathernomics - Download Cache.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import hashlib
+import json
+import logging
+import os
+import os.path as path
+import threading
+
+from gathernomics.defaults import DEFAULT_CACHE_PATH, DEFAULT_CHUNK_SIZE
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name=__name__)
+
+CACHE_VERSION = 1
+
+
+class DownloadCache(object):
+    """Download Cache.
+
+    Remembers the HTTP validators (ETag and Last-Modified) and content
+    hash of every table zip downloaded, keyed by URL, so that later runs
+    can make conditional requests and reuse the local zip when StatsCan
+    has not republished the table.
+    """
+
+    class Entry(object):
+        def __init__(self, url: str, zip_filepath: str, size: int,
+                     sha256: str, etag: str = None,
+                     last_modified: str = None):
+            self.url = url
+            self.zip_filepath = zip_filepath
+            self.size = size
+            self.sha256 = sha256
+            self.etag = etag
+            self.last_modified = last_modified
+
+        def ToDict(self) -> dict:
+            return {
+                "zip_filepath": self.zip_filepath,
+                "size": self.size,
+                "sha256": self.sha256,
+                "etag": self.etag,
+                "last_modified": self.last_modified
+            }
+
+        @classmethod
+        def FromDict(cls, url: str, entry_data: dict):
+            if not isinstance(entry_data, dict):
+                return None
+            zip_filepath = entry_data.get("zip_filepath")
+            size = entry_data.get("size")
+            sha256 = entry_data.get("sha256")
+            if (not isinstance(zip_filepath, str) or
+                    not isinstance(size, int) or
+                    not isinstance(sha256, str)):
+                return None
+            return cls(
+                url=url,
+                zip_filepath=zip_filepath,
+                size=size,
+                sha256=sha256,
+                etag=entry_data.get("etag"),
+                last_modified=entry_data.get("last_modified"))
+
+        def ConditionalHeaders(self) -> dict:
+            headers = {}
+            if self.etag is not None:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified is not None:
+                headers["If-Modified-Since"] = self.last_modified
+            return headers
+
+    def __init__(self, cache_path: str = None):
+        self._cache_path = coalese(cache_path, DEFAULT_CACHE_PATH)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.load()
+
+    @property
+    def cache_path(self) -> str:
+        return self._cache_path
+
+    def load(self):
+        if not path.isfile(self.cache_path):
+            logger.debug("No download cache found at %s", self.cache_path)
+            return
+        logger.debug("Loading download cache: %s", self.cache_path)
+        with open(self.cache_path) as f:
+            try:
+                data = json.load(f)
+            except json.decoder.JSONDecodeError:
+                logger.warning(
+                    "Download cache %s is not a json file", self.cache_path)
+                return
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            logger.debug("> Ignoring cache with unknown version")
+            return
+        entries_data = data.get("entries")
+        if not isinstance(entries_data, dict):
+            return
+        for url, entry_data in entries_data.items():
+            entry = self.Entry.FromDict(url, entry_data)
+            if entry is not None:
+                self._entries[url] = entry
+        logger.debug("> Loaded %d cache entries", len(self._entries))
+
+    def save(self):
+        data = {
+            "version": CACHE_VERSION,
+            "entries": {url: entry.ToDict()
+                        for url, entry in self._entries.items()}
+        }
+        cache_dir = path.dirname(self.cache_path)
+        if cache_dir and not path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # Write then rename, so a crash never leaves a truncated index.
+        temp_path = "{}.tmp".format(self.cache_path)
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, self.cache_path)
+
+    def Get(self, url: str):
+        """Get the Cache Entry of a URL.
+
+        Returns None if the URL was never downloaded or if its zip file is
+        no longer on disk.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None:
+            return None
+        if (not path.isfile(entry.zip_filepath) or
+                path.getsize(entry.zip_filepath) != entry.size):
+            logger.debug("> Cached zip for %s is missing or changed", url)
+            return None
+        return entry
+
+    @staticmethod
+    def Verify(entry) -> bool:
+        """Whether the zip of an entry still has the SHA-256 recorded."""
+        sha256 = hashlib.sha256()
+        try:
+            with open(entry.zip_filepath, "rb") as f:
+                for chunk in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+        except OSError:
+            return False
+        return sha256.hexdigest() == entry.sha256
+
+    def Contains(self, zip_filepath: str) -> bool:
+        """Whether a zip file is the cached copy of some URL."""
+        with self._lock:
+            return any(entry.zip_filepath == zip_filepath
+                       for entry in self._entries.values())
+
+    def Put(self, entry):
+        with self._lock:
+            self._entries[entry.url] = entry
+            self.save()
+
+    def Remove(self, url: str):
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self.save()
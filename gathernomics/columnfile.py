@@ -0,0 +1,84 @@
+"""Gathernomics - Columnar Output File.
+
+Layout of the binary columnar output, and reading it back.
+
+A file starts with the 8 byte MAGIC, the length of the header as a little
+endian uint32 and the header, JSON padded with spaces so the first column
+is aligned.  The columns follow, each little endian and starting on a
+multiple of ALIGNMENT bytes:
+
+    value      <i8      CAD value of the datum
+    date       <M8[D]   Days since 1970-01-01, NaT for facts without one
+    indicator  <u2/<u4  Codes of the header's indicator dictionary
+    category   <u2/<u4  Codes of the header's category dictionary
+    frequency  <u2/<u4  Codes of the header's frequency dictionary
+
+Rows are grouped by series, a distinct (category, indicator, frequency),
+and the header's series table gives the first row and number of rows of
+each, so a single series can be memory-mapped without the rest.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import json
+import struct
+from typing import Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"GTHRCOL1"
+VERSION = 1
+ALIGNMENT = 64
+HEADER_LENGTH = struct.Struct("<I")
+# Day ordinal (`date.toordinal') of the epoch of the date column.
+EPOCH_ORDINAL = 719163
+# numpy's NaT in the date column.
+NO_DATE = -2 ** 63
+
+
+def align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def read_header(path: str) -> Tuple[dict, int]:
+    """Header of a columnar file and the offset of its first column."""
+    with open(path, "rb") as file:
+        magic = file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("{} is not a columnar output file".format(path))
+        length, = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+        header = json.loads(file.read(length).decode("utf-8"))
+    if header["version"] != VERSION:
+        raise ValueError("Unsupported columnar output version {}".format(
+            header["version"]))
+    return header, len(MAGIC) + HEADER_LENGTH.size + length
+
+
+def load_columns(path: str, series: int = None) -> dict:
+    """Load Columns.
+
+    Memory-maps the columns of a columnar file as numpy arrays, only the
+    rows of the `series'th entry of the series table if given.  Requires
+    numpy.
+    """
+    if numpy is None:
+        raise RuntimeError("Loading columnar output requires numpy")
+    header, _ = read_header(path)
+    start, rows = 0, header["rows"]
+    if series is not None:
+        start = header["series"][series]["start"]
+        rows = header["series"][series]["rows"]
+    columns = {}
+    for name, column in header["columns"].items():
+        dtype = numpy.dtype(column["dtype"])
+        if rows == 0:
+            columns[name] = numpy.empty(0, dtype=dtype)
+            continue
+        columns[name] = numpy.memmap(
+            path, dtype=dtype, mode="r", shape=(rows,),
+            offset=column["offset"] + start * dtype.itemsize)
+    return columns
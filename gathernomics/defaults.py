@@ -12,6 +12,26 @@ import tempfile
 DEFAULT_TEMP_DIR = path.join(tempfile.gettempdir(), "gathernomics")
 # Default location for zip files.
 DEFAULT_COMP_DIR = path.join(DEFAULT_TEMP_DIR, "zips")
+# Bytes the compression directory may use before old entries are evicted.
+DEFAULT_COMP_DIR_BUDGET = 2 * 1024 * 1024 * 1024
+# Download cache index, kept next to the zip files it describes.
+DEFAULT_CACHE_PATH = path.join(DEFAULT_TEMP_DIR, "cache.json")
+# Size of the chunks read from the network while downloading tables.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# Connections kept open per host by the downloader's connection pool.
+DEFAULT_POOL_SIZE = 4
+# Seconds to wait when connecting to, and reading from, StatsCan.
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 60.0
+# Attempts made by the connection pool before a request fails.
+DEFAULT_RETRIES = 3
+# Attempts made to finish an interrupted table download.
+DEFAULT_RESUME_ATTEMPTS = 5
+# StatsCan Web Data Service, which publishes the daily changed series.
+DEFAULT_WDS_URL = "https://www150.statcan.gc.ca/t1/wds/rest"
+# Snapshots of the previous run used by incremental ingestion, one file
+# per table.
+DEFAULT_DELTA_STATE_DIR = path.join(DEFAULT_TEMP_DIR, "delta")
 # Standard location for configuration data should be in the user's current
 # working directory.
 DEFAULT_CONFIG_PATH = path.join(os.getcwd(), "config.json")
@@ -19,3 +39,35 @@ DEFAULT_CONFIG_PATH = path.join(os.getcwd(), "config.json")
 DEFAULT_DATEBASE_NAME = "CanDevFinaceCanada"
 
 DEFAULT_TABLE_ENABLED = False
+
+# Number of tables ingested concurrently by default.
+DEFAULT_JOBS = 1
+
+# Lines loaded at once by the columnar filter engine.
+DEFAULT_COLUMNAR_BATCH_ROWS = 4096
+
+# Bytes of a data CSV filtered by each task of a parallel scan.
+DEFAULT_PARALLEL_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Persisted dimension indexes of extracted data CSVs.
+DEFAULT_INDEX_DIR = path.join(DEFAULT_TEMP_DIR, "index")
+# Columns with more distinct values than this are not indexed.
+DEFAULT_INDEX_MAX_VALUES = 4096
+
+# Rows sampled to measure how often each check of a filter rejects a row.
+DEFAULT_SELECTIVITY_SAMPLE_ROWS = 1000
+# Rejection rates of filter checks measured by earlier runs.
+DEFAULT_SELECTIVITY_PATH = path.join(DEFAULT_TEMP_DIR, "selectivity.json")
+
+# Output rows handed to the writer at once.
+DEFAULT_WRITE_BATCH_ROWS = 1024
+# Batches of output rows each table holds in memory before they spill.
+DEFAULT_PIPELINE_BATCHES = 16
+# Threads writing the partitions of partitioned output.
+DEFAULT_WRITERS = 4
+# Bytes of output gathered before they are compressed.
+DEFAULT_COMPRESS_BUFFER_SIZE = 1024 * 1024
+# Rows the columnar writer gathers before spilling them to a temporary file.
+DEFAULT_COLUMNAR_BUFFER_ROWS = 64 * 1024
+# Partition files of partitioned output kept open at once.
+DEFAULT_OPEN_PARTITIONS = 32
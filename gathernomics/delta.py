@@ -0,0 +1,548 @@
+"""Gathernomics - Incremental Ingestion from Daily Deltas.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from datetime import date as Date
+from datetime import timedelta as TimeDelta
+import hashlib
+import json
+import logging
+import os
+import os.path as path
+import re
+import threading
+from typing import Dict, List
+
+import urllib3
+
+from gathernomics.defaults import DEFAULT_DELTA_STATE_DIR, DEFAULT_WDS_URL
+from gathernomics.filters.daterange import DateRange
+from gathernomics.models.factor import TemporalFrequency
+from gathernomics.utils import coalese, name_to_filename
+
+logger = logging.getLogger(name=__name__)
+
+STATE_VERSION = 3
+
+PRODUCT_ID_RE = re.compile(r"(\d{8})-[a-z]{3}\.zip$")
+
+VECTOR_KEY = "VECTOR"
+COORDINATE_KEY = "COORDINATE"
+VALUE_KEY = "VALUE"
+SCALAR_KEY = "SCALAR_FACTOR"
+SCALAR_ID_KEY = "SCALAR_ID"
+DATE_KEY = "REF_DATE"
+
+SCALAR_FACTORS = {
+    0: "units",
+    1: "tens",
+    2: "hundreds",
+    3: "thousands",
+    6: "millions",
+    9: "billions",
+    12: "trillions"
+}
+
+# Number of vectors requested from the WDS at once.
+WDS_BATCH_SIZE = 300
+
+
+def product_id_from_url(url: str) -> int:
+    """Product ID of a StatsCan table from its full table download URL."""
+    match = PRODUCT_ID_RE.search(url)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def vector_id(vector: str) -> int:
+    """Vector ID from its CSV form (`v123')."""
+    vector = vector.strip().lower()
+    if vector.startswith("v"):
+        vector = vector[1:]
+    if not vector.isdecimal():
+        return None
+    return int(vector)
+
+
+def normalize_coordinate(coordinate: str) -> str:
+    """Coordinate without the zero padding used by the WDS."""
+    members = coordinate.strip().split(".")
+    while len(members) > 1 and members[-1] == "0":
+        members.pop()
+    return ".".join(members)
+
+
+def release_date(series: dict) -> Date:
+    """Date of a changed series' `releaseTime' (`YYYY-mm-DDTHH:MM')."""
+    release_time = series.get("releaseTime")
+    if not isinstance(release_time, str):
+        return None
+    try:
+        return Date(*map(int, release_time[:10].split("-")))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_wds_response(data) -> list:
+    """Unwrap the `object' of each successful WDS response."""
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        return []
+    objects = []
+    for response in data:
+        if not isinstance(response, dict):
+            continue
+        if response.get("status") != "SUCCESS":
+            logger.debug("> WDS request failed: %s", response.get("object"))
+            continue
+        obj = response.get("object")
+        if isinstance(obj, list):
+            objects.extend(obj)
+        elif obj is not None:
+            objects.append(obj)
+    return objects
+
+
+class DeltaSource(object):
+    """Delta Source.
+
+    Provides the series which changed on a given day and their changed
+    data points, in the shape of StatsCan's Web Data Service responses.
+    """
+    def __init__(self, date: Date = None):
+        self._date = coalese(date, Date.today())
+
+    @property
+    def date(self) -> Date:
+        return self._date
+
+    def fetchChangedSeries(self):
+        raise NotImplementedError("fetchChangedSeries")
+
+    def fetchSeriesData(self, vector_ids: List[int]):
+        raise NotImplementedError("fetchSeriesData")
+
+    def GetChangedSeries(self) -> List[dict]:
+        """Changed Series as dicts of `vectorId', `productId', `coordinate'."""
+        series = []
+        for obj in parse_wds_response(self.fetchChangedSeries()):
+            if obj.get("responseStatusCode", 0) != 0:
+                continue
+            if not isinstance(obj.get("vectorId"), int):
+                continue
+            series.append(obj)
+        return series
+
+    def GetSeriesData(self, vector_ids: List[int]) -> Dict[int, List[dict]]:
+        """Changed Data Points of each vector."""
+        data_points = {}
+        vector_ids = list(vector_ids)
+        for i in range(0, len(vector_ids), WDS_BATCH_SIZE):
+            batch = vector_ids[i:i + WDS_BATCH_SIZE]
+            for obj in parse_wds_response(self.fetchSeriesData(batch)):
+                if not isinstance(obj.get("vectorId"), int):
+                    continue
+                points = obj.get("vectorDataPoint")
+                if not isinstance(points, list):
+                    continue
+                data_points.setdefault(obj["vectorId"], []).extend(points)
+        return data_points
+
+
+class StatsCanDeltaSource(DeltaSource):
+    """StatsCan Web Data Service Delta Source."""
+    def __init__(self, http: urllib3.PoolManager, wds_url: str = None,
+                 date: Date = None):
+        super().__init__(date=date)
+        self._http = http
+        self._wds_url = coalese(wds_url, DEFAULT_WDS_URL)
+
+    def request(self, method: str, endpoint: str, body=None):
+        url = "{}/{}".format(self._wds_url, endpoint)
+        logger.debug("Requesting %s", url)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        response = self._http.request(method, url, body=body, headers=headers)
+        if response.status != 200:
+            logger.warning("> WDS request %s failed (HTTP %d)",
+                           endpoint, response.status)
+            return None
+        try:
+            return json.loads(response.data.decode("utf-8"))
+        except ValueError:
+            logger.warning("> WDS request %s is not json", endpoint)
+            return None
+
+    def fetchChangedSeries(self):
+        return self.request("GET", "getChangedSeriesList")
+
+    def fetchSeriesData(self, vector_ids: List[int]):
+        return self.request(
+            "POST", "getChangedSeriesDataFromVector",
+            body=[{"vectorId": vid} for vid in vector_ids])
+
+
+class LocalDeltaSource(DeltaSource):
+    """Local Delta Source.
+
+    Serves WDS responses saved in a directory, as
+    `getChangedSeriesList.json' and `getChangedSeriesDataFromVector.json'.
+    """
+    def __init__(self, directory: str, date: Date = None):
+        super().__init__(date=date)
+        self._directory = directory
+
+    def load(self, endpoint: str):
+        file_path = path.join(self._directory, "{}.json".format(endpoint))
+        if not path.isfile(file_path):
+            logger.debug("No delta file %s", file_path)
+            return None
+        with open(file_path) as f:
+            try:
+                return json.load(f)
+            except json.decoder.JSONDecodeError:
+                logger.warning("Delta file %s is not a json file", file_path)
+                return None
+
+    def fetchChangedSeries(self):
+        return self.load("getChangedSeriesList")
+
+    def fetchSeriesData(self, vector_ids: List[int]):
+        wanted = set(vector_ids)
+        responses = self.load("getChangedSeriesDataFromVector")
+        if not isinstance(responses, list):
+            return None
+        return [response for response in responses
+                if isinstance(response, dict) and
+                isinstance(response.get("object"), dict) and
+                response["object"].get("vectorId") in wanted]
+
+
+class TableSnapshot(object):
+    """Table Snapshot.
+
+    What incremental ingestion remembers about a table after a run: the
+    coordinate of every vector in the source table, one raw CSV row per
+    vector the filter accepted (used as a template for changed data
+    points), and the rows produced, keyed by vector and reference period.
+    The rows are only those within `date_range', None for every date.
+    """
+    def __init__(self, product_id: int, synced: Date,
+                 vectors: Dict[int, str] = None,
+                 templates: Dict[int, dict] = None,
+                 facts: Dict[tuple, dict] = None,
+                 date_range: DateRange = None):
+        self.product_id = product_id
+        self.synced = synced
+        self.date_range = date_range
+        self.vectors = coalese(vectors, {})
+        self.templates = coalese(templates, {})
+        self.facts = coalese(facts, {})
+
+    def ToDict(self) -> dict:
+        return {
+            "product_id": self.product_id,
+            "synced": self.synced.isoformat(),
+            "date_range": (None if self.date_range is None else
+                           [self.date_range.since, self.date_range.until]),
+            "vectors": {str(vid): coordinate
+                        for vid, coordinate in self.vectors.items()},
+            "templates": {str(vid): row
+                          for vid, row in self.templates.items()},
+            "facts": [[vid, ref_date, fact["value"], fact["indicator"],
+                       fact["category"], fact["date"].isoformat(),
+                       str(fact["frequency"])]
+                      for (vid, ref_date), fact in self.facts.items()]
+        }
+
+    @classmethod
+    def FromDict(cls, snapshot_data: dict):
+        try:
+            facts = {}
+            for (vid, ref_date, value, indicator, category,
+                 date, frequency) in snapshot_data["facts"]:
+                facts[(vid, ref_date)] = {
+                    "value": value,
+                    "indicator": indicator,
+                    "category": category,
+                    "date": Date(*map(int, date.split("-"))),
+                    "frequency": TemporalFrequency.FromString(frequency)
+                }
+            date_range = None
+            if snapshot_data["date_range"] is not None:
+                date_range = DateRange(*snapshot_data["date_range"])
+            return cls(
+                product_id=snapshot_data["product_id"],
+                synced=Date(*map(int, snapshot_data["synced"].split("-"))),
+                vectors={int(vid): coordinate for vid, coordinate
+                         in snapshot_data["vectors"].items()},
+                templates={int(vid): row for vid, row
+                           in snapshot_data["templates"].items()},
+                facts=facts,
+                date_range=date_range)
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def Rows(self) -> list:
+        """Rows ordered by reference period, then by vector."""
+        order = {vid: i for i, vid in enumerate(self.templates)}
+        keys = sorted(self.facts, key=lambda key: (key[1], order[key[0]]))
+        return [self.facts[key] for key in keys]
+
+
+class DeltaState(object):
+    """Delta State.
+
+    Persists the snapshot of every table between runs, each in a file of
+    its own in `state_dir', so storing one table does not rewrite the
+    others.  Snapshots are read as they are first asked for.
+    """
+    def __init__(self, state_dir: str = None):
+        self._state_dir = coalese(state_dir, DEFAULT_DELTA_STATE_DIR)
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    @property
+    def state_dir(self) -> str:
+        return self._state_dir
+
+    def snapshotPath(self, name: str) -> str:
+        """Path of a table's snapshot.
+
+        The hash of the name is part of it, as names may differ only in
+        characters which are left out of file names.
+        """
+        digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:8]
+        return path.join(self.state_dir, "{}-{}.json".format(
+            name_to_filename(name), digest))
+
+    def load(self, name: str) -> TableSnapshot:
+        snapshot_path = self.snapshotPath(name)
+        if not path.isfile(snapshot_path):
+            logger.debug("No snapshot of %s at %s", name, snapshot_path)
+            return None
+        with open(snapshot_path) as f:
+            try:
+                data = json.load(f)
+            except json.decoder.JSONDecodeError:
+                logger.warning(
+                    "Snapshot %s is not a json file", snapshot_path)
+                return None
+        if (not isinstance(data, dict) or
+                data.get("version") != STATE_VERSION or
+                data.get("name") != name):
+            logger.debug("> Ignoring snapshot with unknown version")
+            return None
+        snapshot_data = data.get("snapshot")
+        if not isinstance(snapshot_data, dict):
+            return None
+        return TableSnapshot.FromDict(snapshot_data)
+
+    def save(self, name: str, snapshot: TableSnapshot):
+        data = {
+            "version": STATE_VERSION,
+            "name": name,
+            "snapshot": snapshot.ToDict()
+        }
+        if not path.isdir(self.state_dir):
+            os.makedirs(self.state_dir, exist_ok=True)
+        snapshot_path = self.snapshotPath(name)
+        temp_path = "{}.tmp".format(snapshot_path)
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, snapshot_path)
+
+    def Get(self, name: str) -> TableSnapshot:
+        with self._lock:
+            if name not in self._snapshots:
+                self._snapshots[name] = self.load(name)
+            return self._snapshots[name]
+
+    def Put(self, name: str, snapshot: TableSnapshot):
+        with self._lock:
+            self._snapshots[name] = snapshot
+            self.save(name, snapshot)
+
+
+class IncrementalIngestor(object):
+    """Incremental Ingestor.
+
+    Brings the rows of each table group up to date from the daily list of
+    changed series.  A group is pulled in full when it has no snapshot,
+    when a release was missed, or when a changed series is new to the
+    table or has moved, which means the structure of the table changed.
+
+    Snapshots are synced as of the release of the change list, from the
+    `releaseTime' of its series, not the day of the run: a run before
+    StatsCan's daily release gets the previous day's list.  Applying a
+    list twice changes nothing, so when the release is not known a full
+    pull is only counted as synced up to the day before the run.
+
+    Snapshots only hold the rows within the `date_range' of the run they
+    were pulled by, so a run with another range pulls the group in full.
+    """
+    def __init__(self, source: DeltaSource, state: DeltaState,
+                 filter_factory, date_range: DateRange = None):
+        self._source = source
+        self._state = state
+        self._filter_factory = filter_factory
+        self._date_range = date_range
+        self._lock = threading.Lock()
+        self._changes = None
+        self._released = None
+
+    def changedSeries(self, product_id: int) -> List[dict]:
+        with self._lock:
+            if self._changes is None:
+                logger.debug("Loading changed series for %s",
+                             self._source.date.isoformat())
+                self._changes = {}
+                released = []
+                for series in self._source.GetChangedSeries():
+                    self._changes.setdefault(
+                        series.get("productId"), []).append(series)
+                    date = release_date(series)
+                    if date is not None:
+                        released.append(date)
+                self._released = max(released) if released else None
+                logger.debug("> %d tables changed", len(self._changes))
+        return self._changes.get(product_id, [])
+
+    @property
+    def released(self) -> Date:
+        """Release date of the change list, None if it is not known."""
+        return self._released
+
+    def syncedDate(self) -> Date:
+        """Date a full pull is synced as of."""
+        if self._released is not None:
+            return self._released
+        return self._source.date - TimeDelta(days=1)
+
+    def canApply(self, group, product_id: int, snapshots: list,
+                 changes: List[dict]) -> bool:
+        if product_id is None:
+            return False
+        if self._released is None:
+            logger.debug("> Release of the change list is not known")
+            return False
+        for table, snapshot in zip(group.tables, snapshots):
+            if snapshot is None or snapshot.product_id != product_id:
+                logger.debug("> No snapshot of table %s", table.name)
+                return False
+            if snapshot.date_range != self._date_range:
+                logger.debug("> Table %s was synced for dates %r",
+                             table.name, snapshot.date_range)
+                return False
+            gap = (self._released - snapshot.synced).days
+            if gap < 0 or gap > 1:
+                logger.debug("> Table %s was last synced %s",
+                             table.name, snapshot.synced.isoformat())
+                return False
+            for series in changes:
+                coordinate = snapshot.vectors.get(series["vectorId"])
+                if (coordinate is None or
+                        normalize_coordinate(coordinate) !=
+                        normalize_coordinate(
+                            str(series.get("coordinate", "")))):
+                    logger.debug("> Structure of table %s changed",
+                                 table.name)
+                    return False
+        return True
+
+    @staticmethod
+    def rowFromDataPoint(template: dict, point: dict) -> dict:
+        ref_period = point.get("refPer")
+        if not isinstance(ref_period, str):
+            return None
+        row = template.copy()
+        row[DATE_KEY] = ref_period[:len(template[DATE_KEY])]
+        value = point.get("value")
+        decimals = point.get("decimals")
+        if value is None:
+            row[VALUE_KEY] = ""
+        elif isinstance(decimals, int) and decimals > 0:
+            row[VALUE_KEY] = "{:.{}f}".format(value, decimals)
+        else:
+            row[VALUE_KEY] = str(int(round(value)))
+        scalar_code = point.get("scalarFactorCode")
+        if scalar_code in SCALAR_FACTORS:
+            row[SCALAR_KEY] = SCALAR_FACTORS[scalar_code]
+            if SCALAR_ID_KEY in row:
+                row[SCALAR_ID_KEY] = str(scalar_code)
+        return row
+
+    def applyDelta(self, group, snapshots: list,
+                   changes: List[dict]) -> List[list]:
+        changed = {series["vectorId"] for series in changes}
+        wanted = set()
+        for snapshot in snapshots:
+            wanted.update(changed.intersection(snapshot.templates))
+        logger.debug("Applying %d changed series to tables %s",
+                     len(wanted),
+                     ", ".join(table.name for table in group.tables))
+        data_points = self._source.GetSeriesData(sorted(wanted))
+        results = []
+        for table, snapshot in zip(group.tables, snapshots):
+            table_filter = self._filter_factory(table)
+            for vid in changed.intersection(snapshot.templates):
+                template = snapshot.templates[vid]
+                for point in data_points.get(vid, []):
+                    row = self.rowFromDataPoint(template, point)
+                    if row is None or not table_filter.isValid(row):
+                        continue
+                    snapshot.facts[(vid, row[DATE_KEY])] = \
+                        table_filter.transformRow(row)
+            snapshot.synced = self._released
+            self._state.Put(table.name, snapshot)
+            results.append(snapshot.Rows())
+        return results
+
+    def fullPull(self, group, product_id: int, full_pull) -> List[list]:
+        synced = self.syncedDate()
+        snapshots = [TableSnapshot(product_id, synced,
+                                   date_range=self._date_range)
+                     for _ in group.tables]
+        vectors = {}
+
+        def observe(row, facts):
+            vid = vector_id(row.get(VECTOR_KEY) or "")
+            if vid is None:
+                return
+            vectors[vid] = row.get(COORDINATE_KEY) or ""
+            for snapshot, fact in zip(snapshots, facts):
+                if fact is None:
+                    continue
+                if vid not in snapshot.templates:
+                    snapshot.templates[vid] = row
+                snapshot.facts[(vid, row[DATE_KEY])] = fact
+
+        results = full_pull(observer=observe)
+        if product_id is None or len(vectors) == 0:
+            return results
+        for table, snapshot in zip(group.tables, snapshots):
+            snapshot.vectors = vectors
+            self._state.Put(table.name, snapshot)
+        return results
+
+    def IngestGroup(self, group, full_pull) -> List[list]:
+        """Ingest a Table Group.
+
+        `full_pull' downloads and filters the group, taking an `observer'
+        keyword argument which sees every CSV row and the rows produced
+        for each table.
+        """
+        product_id = product_id_from_url(group.url)
+        snapshots = [self._state.Get(table.name) for table in group.tables]
+        changes = self.changedSeries(product_id)
+        if self.canApply(group, product_id, snapshots, changes):
+            return self.applyDelta(group, snapshots, changes)
+        logger.debug("Pulling tables %s in full",
+                     ", ".join(table.name for table in group.tables))
+        return self.fullPull(group, product_id, full_pull)
@@ -29,6 +29,7 @@ class TableDescriptor(object):
         self.last_update = None
         self.data_filter = None
         self.meta_filter = None
+        self.vectors = None
         self._source = SourceTableType.UNKNOWN
 
     @property
@@ -85,6 +86,9 @@ class TableDescriptor(object):
         meta_filter = table_data.get("meta_filter")
         if isinstance(meta_filter, str):
             table.meta_filter = meta_filter
+        vectors = table_data.get("vectors")
+        if isinstance(vectors, list):
+            table.vectors = cls.parseVectors(name, vectors)
         source = table_data.get("source")
         if not isinstance(source, str):
             table.source = SourceTableType.STATSCAN
@@ -99,3 +103,17 @@ class TableDescriptor(object):
             table.enabled = enabled
         logger.debug("> Loaded table %s", name)
         return table
+
+    @staticmethod
+    def parseVectors(name: str, vectors: list) -> list:
+        """Vector IDs as in the data CSV, "v" and the number."""
+        parsed = []
+        for vector in vectors:
+            digits = str(vector).strip().lower()
+            if digits.startswith("v"):
+                digits = digits[1:]
+            if not digits.isdecimal():
+                logger.warning("Table %s has invalid vector %s", name, vector)
+                continue
+            parsed.append("v{}".format(int(digits)))
+        return parsed
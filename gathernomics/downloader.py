@@ -4,16 +4,30 @@ Copyright (c) 2018 Alex Dale
 See LICENSE for information
 """
 
+import base64
+import hashlib
+import json
 import logging
 import os
 import os.path as path
 import sys
+import threading
 from typing import Tuple
-import urllib.request
 import zipfile
 
-from gathernomics.defaults import DEFAULT_COMP_DIR
+import urllib3
+
+from gathernomics.cache import DownloadCache
+from gathernomics.defaults import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_COMP_DIR,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_READ_TIMEOUT,
+    DEFAULT_RESUME_ATTEMPTS,
+    DEFAULT_RETRIES)
 from gathernomics.models.sourcetbl import SourceTableType
+from gathernomics.storage import CompressionDirManager
 from gathernomics.utils import iso_datetime, coalese, name_to_filename, tryint
 
 logger = logging.getLogger(name=__name__)
@@ -25,6 +39,23 @@ def die(message, *args, **kwargs):
     sys.exit(1)
 
 
+class DownloadError(Exception):
+    """Download Error.
+
+    Raised when a table cannot be downloaded or its files are missing.
+    Tables are downloaded by worker threads, so errors are raised rather
+    than exiting, for the table to be reported as failed.
+    """
+
+
+class CorruptCacheError(DownloadError):
+    """Raised when the cached zip of a table no longer matches its hash."""
+
+
+class IncompleteDownloadError(DownloadError):
+    """Raised when a response ends before the whole zip was received."""
+
+
 class StatsCanTableDownloader(object):
     class Context(object):
         def __init__(self, name: str, url: str):
@@ -32,15 +63,29 @@ class StatsCanTableDownloader(object):
             self.url = url
             self.iso_datetime = iso_datetime()
             self.zip_filepath = None
+            self.zip_size = None
+            self.zip_sha256 = None
             self.extract_dirpath = None
             self.data_csv_path = None
             self.meta_csv_path = None
+            self.data_csv_member = None
+            self.meta_csv_member = None
 
-    def __init__(self, compression_dir: str = None):
+    def __init__(self, compression_dir: str = None, chunk_size: int = None,
+                 cache: DownloadCache = None, extract: bool = True,
+                 pool_size: int = None, budget: int = None):
         # Initialize variables.
         self._compression_dir = coalese(compression_dir, DEFAULT_COMP_DIR)
+        self._chunk_size = coalese(chunk_size, DEFAULT_CHUNK_SIZE)
+        self._cache = cache
+        self._extract = extract
         self._temp_files = []
         self._temp_directories = []
+        self._contexts = []
+        self._storage = CompressionDirManager(self._compression_dir, budget)
+        self._pool_size = coalese(pool_size, DEFAULT_POOL_SIZE)
+        self._http = None
+        self._http_lock = threading.Lock()
         # Initialize resources
         self.makeCompressionDir()
 
@@ -54,6 +99,45 @@ class StatsCanTableDownloader(object):
     def compression_dir(self) -> str:
         return self._compression_dir
 
+    @property
+    def chunk_size(self) -> int:
+        return self._chunk_size
+
+    @property
+    def cache(self) -> DownloadCache:
+        return self._cache
+
+    @property
+    def extract(self) -> bool:
+        return self._extract
+
+    @property
+    def http(self) -> urllib3.PoolManager:
+        # One keep-alive pool per host, shared by every table and worker,
+        # made on first use.  Blocking keeps concurrent workers within the
+        # per-host limit.
+        with self._http_lock:
+            if self._http is None:
+                self._http = urllib3.PoolManager(
+                    maxsize=self._pool_size,
+                    block=True,
+                    timeout=urllib3.Timeout(
+                        connect=DEFAULT_CONNECT_TIMEOUT,
+                        read=DEFAULT_READ_TIMEOUT),
+                    retries=urllib3.Retry(
+                        total=DEFAULT_RETRIES, backoff_factor=0.5))
+            return self._http
+
+    @property
+    def storage(self) -> CompressionDirManager:
+        return self._storage
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.Cleanup()
+
     def makeCompressionDir(self):
         cdir = self.compression_dir
         if path.isdir(cdir):
@@ -67,53 +151,289 @@ class StatsCanTableDownloader(object):
         except Exception as e:
             die("Failed to create compression directory.  Error message: %s",
                 str(e))
-        self.pushDirectory(cdir)
 
-    def downloadZipFile(self, ctx) -> str:
-        url = ctx.url
-        zip_path = path.join(
+    def uniquePath(self, name: str, suffix: str) -> str:
+        """Path in the compression directory which is not yet taken."""
+        candidate = path.join(
+            self.compression_dir, "{}{}".format(name, suffix))
+        count = 1
+        while path.exists(candidate):
+            candidate = path.join(
+                self.compression_dir, "{}-{}{}".format(name, count, suffix))
+            count += 1
+        return candidate
+
+    def partPath(self, ctx) -> str:
+        """Path of a table's partial download.
+
+        The name is stable across runs so an interrupted download can be
+        resumed by the next run.
+        """
+        return path.join(
             self.compression_dir,
-            "{}-{}.zip".format(name_to_filename(ctx.name), ctx.iso_datetime))
-        if path.exists(zip_path):
-            die("Compression file already exists: %s", zip_path)
-        # Download
+            "{}.zip.part".format(name_to_filename(ctx.name)))
+
+    @staticmethod
+    def loadPartInfo(part_path: str) -> dict:
+        info_path = "{}.json".format(part_path)
+        if not path.isfile(info_path):
+            return None
+        with open(info_path) as f:
+            try:
+                return json.load(f)
+            except json.decoder.JSONDecodeError:
+                return None
+
+    @staticmethod
+    def savePartInfo(part_path: str, info: dict):
+        with open("{}.json".format(part_path), "w") as f:
+            json.dump(info, f)
+
+    @staticmethod
+    def removePart(part_path: str):
+        for file_path in (part_path, "{}.json".format(part_path)):
+            if path.exists(file_path):
+                os.remove(file_path)
+
+    def zipPath(self, ctx) -> str:
+        return self.uniquePath(
+            "{}-{}".format(name_to_filename(ctx.name), ctx.iso_datetime),
+            ".zip")
+
+    def downloadZipFile(self, ctx) -> str:
+        zip_path = self.zipPath(ctx)
+        part_path = self.partPath(ctx)
+        # Download, unless the cached copy is still current.
+        entry = self.cache.Get(ctx.url) if self.cache is not None else None
         logger.debug(
-            "Downloading StatsCan table from %s", url)
-        response = urllib.request.urlopen(url)
+            "Downloading StatsCan table from %s", ctx.url)
+        part_files = (part_path, "{}.json".format(part_path))
+        for file_path in part_files:
+            self.storage.Acquire(file_path)
+        try:
+            return self.downloadWithResume(
+                ctx, entry, zip_path, part_path)
+        finally:
+            for file_path in part_files:
+                self.storage.Release(file_path)
+
+    def downloadWithResume(self, ctx, entry, zip_path: str,
+                           part_path: str) -> str:
+        url = ctx.url
+        for attempt in range(1, DEFAULT_RESUME_ATTEMPTS + 1):
+            headers, offset = self.requestHeaders(ctx, entry, part_path)
+            try:
+                response = self.http.request(
+                    "GET", url, headers=headers, preload_content=False)
+                try:
+                    return self.saveResponse(
+                        ctx, response, entry, zip_path, part_path, offset)
+                finally:
+                    response.release_conn()
+            except CorruptCacheError:
+                # Download again, without the validators of the bad zip.
+                entry = None
+            except (urllib3.exceptions.HTTPError,
+                    IncompleteDownloadError) as e:
+                logger.warning(
+                    "> Download of table %s interrupted (attempt %d/%d): %s",
+                    ctx.name, attempt, DEFAULT_RESUME_ATTEMPTS, str(e))
+        logger.warning("> Giving up on table %s", ctx.name)
+        return None
+
+    @staticmethod
+    def rangeValidator(info: dict) -> str:
+        """Validator of a partial download to send in If-Range.
+
+        Weak ETags (`W/"..."') are not allowed in If-Range, the
+        Last-Modified date is used instead, if the server gave one.
+        """
+        etag = info.get("etag")
+        if etag is not None and not etag.startswith("W/"):
+            return etag
+        return info.get("last_modified")
+
+    def requestHeaders(self, ctx, entry, part_path: str):
+        """Request Headers.
+
+        Returns the headers of the next request for a table along with
+        the offset it resumes from.  A partial download is only resumed
+        if it belongs to the same URL and the server gave a validator for
+        it which is usable in If-Range, otherwise it is discarded.
+        """
+        info = self.loadPartInfo(part_path)
+        if path.isfile(part_path) and info is not None:
+            validator = self.rangeValidator(info)
+            offset = path.getsize(part_path)
+            if (info.get("url") == ctx.url and validator is not None and
+                    0 < offset < tryint(info.get("total"))):
+                logger.debug("> Resuming from byte %d", offset)
+                return {
+                    "Range": "bytes={}-".format(offset),
+                    "If-Range": validator
+                }, offset
+        self.removePart(part_path)
+        headers = entry.ConditionalHeaders() if entry is not None else {}
+        return headers, 0
+
+    def saveResponse(self, ctx, response, entry, zip_path: str,
+                     part_path: str, offset: int) -> str:
+        if response.status == 304 and entry is not None:
+            return self.useCachedZip(ctx, entry)
+        expected = self.checkResponse(
+            ctx, response.status, response.headers, offset, part_path)
+        if expected is None:
+            response.drain_conn()
+            return None
+        offset, total_length = expected
+        sha256 = self.beginPart(
+            ctx, response.headers, part_path, offset, total_length)
+        zip_size = offset
+        with open(part_path, "ab" if offset > 0 else "wb") as part_file:
+            for chunk in response.stream(self.chunk_size):
+                sha256.update(chunk)
+                part_file.write(chunk)
+                zip_size += len(chunk)
         logger.debug("> Done downloading")
-        # Verify output
+        return self.finishPart(
+            ctx, response.headers, sha256, zip_size, total_length,
+            zip_path, part_path)
+
+    def useCachedZip(self, ctx, entry) -> str:
+        """Use Cached Zip.
+
+        Reuses the cached zip of a table the server reports unchanged.
+        Raises CorruptCacheError, dropping the entry, if the zip no longer
+        has the SHA-256 it was downloaded with.
+        """
+        if not self.cache.Verify(entry):
+            logger.warning("> Cached zip of table %s is corrupt", ctx.name)
+            self.cache.Remove(ctx.url)
+            self.storage.Remove(entry.zip_filepath)
+            raise CorruptCacheError(
+                "Cached zip {} is corrupt".format(entry.zip_filepath))
+        logger.debug("> Not modified, using %s", entry.zip_filepath)
+        self.storage.Acquire(entry.zip_filepath)
+        ctx.zip_filepath = entry.zip_filepath
+        ctx.zip_size = entry.size
+        ctx.zip_sha256 = entry.sha256
+        return entry.zip_filepath
+
+    def checkResponse(self, ctx, status: int, headers, offset: int,
+                      part_path: str) -> Tuple[int, int]:
+        """Check Response.
+
+        Returns the offset the response body starts at and the total size
+        of the zip, or None if the response cannot be used.
+        """
         context_length = tryint(
-            coalese(response.getheader("Content-Length"), "0").strip())
-        content_type = coalese(response.getheader("Content-Type"), "").strip()
-        if content_type != "application/zip" or context_length == 0:
+            coalese(headers.get("Content-Length"), "0").strip())
+        content_type = coalese(headers.get("Content-Type"), "").strip()
+        if status == 206:
+            content_range = coalese(headers.get("Content-Range"), "").strip()
+            if not content_range.startswith("bytes {}-".format(offset)):
+                logger.warning(
+                    "> Unexpected range %s for table %s",
+                    content_range, ctx.name)
+                self.removePart(part_path)
+                return None
+            total_length = tryint(content_range.rpartition("/")[2])
+        elif status == 200:
+            # The server ignored or refused the range, start over.
+            offset = 0
+            total_length = context_length
+        else:
+            total_length = 0
+        if (status not in (200, 206) or
+                content_type != "application/zip" or
+                context_length == 0 or
+                total_length != offset + context_length):
             logger.warning(
-                "> Failed to download table %s zip from %s ", ctx.name, url)
+                "> Failed to download table %s zip from %s (HTTP %d)",
+                ctx.name, ctx.url, status)
             return None
-        logger.debug("> Zip size: %d", context_length)
-        # Save to data to zip file
-        logger.debug("> Saving response to %s", zip_path)
-        zip_file = open(zip_path, "wb")
-        zip_file.write(response.read())
-        logger.debug("> Done saving")
+        logger.debug("> Zip size: %d", total_length)
+        return offset, total_length
+
+    def beginPart(self, ctx, headers, part_path: str, offset: int,
+                  total_length: int):
+        """Record a partial download and hash what is already on disk."""
+        self.savePartInfo(part_path, {
+            "url": ctx.url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "total": total_length
+        })
+        sha256 = hashlib.sha256()
+        if offset > 0:
+            with open(part_path, "rb") as part_file:
+                for chunk in iter(
+                        lambda: part_file.read(self.chunk_size), b""):
+                    sha256.update(chunk)
+        logger.debug("> Saving response to %s", part_path)
+        return sha256
+
+    def finishPart(self, ctx, headers, sha256, zip_size: int,
+                   total_length: int, zip_path: str, part_path: str) -> str:
+        """Verify a finished download and move it into place.
+
+        Raises IncompleteDownloadError if the response ended early, the
+        partial download is kept for the next attempt to resume.
+        """
+        if zip_size != total_length:
+            raise IncompleteDownloadError(
+                "Expected {} bytes of table {}, got {}".format(
+                    total_length, ctx.name, zip_size))
+        if not self.checkDigest(headers, sha256):
+            logger.warning("> Checksum mismatch for table %s", ctx.name)
+            self.removePart(part_path)
+            return None
+        logger.debug("> SHA-256: %s", sha256.hexdigest())
+        os.replace(part_path, zip_path)
+        self.removePart(part_path)
+        self.storage.Acquire(zip_path)
         ctx.zip_filepath = zip_path
+        ctx.zip_size = zip_size
+        ctx.zip_sha256 = sha256.hexdigest()
         self.pushFile(zip_path)
+        if self.cache is not None:
+            self.cache.Put(DownloadCache.Entry(
+                url=ctx.url,
+                zip_filepath=zip_path,
+                size=zip_size,
+                sha256=ctx.zip_sha256,
+                etag=headers.get("ETag"),
+                last_modified=headers.get("Last-Modified")))
         return zip_path
 
+    @staticmethod
+    def checkDigest(headers, sha256) -> bool:
+        """Check the SHA-256 of a download against its Digest header.
+
+        Downloads without a SHA-256 digest are accepted as is.
+        """
+        digest = coalese(headers.get("Digest"), "")
+        for item in digest.split(","):
+            algorithm, _, value = item.strip().partition("=")
+            if algorithm.lower() == "sha-256":
+                return base64.b64decode(value) == sha256.digest()
+        return True
+
     def extractZipFile(self, ctx) -> Tuple[str, str]:
         zippath = ctx.zip_filepath
-        out_dir = path.join(
-            self.compression_dir, "{}-{}.d".format(
-                name_to_filename(ctx.name), ctx.iso_datetime))
-        if path.exists(out_dir):
-            die("Extraction directory already exists: %s", out_dir)
+        out_dir = self.uniquePath(
+            "{}-{}".format(name_to_filename(ctx.name), ctx.iso_datetime),
+            ".d")
         if not path.isfile(zippath):
-            die("Zip file does not exists for %s", ctx.name)
+            raise DownloadError(
+                "Zip file does not exists for {}".format(ctx.name))
         # Extract files
         logger.debug("Openning zip file: %s", zippath)
         zipref = zipfile.ZipFile(zippath, "r")
         logger.debug("> Extracting all files to %s", out_dir)
         zipref.extractall(path=out_dir)
         ctx.extract_dirpath = out_dir
+        self.storage.Acquire(out_dir)
         self.pushDirectory(out_dir)
         # Gather CSV files
         files = zipref.namelist()
@@ -136,7 +456,8 @@ class StatsCanTableDownloader(object):
         data_path = path.join(out_dir, data_file)
         ctx.data_csv_path = data_path
         if not path.isfile(data_path):
-            die("Data CSV %s does not exists as %s", data_file, data_path)
+            raise DownloadError("Data CSV {} does not exists as {}".format(
+                data_file, data_path))
         # Check for meta
         if len(meta_csv_files) != 1:
             logger.debug("> No meta file available")
@@ -144,10 +465,37 @@ class StatsCanTableDownloader(object):
         meta_file = meta_csv_files[0]
         meta_path = path.join(out_dir, meta_file)
         if not path.isfile(meta_path):
-            die("Meta CSV {} does not exists as %s", meta_file, meta_path)
+            raise DownloadError("Meta CSV {} does not exists as {}".format(
+                meta_file, meta_path))
         ctx.meta_csv_path = meta_path
         return data_path, meta_path
 
+    def openZipFile(self, ctx) -> Tuple[str, str]:
+        """Locate the CSV members of a zip without extracting them."""
+        zippath = ctx.zip_filepath
+        if not path.isfile(zippath):
+            raise DownloadError(
+                "Zip file does not exists for {}".format(ctx.name))
+        logger.debug("Openning zip file: %s", zippath)
+        with zipfile.ZipFile(zippath, "r") as zipref:
+            files = zipref.namelist()
+        csv_files = [filename for filename in files
+                     if filename.endswith(".csv")]
+        data_csv_files = [csv_file for csv_file in csv_files
+                          if "MetaData" not in csv_file]
+        meta_csv_files = [csv_file for csv_file in csv_files
+                          if "MetaData" in csv_file]
+        if len(data_csv_files) != 1:
+            logger.warning("No data file available for %s", ctx.name)
+            return None, None
+        ctx.data_csv_member = data_csv_files[0]
+        logger.debug("> Data member: %s", ctx.data_csv_member)
+        if len(meta_csv_files) != 1:
+            logger.debug("> No meta file available")
+            return ctx.data_csv_member, None
+        ctx.meta_csv_member = meta_csv_files[0]
+        return ctx.data_csv_member, ctx.meta_csv_member
+
     def DownloadTable(self, table_descriptor):
         if table_descriptor.source != SourceTableType.STATSCAN:
             logger.debug(
@@ -155,10 +503,58 @@ class StatsCanTableDownloader(object):
                 table_descriptor.name)
             return None
         ctx = self.Context(table_descriptor.name, table_descriptor.url)
+        self._contexts.append(ctx)
         zip_file = self.downloadZipFile(ctx)
         if zip_file is None:
+            self.Release(ctx)
             return None
-        data_path, _ = self.extractZipFile(ctx)
+        if self.extract:
+            data_path, _ = self.extractZipFile(ctx)
+        else:
+            data_path, _ = self.openZipFile(ctx)
         if data_path is None:
+            self.Release(ctx)
             return None
         return ctx
+
+    def isCached(self, file_path: str) -> bool:
+        """Whether the download cache keeps a zip for later runs."""
+        if self.cache is None:
+            return False
+        return self.cache.Contains(file_path)
+
+    def Release(self, ctx):
+        """Release a Downloaded Table.
+
+        Removes the table's extracted files, and its zip unless the
+        download cache keeps it, then evicts the least recently used
+        entries of the compression directory if it is over budget.
+        """
+        if ctx not in self._contexts:
+            return
+        self._contexts.remove(ctx)
+        if ctx.extract_dirpath is not None:
+            self.storage.Release(ctx.extract_dirpath)
+            self.storage.Remove(ctx.extract_dirpath)
+        if ctx.zip_filepath is not None:
+            self.storage.Release(ctx.zip_filepath)
+            if not self.isCached(ctx.zip_filepath):
+                self.storage.Remove(ctx.zip_filepath)
+        self.storage.Evict()
+
+    def Cleanup(self):
+        """Remove Temporary Files.
+
+        Releases every table still held and removes the files this
+        downloader created, except the zips kept by the download cache.
+        """
+        for ctx in list(self._contexts):
+            self.Release(ctx)
+        for dir_path in self._temp_directories:
+            self.storage.Remove(dir_path)
+        for file_path in self._temp_files:
+            if path.exists(file_path) and not self.isCached(file_path):
+                self.storage.Remove(file_path)
+        self._temp_files.clear()
+        self._temp_directories.clear()
+        self.storage.Evict()
@@ -0,0 +1,146 @@
+"""Gathernomics - Fact Frame.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from array import array
+from datetime import date as Date
+from typing import Iterable, Iterator, List
+
+# Fields of a fact, in the order of the tuples of FactFrame.Rows.
+FIELDS = ["value", "indicator", "category", "date", "frequency"]
+# Columns of a FactFrame which are dictionary encoded.
+DICTIONARY_FIELDS = ["indicator", "category", "frequency"]
+# Day ordinal of facts without a date; real ordinals start at 1.
+NO_DATE = 0
+
+
+class DictionaryColumn(object):
+    """Dictionary Column.
+
+    A column of a few distinct values, each stored once and referred to by
+    its code.  Codes take two bytes, or four past 65536 distinct values.
+    """
+    def __init__(self):
+        self.codes = array("H")
+        self.values = []
+        self._index = {}
+
+    def Encode(self, value) -> int:
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+            if code == 65536:
+                self.codes = array("I", self.codes)
+        return code
+
+    def Append(self, value):
+        # Encode first, it may widen the codes to a new array.
+        code = self.Encode(value)
+        self.codes.append(code)
+
+    def Take(self, indices: List[int]):
+        """Column of the values at `indices', sharing the dictionary."""
+        column = DictionaryColumn()
+        column.codes = array(self.codes.typecode,
+                             map(self.codes.__getitem__, indices))
+        column.values = list(self.values)
+        column._index = dict(self._index)
+        return column
+
+    def Decode(self) -> List:
+        """Every value of the column."""
+        values = self.values
+        return [values[code] for code in self.codes]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the codes, the values are shared."""
+        return self.codes.itemsize * len(self.codes)
+
+
+class FactFrame(object):
+    """Fact Frame.
+
+    Stores facts by column rather than as a dict each: values as 64-bit
+    integers, dates as day ordinals (`date.toordinal') and the indicator,
+    category and frequency dictionary encoded, for a few bytes a fact.
+    Filters fill frames with `Append' or `Extend' and writers read them
+    back with `Rows' or column by column.
+
+    Values must fit in 64 bits, OverflowError is raised otherwise.
+    """
+    def __init__(self):
+        self.values = array("q")
+        self.dates = array("i")
+        self.columns = {field: DictionaryColumn()
+                        for field in DICTIONARY_FIELDS}
+
+    @classmethod
+    def FromFacts(cls, facts: Iterable[dict]):
+        frame = cls()
+        frame.Extend(facts)
+        return frame
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def Append(self, fact: dict):
+        date = fact["date"]
+        self.values.append(fact["value"])
+        self.dates.append(date.toordinal() if date is not None else NO_DATE)
+        for field, column in self.columns.items():
+            column.Append(fact[field])
+
+    def Extend(self, facts: Iterable[dict]):
+        for fact in facts:
+            self.Append(fact)
+
+    def ExtendFrame(self, other):
+        """Append the facts of another frame."""
+        self.values.extend(other.values)
+        self.dates.extend(other.dates)
+        for field, column in self.columns.items():
+            other_column = other.columns[field]
+            codes = [column.Encode(value) for value in other_column.values]
+            for code in other_column.codes:
+                column.codes.append(codes[code])
+
+    def Take(self, indices: List[int]):
+        """Frame of the facts at `indices'."""
+        frame = FactFrame()
+        frame.values = array("q", map(self.values.__getitem__, indices))
+        frame.dates = array("i", map(self.dates.__getitem__, indices))
+        frame.columns = {field: column.Take(indices)
+                         for field, column in self.columns.items()}
+        return frame
+
+    def Dates(self) -> List[Date]:
+        """The date of every fact, None for those without."""
+        dates = {NO_DATE: None}
+        for ordinal in set(self.dates):
+            if ordinal != NO_DATE:
+                dates[ordinal] = Date.fromordinal(ordinal)
+        return [dates[ordinal] for ordinal in self.dates]
+
+    def Rows(self) -> Iterator[tuple]:
+        """The facts as tuples of the FIELDS."""
+        return zip(self.values,
+                   self.columns["indicator"].Decode(),
+                   self.columns["category"].Decode(),
+                   self.Dates(),
+                   self.columns["frequency"].Decode())
+
+    def Facts(self) -> Iterator[dict]:
+        """The facts as the dicts filters produce."""
+        for row in self.Rows():
+            yield dict(zip(FIELDS, row))
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the columns of the frame."""
+        return (self.values.itemsize * len(self.values) +
+                self.dates.itemsize * len(self.dates) +
+                sum(column.nbytes for column in self.columns.values()))
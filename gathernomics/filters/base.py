@@ -6,31 +6,77 @@ See LICENSE for information.
 
 import re
 import csv
+import io
+import itertools
 from datetime import datetime as DateTime
 from datetime import date as Date
 import logging
-from typing import List
+from operator import itemgetter
+from typing import Callable, Iterator, List
+import zipfile
 
+from gathernomics.defaults import DEFAULT_SELECTIVITY_SAMPLE_ROWS
+from gathernomics.filters.daterange import DateRange, DateRangeMemo
+from gathernomics.filters.parsecache import ParseCache
 from gathernomics.models.factor import TemporalFrequency
+from gathernomics.utils import coalese
 
 logger = logging.getLogger(name="gathernomics.filters.base")
 
+VALUE_KEY = "VALUE"
+SCALAR_KEY = "SCALAR_FACTOR"
+DATE_KEY = "REF_DATE"
+VECTOR_KEY = "VECTOR"
+COORDINATE_KEY = "COORDINATE"
+# Most coordinates matched as a set, beyond which labels are compared.
+MAX_COORDINATES = 65536
+
 
 class FilterBase(object):
-    def __init__(self, csv_path, filters: dict = None):
+    # How `getValue' parses VALUE before scaling it by SCALAR_FACTOR.  int
+    # parses it as `tryint' does, float truncates the scaled value to an
+    # int and None means the filter overrides `getValue'.
+    value_type = None
+
+    def __init__(self, csv_path, filters: dict = None,
+                 required: List[str] = None):
         self._path = csv_path
         self.filters = filters.copy() if filters is not None else None
+        # Columns a row must have, on top of those in `filters'.
+        self.required = list(required) if required is not None else []
+        # When set, `path' is a zip file and the CSV is read from this member.
+        self.zip_member = None
+        # SHA-256 of the zip the CSV came from, keying its persisted index.
+        self.source_hash = None
+        # TableMetadata of the CSV, to match rows on their COORDINATE.
+        self.metadata = None
+        # When set, only rows of these series ("v" and the vector ID) match.
+        self.vectors = None
+        # When set, only rows whose REF_DATE is within the range match.
+        self.date_range = None
+        # Fraction of rows rejected by the check of each column, which
+        # orders the checks.  Set by `compile' when it samples rows.
+        self.selectivity = None
+        # Dates, scalar factors and strings parsed from the rows kept.
+        self.parse_cache = ParseCache()
 
     @property
     def path(self) -> str:
         return self._path
 
+    def matchFilters(self) -> dict:
+        """Values of the columns a row must have to match."""
+        if self.vectors is not None:
+            return {VECTOR_KEY: list(self.vectors)}
+        return coalese(self.filters, {})
+
     def isValid(self, row: dict) -> bool:
         if not isinstance(row, dict):
             return False
-        if self.filters is None:
-            return True
-        for key, value in self.filters.items():
+        for key in self.required:
+            if key not in row:
+                return False
+        for key, value in self.matchFilters().items():
             if isinstance(value, list):
                 if not self.checkValues(row, key, value):
                     return False
@@ -39,8 +85,197 @@ class FilterBase(object):
                     return False
             else:
                 logger.warning("Unknown filter type %s", str(type(value)))
+        if (self.date_range is not None and
+                row.get(DATE_KEY) not in self.date_range):
+            return False
         return True
 
+    def compile(self, header: List[str],
+                sample: List[list] = None) -> Callable[[list], bool]:
+        """Compile the Filter for a CSV Header.
+
+        Returns a predicate equivalent to `isValid' which takes the rows
+        of a `csv.reader' with that header.  Column positions are
+        resolved once here rather than for every row.  With `metadata',
+        the labels of the dimensions are resolved to member IDs and rows
+        are matched on their COORDINATE instead, which raises ValueError
+        if a label is no longer in the table.
+
+        The checks are ordered so those rejecting the most rows run first,
+        by their rejection rates over the `sample' rows if given, or else
+        by the rates in `selectivity'.
+        """
+        # Like csv.DictReader, the last of any duplicate columns is used.
+        columns = {key: i for i, key in enumerate(header)}
+        return self.compileFilters(
+            columns, self.resolveFilters(header), sample)
+
+    def resolveFilters(self, header: List[str]) -> dict:
+        """Values of the columns a row with a CSV header must have.
+
+        As `matchFilters', but with the labels of the dimensions resolved
+        to COORDINATE when the filter has `metadata' and with REF_DATE
+        checked against `date_range', as `compile' matches rows.  Engines
+        narrowing down the rows to check do so on these, so they match
+        the same rows.  Raises ValueError if a label is no longer in the
+        table.
+        """
+        filters = self.matchFilters()
+        if (self.vectors is None and self.metadata is not None and
+                COORDINATE_KEY in header):
+            filters = self.coordinateFilters(filters)
+        if self.date_range is not None:
+            filters = dict(filters)
+            filters[DATE_KEY] = self.date_range
+        return filters
+
+    def coordinateFilters(self, filters: dict) -> dict:
+        """Replace the checks of dimension labels with one of COORDINATE."""
+        constraints = {}
+        rest = {}
+        for key, value in filters.items():
+            dimension = self.metadata.ColumnDimension(key)
+            if dimension is None or not isinstance(value, (str, list)):
+                rest[key] = value
+                continue
+            labels = [value] if isinstance(value, str) else value
+            constraints[dimension.position] = \
+                self.metadata.ResolveMembers(key, labels)
+        if len(constraints) == 0:
+            return filters
+        coordinates = self.metadata.Coordinates(constraints, MAX_COORDINATES)
+        if coordinates is None:
+            logger.info("More than %d coordinates match %s, matching on "
+                        "labels", MAX_COORDINATES, self.path)
+            return filters
+        rest[COORDINATE_KEY] = sorted(coordinates)
+        return rest
+
+    def compileFilters(self, columns: dict, filters: dict,
+                       sample: List[list] = None) -> Callable[[list], bool]:
+        for key in self.required:
+            if key not in columns:
+                logger.debug("Column %s is missing, no row can match", key)
+                return lambda _: False
+        # Checks are (column, index, value), with a frozenset or DateRange
+        # value for membership checks.
+        checks = []
+        for key, value in filters.items():
+            if key not in columns:
+                logger.debug("Column %s is missing, no row can match", key)
+                return lambda _: False
+            if isinstance(value, list):
+                checks.append((key, columns[key], frozenset(value)))
+            elif isinstance(value, (str, DateRange)):
+                checks.append((key, columns[key], value))
+            else:
+                logger.warning("Unknown filter type %s", str(type(value)))
+        if sample:
+            self.selectivity = self.sampleChecks(checks, sample)
+        return self.buildPredicate(self.orderChecks(checks))
+
+    @staticmethod
+    def sampleChecks(checks: list, sample: List[list]) -> dict:
+        """Fraction of the sample rows rejected by each check.
+
+        REF_DATE is left out, as the rows of a table are grouped by date,
+        so a sample of consecutive rows holds only one or a few dates.
+        """
+        rates = {}
+        for key, index, value in checks:
+            if key == DATE_KEY:
+                continue
+            if isinstance(value, str):
+                rejected = sum(1 for row in sample if row[index] != value)
+            else:
+                rejected = sum(1 for row in sample if row[index] not in value)
+            rates[key] = rejected / len(sample)
+        return rates
+
+    def orderChecks(self, checks: list) -> list:
+        """Order checks from the most to the least rejecting.
+
+        Checks without a known rate go last, keeping their order, and
+        equal rates favour the cheaper single valued checks.
+        """
+        rates = coalese(self.selectivity, {})
+        return sorted(checks, key=lambda check: (
+            -rates.get(check[0], -1.0), not isinstance(check[2], str)))
+
+    @staticmethod
+    def buildPredicate(checks: list) -> Callable[[list], bool]:
+        if len(checks) == 0:
+            return lambda _: True
+        # The first check runs on its own, so most rows are rejected
+        # without building a tuple of the values of the other columns.
+        _, first_index, first_values = checks[0]
+        if isinstance(first_values, str):
+            first_values = frozenset([first_values])
+        indices = []
+        expected = []
+        memberships = []
+        for _, index, value in checks[1:]:
+            if isinstance(value, str):
+                indices.append(index)
+                expected.append(value)
+            elif isinstance(value, DateRange):
+                memberships.append((index, DateRangeMemo(value)))
+            else:
+                memberships.append((index, value))
+        if len(indices) == 0:
+            get_values, expected = (lambda _: ()), ()
+        elif len(indices) == 1:
+            get_values, expected = itemgetter(indices[0]), expected[0]
+        else:
+            get_values, expected = itemgetter(*indices), tuple(expected)
+
+        if isinstance(first_values, DateRange):
+            within = DateRangeMemo(first_values)
+
+            def date_predicate(row: list) -> bool:
+                if not within[row[first_index]]:
+                    return False
+                if get_values(row) != expected:
+                    return False
+                for index, values in memberships:
+                    if row[index] not in values:
+                        return False
+                return True
+            return date_predicate
+
+        def predicate(row: list) -> bool:
+            if row[first_index] not in first_values:
+                return False
+            if get_values(row) != expected:
+                return False
+            for index, values in memberships:
+                if row[index] not in values:
+                    return False
+            return True
+        return predicate
+
+    @staticmethod
+    def readRows(csvfile, header: List[str] = None) -> Iterator[list]:
+        """Read a CSV File.
+
+        Yields the header, then every non-blank row padded to the width
+        of the header, as `csv.DictReader' would.  If given, `header' is
+        used for a file without a header row of its own.
+        """
+        reader = csv.reader(csvfile)
+        if header is None:
+            header = next(reader, None)
+            if header is None:
+                return
+        yield header
+        width = len(header)
+        for row in reader:
+            if len(row) == 0:
+                continue
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            yield row
+
     def getIndicator(self, row: dict) -> str:
         raise NotImplementedError("getIndicator")
 
@@ -48,7 +283,10 @@ class FilterBase(object):
         raise NotImplementedError("getCategory")
 
     def getValue(self, row: dict) -> int:
-        raise NotImplementedError("getValue")
+        if self.value_type is None:
+            raise NotImplementedError("getValue")
+        return self.parse_cache.Value(
+            self.value_type, row[VALUE_KEY], row[SCALAR_KEY])
 
     def getDate(self, row: dict) -> Date:
         frequency = self.getFrequency(row)
@@ -65,20 +303,38 @@ class FilterBase(object):
     def getFrequency(self, row: dict) -> TemporalFrequency:
         raise NotImplementedError("getFrequency")
 
+    def transformRow(self, row: dict) -> dict:
+        cache = self.parse_cache
+        return {
+            "value": self.getValue(row),
+            "indicator": cache.String(self.getIndicator(row)),
+            "category": cache.String(self.getCategory(row)),
+            "date": cache.Date(self, row),
+            "frequency": self.getFrequency(row)
+        }
+
+    def openCsv(self):
+        if self.zip_member is None:
+            return open(self.path, mode="r", encoding="utf-8-sig")
+        # Decompress the member as it is read.  The member keeps the
+        # underlying zip file open until it is closed itself.
+        with zipfile.ZipFile(self.path, "r") as zipref:
+            member = zipref.open(self.zip_member, "r")
+        return io.TextIOWrapper(member, encoding="utf-8-sig", newline="")
+
     def __iter__(self):
-        with open(self.path, mode="r", encoding="utf-8-sig") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                row = dict(row)
-                if not self.isValid(row):
-                    continue
-                yield {
-                    "value": self.getValue(row),
-                    "indicator": self.getIndicator(row),
-                    "category": self.getCategory(row),
-                    "date": self.getDate(row),
-                    "frequency": self.getFrequency(row)
-                }
+        with self.openCsv() as csvfile:
+            rows = self.readRows(csvfile)
+            header = next(rows, None)
+            if header is None:
+                return
+            sample = list(itertools.islice(
+                rows, DEFAULT_SELECTIVITY_SAMPLE_ROWS))
+            predicate = self.compile(header, sample)
+            for row in itertools.chain(sample, rows):
+                # Only build a dict for the rows which are kept.
+                if predicate(row):
+                    yield self.transformRow(dict(zip(header, row)))
 
     @staticmethod
     def checkValue(row: dict, key: str, value: str) -> bool:
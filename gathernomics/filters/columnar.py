@@ -0,0 +1,217 @@
+"""Restaurant Site - Gathernomics Columnar Filter Engine.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+import itertools
+import logging
+from typing import Iterator, List
+import warnings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gathernomics.defaults import (
+    DEFAULT_COLUMNAR_BATCH_ROWS, DEFAULT_SELECTIVITY_SAMPLE_ROWS)
+from gathernomics.filters.base import FilterBase
+from gathernomics.filters.daterange import DateRange, DateRangeMemo
+from gathernomics.filters.scan import FilterEngine
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name="gathernomics.filters.columnar")
+
+
+def columnar_available() -> bool:
+    return numpy is not None
+
+
+# Fraction of the sampled rows kept above which the rest of the file is
+# scanned row by row, as masks then spare too few lines being parsed.
+MAX_KEPT_FRACTION = 0.5
+
+
+class MultilineBatch(Exception):
+    """A batch of lines is not one row per line."""
+    pass
+
+
+class ColumnarScanEngine(FilterEngine):
+    """Columnar Scan Engine.
+
+    Produces the same rows as iterating over each filter, for filters
+    bound to the same data CSV.  The lines are read in batches and the
+    columns the filters check are loaded from each batch at once by
+    NumPy's CSV parser, which quotes fields as `csv.reader' does.  The
+    checks of each filter are evaluated as masks over those columns, each
+    on the rows the previous ones kept, and only the lines of the rows
+    kept are parsed, so VALUE, SCALAR_FACTOR and REF_DATE are parsed for
+    those rows alone.
+
+    Rows spanning several lines, blank lines and rows too short for the
+    checked columns end the batches: the rest of the file is then scanned
+    row by row, as it is when the filters keep most of the sampled rows.
+    Observers are not supported, use ScanEngine for those.
+    """
+    def __init__(self, filters: List[FilterBase], batch_rows: int = None):
+        if numpy is None:
+            raise RuntimeError("The columnar filter engine requires numpy")
+        super().__init__(filters)
+        self._batch_rows = coalese(batch_rows, DEFAULT_COLUMNAR_BATCH_ROWS)
+
+    @property
+    def batch_rows(self) -> int:
+        return self._batch_rows
+
+    @staticmethod
+    def compileChecks(table_filter: FilterBase, header: List[str]) -> list:
+        """Checks of a filter, as `compileFilters' builds them.
+
+        Returns the (column, index, value) checks in the order they run,
+        or None if no row can match.
+        """
+        columns = {key: i for i, key in enumerate(header)}
+        for key in table_filter.required:
+            if key not in columns:
+                return None
+        checks = []
+        for key, value in table_filter.resolveFilters(header).items():
+            if key not in columns:
+                return None
+            if isinstance(value, list):
+                checks.append((key, columns[key], frozenset(value)))
+            elif isinstance(value, DateRange):
+                checks.append((key, columns[key], DateRangeMemo(value)))
+            elif isinstance(value, str):
+                checks.append((key, columns[key], value))
+        return table_filter.orderChecks(checks)
+
+    @staticmethod
+    def loadColumns(lines: List[str], indices: List[int]) -> dict:
+        """Columns of a batch of lines, by their index in the header.
+
+        Raises MultilineBatch unless each line holds one row.
+        """
+        if len(indices) == 0:
+            return {}
+        try:
+            with warnings.catch_warnings():
+                # Blank lines are skipped with a warning.
+                warnings.simplefilter("ignore")
+                table = numpy.loadtxt(
+                    lines, dtype=object, delimiter=",", quotechar='"',
+                    comments=None, usecols=indices, ndmin=2)
+        except ValueError:
+            raise MultilineBatch()
+        if len(table) != len(lines):
+            raise MultilineBatch()
+        return {index: table[:, n] for n, index in enumerate(indices)}
+
+    @staticmethod
+    def checkMask(column, value):
+        if isinstance(value, str):
+            return column == value
+        lookup = value.__getitem__ if isinstance(value, DateRangeMemo) \
+            else value.__contains__
+        return numpy.fromiter(
+            map(lookup, column), dtype=bool, count=len(column))
+
+    def selectRows(self, checks: list, columns: dict, size: int):
+        """Positions of the rows of a batch passing every check."""
+        selected = numpy.arange(size)
+        for _, index, value in checks:
+            column = columns[index]
+            if len(selected) < size:
+                column = column[selected]
+            selected = selected[self.checkMask(column, value)]
+            if len(selected) == 0:
+                break
+        return selected
+
+    def scanBatch(self, header: List[str], lines: List[str],
+                  checks: List[list], results: List[list]):
+        indices = sorted({index for filter_checks in checks
+                          if filter_checks is not None
+                          for _, index, _ in filter_checks})
+        columns = self.loadColumns(lines, indices)
+        selections = [self.selectRows(filter_checks, columns, len(lines))
+                      if filter_checks is not None else None
+                      for filter_checks in checks]
+        kept = [selected for selected in selections
+                if selected is not None and len(selected) > 0]
+        if len(kept) == 0:
+            return
+        # Parse each selected line once, whichever filters kept it.
+        positions = numpy.unique(numpy.concatenate(kept)).tolist()
+        selected_rows = FilterBase.readRows(
+            [lines[i] for i in positions], header)
+        next(selected_rows)
+        parsed = dict(zip(positions, map(
+            lambda row: dict(zip(header, row)), selected_rows)))
+        for table_filter, selected, rows in zip(
+                self._filters, selections, results):
+            if selected is not None:
+                rows.extend(map(table_filter.transformRow,
+                                map(parsed.__getitem__, selected.tolist())))
+
+    def scanRows(self, header: List[str], rows: Iterator[list],
+                 predicates: list, results: List[list]) -> int:
+        """Scan rows by the filters' predicates, returning how many match."""
+        targets = list(zip(predicates, self._filters, results))
+        matched = 0
+        for row in rows:
+            row_dict = None
+            for predicate, table_filter, filter_rows in targets:
+                if not predicate(row):
+                    continue
+                if row_dict is None:
+                    row_dict = dict(zip(header, row))
+                    matched += 1
+                filter_rows.append(table_filter.transformRow(row_dict))
+        return matched
+
+    def Run(self) -> List[list]:
+        """Scan the whole file, returning the rows of every filter."""
+        results = [[] for _ in self._filters]
+        if len(self._filters) == 0:
+            return results
+        source = self._filters[0]
+        logger.debug("Scanning %s for %d filters, columnar",
+                     source.path, len(self._filters))
+        with source.openCsv() as csvfile:
+            rows = source.readRows(csvfile)
+            header = next(rows, None)
+            if header is None:
+                return results
+            # The sample is read row by row, leaving the file at the
+            # start of the next line.
+            sample = list(itertools.islice(
+                rows, DEFAULT_SELECTIVITY_SAMPLE_ROWS))
+            predicates = [table_filter.compile(header, sample)
+                          for table_filter in self._filters]
+            matched = self.scanRows(header, sample, predicates, results)
+            if matched > MAX_KEPT_FRACTION * len(sample):
+                logger.debug("Filters keep %d of %d sampled rows of %s, "
+                             "scanning by rows", matched, len(sample),
+                             source.path)
+                self.scanRows(header, rows, predicates, results)
+                return results
+            checks = [self.compileChecks(table_filter, header)
+                      for table_filter in self._filters]
+            while True:
+                lines = list(itertools.islice(csvfile, self.batch_rows))
+                if len(lines) == 0:
+                    break
+                try:
+                    self.scanBatch(header, lines, checks, results)
+                except MultilineBatch:
+                    logger.debug("Scanning the rest of %s by rows",
+                                 source.path)
+                    rest = source.readRows(
+                        itertools.chain(lines, csvfile), header)
+                    next(rest)
+                    self.scanRows(header, rest, predicates, results)
+                    break
+        return results
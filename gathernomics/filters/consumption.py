@@ -7,7 +7,6 @@ See LICENSE for information.
 from datetime import date as Date
 from datetime import datetime as DateTime
 
-from gathernomics.utils import tryint, scalar_multiplier
 from gathernomics.filters.base import FilterBase
 from gathernomics.models.factor import TemporalFrequency
 
@@ -27,32 +26,26 @@ DATE_KEY = "REF_DATE"
 
 class ConsumptionFilter(FilterBase):
     """Consumption Filter."""
+    value_type = int
+
     def __init__(
             self,
             csv_path: str,
             category: str,
             indicator: str,
             frequency: TemporalFrequency):
-        super().__init__(csv_path=csv_path)
+        super().__init__(
+            csv_path=csv_path,
+            filters={
+                ESTIMATE_KEY: ESTIMATE_VALUE,
+                GEO_KEY: GEO_VALUE,
+                PRICE_KEY: PRICE_VALUE
+            },
+            required=[VALUE_KEY, SCALAR_KEY, DATE_KEY])
         self.category = category
         self.indicator = indicator
         self.frequency = frequency
 
-    def isValid(self, row: dict) -> bool:
-        if (ESTIMATE_KEY not in row or
-                row[ESTIMATE_KEY] != ESTIMATE_VALUE):
-            return False
-        if (GEO_KEY not in row or
-                row[GEO_KEY] != GEO_VALUE):
-            return False
-        if PRICE_KEY not in row or row[PRICE_KEY] != PRICE_VALUE:
-            return False
-        if (VALUE_KEY not in row or
-                SCALAR_KEY not in row or
-                DATE_KEY not in row):
-            return False
-        return True
-
     def getIndicator(self, _) -> str:
         return self.indicator
 
@@ -62,11 +55,6 @@ class ConsumptionFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = tryint(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return value * multiplier
-
 
 SEX_KEY = "Sex"
 SEX_VALUE = "Both sexes"
@@ -80,37 +68,27 @@ INCOME_VALUE = "Dollar amount claimed on income tax form"
 
 class ConsumptionTaxFilter(FilterBase):
     """Consumption - Taxes Filter."""
+    value_type = int
+
     def __init__(
             self,
             csv_path: str,
             category: str,
             indicator: str,
             frequency: TemporalFrequency):
-        super().__init__(csv_path=csv_path)
+        super().__init__(
+            csv_path=csv_path,
+            filters={
+                SEX_KEY: SEX_VALUE,
+                GEO_KEY: GEO_VALUE,
+                TAXES_KEY: TAXES_VALUE,
+                INCOME_KEY: INCOME_VALUE
+            },
+            required=[VALUE_KEY, SCALAR_KEY, DATE_KEY])
         self.category = category
         self.indicator = indicator
         self.frequency = frequency
 
-    def isValid(self, row: dict) -> bool:
-        if (SEX_KEY not in row or
-                row[SEX_KEY] != SEX_VALUE):
-            return False
-        if (GEO_KEY not in row or
-                row[GEO_KEY] != GEO_VALUE):
-            return False
-        if (TAXES_KEY not in row or
-                row[TAXES_KEY] != TAXES_VALUE):
-            return False
-        if (INCOME_KEY not in row or
-                row[INCOME_KEY] != INCOME_VALUE):
-            return False
-
-        if (VALUE_KEY not in row or
-                SCALAR_KEY not in row or
-                DATE_KEY not in row):
-            return False
-        return True
-
     def getIndicator(self, _) -> str:
         return self.indicator
 
@@ -120,11 +98,6 @@ class ConsumptionTaxFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = tryint(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return value * multiplier
-
 
 LABOUR_KEY = "Labour force characteristics"
 LABOUR_VALUE = "Unemployment"
@@ -141,43 +114,29 @@ DATA_VALUE = "Seasonally adjusted"
 
 class ConsumptionEmploymentRateFilter(FilterBase):
     """Consumption - Employment Rate Filter."""
+    value_type = float
+
     def __init__(
             self,
             csv_path: str,
             category: str,
             indicator: str,
             frequency: TemporalFrequency):
-        super().__init__(csv_path=csv_path)
+        super().__init__(
+            csv_path=csv_path,
+            filters={
+                SEX_KEY: SEX_VALUE,
+                GEO_KEY: GEO_VALUE,
+                LABOUR_KEY: LABOUR_VALUE,
+                AGE_KEY: AGE_VALUE,
+                STATS_KEY: STATS_VALUE,
+                DATA_KEY: DATA_VALUE
+            },
+            required=[VALUE_KEY, SCALAR_KEY, DATE_KEY])
         self.category = category
         self.indicator = indicator
         self.frequency = frequency
 
-    def isValid(self, row: dict) -> bool:
-        if (SEX_KEY not in row or
-                row[SEX_KEY] != SEX_VALUE):
-            return False
-        if (GEO_KEY not in row or
-                row[GEO_KEY] != GEO_VALUE):
-            return False
-        if (LABOUR_KEY not in row or
-                row[LABOUR_KEY] != LABOUR_VALUE):
-            return False
-        if (AGE_KEY not in row or
-                row[AGE_KEY] != AGE_VALUE):
-            return False
-        if (STATS_KEY not in row or
-                row[STATS_KEY] != STATS_VALUE):
-            return False
-        if (DATA_KEY not in row or
-                row[DATA_KEY] != DATA_VALUE):
-            return False
-
-        if (VALUE_KEY not in row or
-                SCALAR_KEY not in row or
-                DATE_KEY not in row):
-            return False
-        return True
-
     def getIndicator(self, _) -> str:
         return self.indicator
 
@@ -187,16 +146,13 @@ class ConsumptionEmploymentRateFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = float(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return int(value * multiplier)
-
 
 NAICS_KEY = "North American Industry Classification System (NAICS)"
 
 
 class ConsumptionWagesFilter(FilterBase):
+    value_type = float
+
     def __init__(
             self,
             csv_path: str,
@@ -223,13 +179,10 @@ class ConsumptionWagesFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = float(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return int(value * multiplier)
-
 
 class ConsumptionDisposableIncomeFilter(FilterBase):
+    value_type = int
+
     def __init__(
             self,
             csv_path: str,
@@ -258,13 +211,10 @@ class ConsumptionDisposableIncomeFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = tryint(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return value * multiplier
-
 
 class ConsumptionCreditFilter(FilterBase):
+    value_type = int
+
     def __init__(
             self,
             csv_path: str,
@@ -290,8 +240,3 @@ class ConsumptionCreditFilter(FilterBase):
 
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
-
-    def getValue(self, row) -> int:
-        value = tryint(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return value * multiplier
@@ -0,0 +1,88 @@
+"""Restaurant Site - Gathernomics Date Range.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+import re
+
+REF_DATE_PATTERN = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+
+
+def ref_date(value: str) -> str:
+    """Check a Date Bound.
+
+    Returns the bound if it is a year, month or day as StatsCan writes
+    REF_DATE (`YYYY', `YYYY-mm' or `YYYY-mm-DD'), else raises ValueError.
+    """
+    if not REF_DATE_PATTERN.match(value):
+        raise ValueError("Invalid date {}".format(value))
+    return value
+
+
+class DateRange(object):
+    """Date Range.
+
+    Inclusive bounds on the REF_DATE of rows, checked on the raw string
+    so rows out of range are rejected before anything is parsed.  A row
+    and a bound are compared on the part both of them give, so a period
+    is within the range if it overlaps it: the month "2018-03" is within
+    a range since "2018" and the year "2018" is within a range since
+    "2018-03".  Either bound may be None.
+
+    Used as the accepted values of a filter check, `in' tests a REF_DATE.
+    """
+    def __init__(self, since: str = None, until: str = None):
+        self._since = since
+        self._until = until
+
+    @property
+    def since(self) -> str:
+        return self._since
+
+    @property
+    def until(self) -> str:
+        return self._until
+
+    def __contains__(self, value: str) -> bool:
+        if value is None:
+            return False
+        if self._since is not None:
+            n = min(len(value), len(self._since))
+            if value[:n] < self._since[:n]:
+                return False
+        if self._until is not None:
+            n = min(len(value), len(self._until))
+            if value[:n] > self._until[:n]:
+                return False
+        return True
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, DateRange):
+            return NotImplemented
+        return (self._since, self._until) == (other.since, other.until)
+
+    def __hash__(self) -> int:
+        return hash((self._since, self._until))
+
+    def __repr__(self) -> str:
+        return "DateRange({!r}, {!r})".format(self._since, self._until)
+
+
+class DateRangeMemo(dict):
+    """Date Range Memo.
+
+    Maps each REF_DATE looked up to whether it is within a DateRange,
+    comparing each distinct date only the first time it is seen, so
+    indexing it costs a dict lookup.
+    """
+    def __init__(self, date_range: DateRange):
+        super().__init__()
+        self._date_range = date_range
+
+    def __missing__(self, value: str) -> bool:
+        within = self[value] = value in self._date_range
+        return within
+
+    def __contains__(self, value: str) -> bool:
+        return self[value]
@@ -7,7 +7,6 @@ See LICENSE for information.
 from datetime import date as Date
 from datetime import datetime as DateTime
 
-from gathernomics.utils import tryint, scalar_multiplier
 from gathernomics.filters.base import FilterBase
 from gathernomics.models.factor import TemporalFrequency
 
@@ -27,31 +26,26 @@ DATE_KEY = "REF_DATE"
 
 class GDPFilter(FilterBase):
     """GDP Filter."""
+    value_type = int
+
     def __init__(
             self,
             csv_path: str,
             category: str,
             indicator: str,
             frequency: TemporalFrequency):
-        super().__init__(csv_path=csv_path)
+        super().__init__(
+            csv_path=csv_path,
+            filters={
+                NAICS_KEY: NAICS_VALUE,
+                ADJUSTMENT_KEY: ADJUSTMENT_VALUE,
+                PRICE_KEY: PRICE_VALUE
+            },
+            required=[VALUE_KEY, SCALAR_KEY, DATE_KEY])
         self.category = category
         self.indicator = indicator
         self.frequency = frequency
 
-    def isValid(self, row: dict) -> bool:
-        if NAICS_KEY not in row or row[NAICS_KEY] != NAICS_VALUE:
-            return False
-        if (ADJUSTMENT_KEY not in row or
-                row[ADJUSTMENT_KEY] != ADJUSTMENT_VALUE):
-            return False
-        if PRICE_KEY not in row or row[PRICE_KEY] != PRICE_VALUE:
-            return False
-        if (VALUE_KEY not in row or
-                SCALAR_KEY not in row or
-                DATE_KEY not in row):
-            return False
-        return True
-
     def getIndicator(self, _) -> str:
         return self.indicator
 
@@ -61,11 +55,6 @@ class GDPFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = tryint(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return value * multiplier
-
     def getDate(self, row: dict) -> Date:
         date_string = row[DATE_KEY]
         dt = DateTime.strptime(date_string, "%Y-%m")
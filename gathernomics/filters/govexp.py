@@ -7,7 +7,6 @@ See LICENSE for information.
 from datetime import date as Date
 from datetime import datetime as DateTime
 
-from gathernomics.utils import tryint, scalar_multiplier
 from gathernomics.filters.base import FilterBase
 from gathernomics.models.factor import TemporalFrequency
 
@@ -27,32 +26,26 @@ DATE_KEY = "REF_DATE"
 
 class GovernmentExpenditureFilter(FilterBase):
     """Government Expenditure Filter."""
+    value_type = int
+
     def __init__(
             self,
             csv_path: str,
             category: str,
             indicator: str,
             frequency: TemporalFrequency):
-        super().__init__(csv_path=csv_path)
+        super().__init__(
+            csv_path=csv_path,
+            filters={
+                GOV_SECT_KEY: GOV_SECT_VALUE,
+                STATEMENT_KEY: STATEMENT_VALUE,
+                GEO_KEY: GEO_VALUE
+            },
+            required=[VALUE_KEY, SCALAR_KEY, DATE_KEY])
         self.category = category
         self.indicator = indicator
         self.frequency = frequency
 
-    def isValid(self, row: dict) -> bool:
-        if (GOV_SECT_KEY not in row or
-                row[GOV_SECT_KEY] != GOV_SECT_VALUE):
-            return False
-        if (STATEMENT_KEY not in row or
-                row[STATEMENT_KEY] != STATEMENT_VALUE):
-            return False
-        if GEO_KEY not in row or row[GEO_KEY] != GEO_VALUE:
-            return False
-        if (VALUE_KEY not in row or
-                SCALAR_KEY not in row or
-                DATE_KEY not in row):
-            return False
-        return True
-
     def getIndicator(self, _) -> str:
         return self.indicator
 
@@ -62,11 +55,6 @@ class GovernmentExpenditureFilter(FilterBase):
     def getFrequency(self, _) -> TemporalFrequency:
         return self.frequency
 
-    def getValue(self, row) -> int:
-        value = tryint(row[VALUE_KEY])
-        multiplier = scalar_multiplier(row[SCALAR_KEY])
-        return value * multiplier
-
     def getDate(self, row: dict) -> Date:
         date_string = row[DATE_KEY]
         dt = DateTime.strptime(date_string, "%Y-%m")
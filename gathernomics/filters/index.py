@@ -0,0 +1,380 @@
+"""Restaurant Site - Gathernomics Dimension Index.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+import csv
+import io
+import json
+import logging
+import os
+import os.path as path
+import threading
+from typing import List
+
+from gathernomics.defaults import DEFAULT_INDEX_DIR, DEFAULT_INDEX_MAX_VALUES
+from gathernomics.filters.base import (
+    COORDINATE_KEY, DATE_KEY, VECTOR_KEY, FilterBase)
+from gathernomics.filters.daterange import DateRange
+from gathernomics.filters.scan import FilterEngine
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name="gathernomics.filters.index")
+
+INDEX_VERSION = 3
+# Columns naming the series of a row, indexed whatever their number of
+# distinct values, as filters matching series look rows up by them.
+SERIES_KEYS = (COORDINATE_KEY, VECTOR_KEY)
+
+
+def parse_record(record: bytes) -> list:
+    """Parse the single CSV row held by some bytes of the file."""
+    text = io.StringIO(record.decode("utf-8"), newline=None)
+    return next(csv.reader(text), [])
+
+
+def read_records(csvfile):
+    """Read a CSV File as Rows.
+
+    Yields the offset, the bytes and the parsed row of every row of a
+    binary file, the header included.  Quoted fields may span lines.
+    """
+    offset = 0
+    record = b""
+    quotes = 0
+    for line in csvfile:
+        record += line
+        quotes += line.count(b'"')
+        if quotes % 2 == 1:
+            continue  # The row goes on past a quoted line break.
+        if record.strip():
+            yield offset, record, parse_record(record)
+        offset += len(record)
+        record = b""
+        quotes = 0
+    if record.strip():
+        yield offset, record, parse_record(record)
+
+
+class DimensionIndex(object):
+    """Dimension Index.
+
+    Maps every value of the dimension columns of a data CSV to the sorted
+    numbers of the rows holding it, along with the byte offset of each row,
+    so filters can read only the rows which may match.  Columns with more
+    than `max_values' distinct values, such as VALUE, are not indexed,
+    apart from COORDINATE and VECTOR, which have one for each series.
+    Whatever its number of values, the first and last rows of each
+    REF_DATE are kept too, as the rows of a table are grouped by date.
+
+    Indexes are persisted in the index directory keyed by the SHA-256 of
+    the zip the CSV came from.  A new zip of the same table gets a new
+    index, and replaces the index of the previous one.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, name: str, csv_size: int, header: List[str],
+                 offsets: array, columns: dict, postings: array,
+                 dates: dict = None):
+        self._name = name
+        self._csv_size = csv_size
+        self._header = header
+        self._offsets = offsets
+        self._columns = columns
+        self._postings = postings
+        # First and last row number of each REF_DATE.
+        self._dates = coalese(dates, {})
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def header(self) -> List[str]:
+        return self._header
+
+    @property
+    def row_count(self) -> int:
+        return len(self._offsets) - 1
+
+    def IsIndexed(self, key: str) -> bool:
+        return key in self._columns
+
+    def Values(self, key: str) -> List[str]:
+        return list(self._columns.get(key, {}).keys())
+
+    def DateRows(self, date_range: DateRange) -> List[tuple]:
+        """Sorted, disjoint spans of rows holding the dates in a range.
+
+        Each span is the first and last number of its rows.  Rows within
+        a span may hold other dates, if those are not grouped.
+        """
+        spans = sorted(rows for date, rows in self._dates.items()
+                       if date in date_range)
+        merged = []
+        for first, last in spans:
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
+    def Postings(self, key: str, value: str) -> array:
+        """Sorted numbers of the rows whose `key' column holds `value'."""
+        start, count = self._columns[key].get(value, (0, 0))
+        return self._postings[start:start + count]
+
+    @classmethod
+    def Build(cls, csv_path: str, max_values: int = None):
+        max_values = coalese(max_values, DEFAULT_INDEX_MAX_VALUES)
+        logger.debug("Indexing %s", csv_path)
+        offsets = array("Q")
+        header = None
+        values = None
+        dates = {}
+        date_column = None
+        with open(csv_path, "rb") as csvfile:
+            for offset, record, row in read_records(csvfile):
+                if header is None:
+                    header = parse_record(record.lstrip(b"\xef\xbb\xbf"))
+                    values = [{} for _ in header]
+                    limits = [None if key in SERIES_KEYS else max_values
+                              for key in header]
+                    if header.count(DATE_KEY) == 1:
+                        date_column = header.index(DATE_KEY)
+                    continue
+                number = len(offsets)
+                offsets.append(offset)
+                if date_column is not None and date_column < len(row):
+                    rows = dates.get(row[date_column])
+                    if rows is None:
+                        dates[row[date_column]] = (number, number)
+                    else:
+                        dates[row[date_column]] = (rows[0], number)
+                for i, value in enumerate(row[:len(values)]):
+                    column = values[i]
+                    if column is None:
+                        continue
+                    rows = column.get(value)
+                    if rows is None:
+                        if len(column) == limits[i]:
+                            values[i] = None  # Too many to be a dimension.
+                            continue
+                        rows = column[value] = array("I")
+                    rows.append(number)
+        csv_size = path.getsize(csv_path)
+        offsets.append(csv_size)
+        columns = {}
+        postings = array("I")
+        header = coalese(header, [])
+        for key, column in zip(header, coalese(values, [])):
+            if column is None or header.count(key) > 1:
+                continue
+            columns[key] = {}
+            for value, rows in column.items():
+                columns[key][value] = (len(postings), len(rows))
+                postings.extend(rows)
+        return cls(path.basename(csv_path), csv_size, coalese(header, []),
+                   offsets, columns, postings, dates)
+
+    @staticmethod
+    def indexPaths(index_dir: str, key: str):
+        return (path.join(index_dir, "{}.json".format(key)),
+                path.join(index_dir, "{}.bin".format(key)))
+
+    @classmethod
+    def Load(cls, index_dir: str, key: str, csv_path: str):
+        """Load a persisted index, or None if it is missing or stale."""
+        json_path, bin_path = cls.indexPaths(index_dir, key)
+        if not path.isfile(json_path) or not path.isfile(bin_path):
+            return None
+        try:
+            with open(json_path) as f:
+                index_data = json.load(f)
+            if (index_data.get("version") != INDEX_VERSION or
+                    index_data.get("csv_size") != path.getsize(csv_path)):
+                return None
+            offsets = array("Q")
+            postings = array("I")
+            with open(bin_path, "rb") as f:
+                offsets.fromfile(f, index_data["rows"] + 1)
+                postings.fromfile(f, index_data["postings"])
+        except (OSError, EOFError, ValueError, KeyError) as e:
+            logger.warning("Failed to load index %s: %s", json_path, str(e))
+            return None
+        columns = {key: {value: tuple(entry)
+                         for value, entry in column.items()}
+                   for key, column in index_data["columns"].items()}
+        dates = {date: tuple(rows)
+                 for date, rows in index_data["dates"].items()}
+        return cls(index_data["name"], index_data["csv_size"],
+                   index_data["header"], offsets, columns, postings, dates)
+
+    def Save(self, index_dir: str, key: str):
+        """Persist the index, replacing older indexes of the same CSV."""
+        json_path, bin_path = self.indexPaths(index_dir, key)
+        with self._lock:
+            os.makedirs(index_dir, exist_ok=True)
+            for filename in os.listdir(index_dir):
+                other_path = path.join(index_dir, filename)
+                if (not filename.endswith(".json") or
+                        other_path == json_path):
+                    continue
+                try:
+                    with open(other_path) as f:
+                        other_name = json.load(f).get("name")
+                except (OSError, ValueError):
+                    continue
+                if other_name == self.name:
+                    logger.debug("Removing stale index %s", other_path)
+                    for stale_path in self.indexPaths(
+                            index_dir, filename[:-len(".json")]):
+                        if path.exists(stale_path):
+                            os.remove(stale_path)
+            with open("{}.tmp".format(bin_path), "wb") as f:
+                self._offsets.tofile(f)
+                self._postings.tofile(f)
+            os.replace("{}.tmp".format(bin_path), bin_path)
+            with open("{}.tmp".format(json_path), "w") as f:
+                json.dump({
+                    "version": INDEX_VERSION,
+                    "name": self.name,
+                    "csv_size": self._csv_size,
+                    "header": self.header,
+                    "rows": self.row_count,
+                    "postings": len(self._postings),
+                    "columns": self._columns,
+                    "dates": self._dates
+                }, f)
+            os.replace("{}.tmp".format(json_path), json_path)
+
+    @classmethod
+    def LoadOrBuild(cls, index_dir: str, key: str, csv_path: str):
+        index = cls.Load(index_dir, key, csv_path)
+        if index is None:
+            index = cls.Build(csv_path)
+            index.Save(index_dir, key)
+        return index
+
+    def postingsFor(self, key: str, values: List[str]) -> List[int]:
+        if len(values) == 1:
+            return self.Postings(key, values[0])
+        rows = set()
+        for value in values:
+            rows.update(self.Postings(key, value))
+        return sorted(rows)
+
+    def Candidates(self, table_filter: FilterBase) -> List[int]:
+        """Candidate Rows.
+
+        Numbers of the rows which hold every indexed value a filter
+        requires, its COORDINATE once its labels are resolved, and, with a
+        date range, a REF_DATE within it, by its postings if REF_DATE is
+        indexed or else within the spans of rows of the dates in range.
+        Returns None if the filter checks no indexed column and no dates.
+        """
+        lists = []
+        spans = None
+        for key, value in table_filter.resolveFilters(self.header).items():
+            if (isinstance(value, DateRange) and key == DATE_KEY and
+                    not self.IsIndexed(key) and len(self._dates) > 0):
+                spans = self.DateRows(value)
+                continue
+            if not self.IsIndexed(key):
+                continue
+            if isinstance(value, DateRange):
+                # Skip the rows of the dates out of range.
+                values = [date for date in self.Values(key) if date in value]
+            else:
+                values = [value] if isinstance(value, str) else value
+            lists.append(self.postingsFor(key, values))
+        if len(lists) == 0:
+            if spans is None:
+                return None
+            return [row for first, last in spans
+                    for row in range(first, last + 1)]
+        lists.sort(key=len)
+        candidates = lists[0]
+        for other in lists[1:]:
+            # Look the few candidates up in the longer lists.
+            candidates = [row for row in candidates
+                          if self.contains(other, row)]
+        if spans is not None:
+            starts = [first for first, _ in spans]
+            candidates = [row for row in candidates
+                          if self.withinSpans(spans, starts, row)]
+        return list(candidates)
+
+    @staticmethod
+    def withinSpans(spans: List[tuple], starts: List[int], row: int) -> bool:
+        i = bisect_right(starts, row) - 1
+        return i >= 0 and row <= spans[i][1]
+
+    @staticmethod
+    def contains(rows, row: int) -> bool:
+        i = bisect_left(rows, row)
+        return i < len(rows) and rows[i] == row
+
+    def ReadRows(self, csv_path: str, rows: List[int]):
+        """Read and parse numbered rows from the CSV."""
+        with open(csv_path, "rb") as csvfile:
+            for row in rows:
+                start = self._offsets[row]
+                csvfile.seek(start)
+                yield parse_record(
+                    csvfile.read(self._offsets[row + 1] - start))
+
+
+class IndexedScanEngine(FilterEngine):
+    """Indexed Scan Engine.
+
+    Runs filters bound to the same extracted data CSV by intersecting the
+    posting lists of the values they require in the CSV's dimension index
+    and reading only those rows.  The index is loaded from `index_dir',
+    or built and persisted on first use.  The filters' predicates still
+    make the final decision, so the rows are the same as scanning.
+
+    CSVs read straight out of a zip, CSVs without a `source_hash' and
+    filters which check no indexed column and no date range are scanned
+    by ScanEngine.
+    """
+    def __init__(self, filters: List[FilterBase], index_dir: str = None):
+        super().__init__(filters)
+        self._index_dir = coalese(index_dir, DEFAULT_INDEX_DIR)
+
+    @property
+    def index_dir(self) -> str:
+        return self._index_dir
+
+    def Run(self) -> List[list]:
+        """Scan the whole file, returning the rows of every filter."""
+        results = [[] for _ in self._filters]
+        if len(self._filters) == 0:
+            return results
+        source = self._filters[0]
+        if source.zip_member is not None or source.source_hash is None:
+            return self.scanAll()
+        index = DimensionIndex.LoadOrBuild(
+            self.index_dir, source.source_hash, source.path)
+        header = index.header
+        width = len(header)
+        rest = []
+        for i, table_filter in enumerate(self._filters):
+            candidates = index.Candidates(table_filter)
+            if candidates is None:
+                rest.append(i)
+                continue
+            logger.debug("> %d candidate rows of %d",
+                         len(candidates), index.row_count)
+            predicate = table_filter.compile(header)
+            for row in index.ReadRows(source.path, candidates):
+                if len(row) < width:
+                    row.extend([None] * (width - len(row)))
+                if predicate(row):
+                    results[i].append(
+                        table_filter.transformRow(dict(zip(header, row))))
+        self.scanRest(results, rest)
+        return results
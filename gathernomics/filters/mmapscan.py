@@ -0,0 +1,234 @@
+"""Restaurant Site - Gathernomics Memory Mapped Filter Scan.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+import csv
+import heapq
+import logging
+import mmap
+import os.path as path
+from typing import Iterator, List
+
+from gathernomics.filters.base import FilterBase
+from gathernomics.filters.parallel import line_end
+from gathernomics.filters.scan import FilterEngine
+
+logger = logging.getLogger(name="gathernomics.filters.mmapscan")
+
+
+class MultilineRow(Exception):
+    """A candidate row spans several lines."""
+    pass
+
+
+# Bytes sampled to estimate how often each needle occurs.
+SAMPLE_SIZE = 1024 * 1024
+# Most values of a membership check searched for one by one.
+MAX_NEEDLE_VALUES = 64
+# Fraction of the sampled lines holding a filter's needles above which
+# the filter is scanned by ScanEngine, which parses lines faster than
+# they are found and checked one by one.
+MAX_NEEDLE_LINES = 0.1
+
+
+def filter_needles(filters: dict) -> List[bytes]:
+    """Bytes every line accepted by a filter's resolved checks contains.
+
+    A membership check has a needle when its shortest value is within
+    each of the others, as a coordinate is within its padded form.  A
+    value with a quote is written with the quote doubled within a quoted
+    field, or as is in a field without quotes, so a filter checking one
+    has no needles.
+    """
+    values = []
+    for value in filters.values():
+        if isinstance(value, list) and len(value) > 0:
+            shortest = min(value, key=len)
+            if all(shortest in other for other in value):
+                value = shortest
+        if isinstance(value, str) and len(value) > 0:
+            values.append(value)
+    if any('"' in value for value in values):
+        return []
+    return [value.encode("utf-8") for value in values]
+
+
+def filter_alternatives(filters: dict) -> List[List[bytes]]:
+    """Needles of which every line accepted by a filter contains one.
+
+    One list for each membership check of at most MAX_NEEDLE_VALUES
+    values, such as the coordinates of several series or a list of
+    vectors, leaving out values containing another value of the list.
+    """
+    alternatives = []
+    for value in filters.values():
+        if not isinstance(value, list) or len(value) == 0:
+            continue
+        values = sorted(set(value), key=len)
+        if (len(values) > MAX_NEEDLE_VALUES or
+                any(len(value) == 0 or '"' in value for value in values)):
+            continue
+        needles = []
+        for value in values:
+            if not any(needle in value for needle in needles):
+                needles.append(value)
+        alternatives.append([needle.encode("utf-8") for needle in needles])
+    return alternatives
+
+
+def can_match(table_filter: FilterBase, filters: dict,
+              header: List[str]) -> bool:
+    """Whether the header has every column the filter checks."""
+    keys = list(table_filter.required)
+    keys.extend(filters.keys())
+    return all(key in header for key in keys)
+
+
+def needle_lines(data, start: int, needle: bytes) -> Iterator[int]:
+    """Offsets of the lines past `start' containing the needle, in order."""
+    position = start
+    while True:
+        hit = data.find(needle, position)
+        if hit < 0:
+            return
+        yield max(data.rfind(b"\n", start, hit) + 1, start)
+        position = data.find(b"\n", hit)
+        if position < 0:
+            return
+        position += 1
+
+
+class MmapScanEngine(FilterEngine):
+    """Memory Mapped Scan Engine.
+
+    Scans an extracted data CSV for filters with at least one single
+    valued check without decoding every line.  The file is memory mapped
+    and searched for the value a filter requires which is rarest in a
+    sample of the file, jumping from one occurrence to the next.  Lines
+    which also contain the filter's other required values are decoded,
+    parsed and given to the filter's real predicate, so the rows are the
+    same as iterating over the filter.  The values are those of the
+    filter's resolved checks, so with metadata the rarest is usually the
+    COORDINATE of its series.
+
+    A membership check of at most MAX_NEEDLE_VALUES values, such as the
+    coordinates of several series or a list of vectors, is searched for
+    each of its values, their occurrences merged in file order.  It is
+    what a filter checking no single value jumps between.
+
+    A running count of quotes tells whether a candidate line starts or
+    ends inside a quoted field.  If one does, the file has rows spanning
+    several lines and is scanned by ScanEngine instead, as are CSVs read
+    straight out of a zip.  Filters without needles, as those checking a
+    value with a quote, and those whose needles are in more than
+    MAX_NEEDLE_LINES of the sampled lines share one ScanEngine pass.
+    """
+    @staticmethod
+    def jumpNeedles(sample: bytes, needles: List[bytes],
+                    alternatives: List[List[bytes]]) -> List[bytes]:
+        """Needles to jump between, found in the fewest sampled lines.
+
+        Either the rarest needle, or the needles of the rarest list of
+        alternatives.  Returns None if there are none, or if they are in
+        more than MAX_NEEDLE_LINES of the sampled lines.
+        """
+        groups = [[needle] for needle in needles]
+        groups.extend(alternatives)
+        if len(groups) == 0:
+            return None
+        counts = [sum(sample.count(needle) for needle in group)
+                  for group in groups]
+        count, _, _, jump_needles = min(
+            (count, len(group), -min(map(len, group)), group)
+            for count, group in zip(counts, groups))
+        if count > MAX_NEEDLE_LINES * max(sample.count(b"\n"), 1):
+            return None
+        return jump_needles
+
+    @staticmethod
+    def scanFilter(data, start: int, header: List[str],
+                   table_filter: FilterBase, jump_needles: List[bytes],
+                   other_needles: List[bytes]) -> list:
+        predicate = table_filter.compile(header)
+        width = len(header)
+        rows = []
+        quotes_to = start
+        inside_quotes = False
+        previous = None
+        for line_start in heapq.merge(*[
+                needle_lines(data, start, needle)
+                for needle in jump_needles]):
+            if line_start == previous:
+                continue
+            previous = line_start
+            line_stop = data.find(b"\n", line_start)
+            if line_stop < 0:
+                line_stop = len(data)
+            if data[quotes_to:line_start].count(b'"') % 2 == 1:
+                inside_quotes = not inside_quotes
+            quotes_to = line_start
+            line = data[line_start:line_stop]
+            if inside_quotes or line.count(b'"') % 2 == 1:
+                raise MultilineRow()
+            if any(needle not in line for needle in other_needles):
+                continue
+            row = next(csv.reader([line.decode("utf-8").rstrip("\r")]), [])
+            if len(row) == 0:
+                continue
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            if predicate(row):
+                rows.append(table_filter.transformRow(dict(zip(header, row))))
+        return rows
+
+    def Run(self) -> List[list]:
+        """Scan the whole file, returning the rows of every filter."""
+        results = [[] for _ in self._filters]
+        if len(self._filters) == 0:
+            return results
+        source = self._filters[0]
+        if source.zip_member is not None or path.getsize(source.path) == 0:
+            return self.scanAll()
+        with source.openCsv() as csvfile:
+            header = next(csv.reader(csvfile), None)
+        if header is None:
+            return results
+        # Labels are resolved up front, so an unknown one raises whichever
+        # way the filter is scanned.
+        resolved = [table_filter.resolveFilters(header)
+                    for table_filter in self._filters]
+        needles = [filter_needles(filters) for filters in resolved]
+        alternatives = [filter_alternatives(filters) for filters in resolved]
+        if not any(needles) and not any(alternatives):
+            return self.scanAll()
+        logger.debug("Scanning %s for %d filters, memory mapped",
+                     source.path, len(self._filters))
+        try:
+            with open(source.path, "rb") as csvfile:
+                with mmap.mmap(csvfile.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    start = line_end(data, 0, 0)
+                    sample = data[start:start + SAMPLE_SIZE]
+                    for i, table_filter in enumerate(self._filters):
+                        if not can_match(
+                                table_filter, resolved[i], header):
+                            needles[i] = None
+                            continue
+                        jump_needles = self.jumpNeedles(
+                            sample, needles[i], alternatives[i])
+                        if jump_needles is None:
+                            continue
+                        results[i] = self.scanFilter(
+                            data, start, header, table_filter, jump_needles,
+                            [needle for needle in needles[i]
+                             if [needle] != jump_needles])
+                        needles[i] = None
+        except MultilineRow:
+            logger.debug("> Rows span several lines, scanning rows")
+            return self.scanAll()
+        rest = [i for i, unscanned in enumerate(needles)
+                if unscanned is not None]
+        self.scanRest(results, rest)
+        return results
@@ -0,0 +1,158 @@
+"""Restaurant Site - Gathernomics Parallel Filter Scan.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+import csv
+import io
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os.path as path
+from typing import List, Tuple
+
+from gathernomics.defaults import (
+    DEFAULT_PARALLEL_CHUNK_SIZE, DEFAULT_SELECTIVITY_SAMPLE_ROWS)
+from gathernomics.filters.base import FilterBase
+from gathernomics.filters.scan import FilterEngine
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name="gathernomics.filters.parallel")
+
+
+def process_pool(processes: int = None) -> ProcessPoolExecutor:
+    """Process Pool.
+
+    Pool of `processes' workers, or one per CPU, started by a fork server
+    or else spawned.  Forking would copy the locks held by the download
+    and writer threads into each worker, which could deadlock on them.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+
+def line_end(data, start: int, target: int) -> int:
+    """Line End.
+
+    Offset just past the first line break at or after `target' which is
+    not inside a quoted field, given that a row starts at `start'.  A line
+    break is outside of quotes when an even number of quotes precede it
+    within its row.
+    """
+    quotes = data[start:target].count(b'"')
+    position = target
+    while True:
+        newline = data.find(b"\n", position)
+        if newline < 0:
+            return len(data)
+        quotes += data[position:newline].count(b'"')
+        if quotes % 2 == 0:
+            return newline + 1
+        position = newline + 1
+
+
+def split_csv(csv_path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """Split a CSV File into Row Aligned Byte Ranges.
+
+    Returns (start, end) ranges of about `chunk_size' bytes covering every
+    row after the header.  Quoted fields spanning several lines are never
+    split.
+    """
+    if path.getsize(csv_path) == 0:
+        return []
+    ranges = []
+    with open(csv_path, "rb") as csvfile:
+        with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = line_end(data, 0, 0)
+            while start < len(data):
+                end = line_end(
+                    data, start, min(start + chunk_size, len(data)))
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def scan_range(filters: List[FilterBase], csv_path: str, header: List[str],
+               start: int, end: int) -> List[list]:
+    """Run filters over the rows within a byte range of a CSV file."""
+    with open(csv_path, "rb") as csvfile:
+        csvfile.seek(start)
+        data = csvfile.read(end - start)
+    results = [[] for _ in filters]
+    with io.TextIOWrapper(io.BytesIO(data), encoding="utf-8") as text:
+        rows = FilterBase.readRows(text, header=header)
+        next(rows)
+        sample = list(itertools.islice(
+            rows, DEFAULT_SELECTIVITY_SAMPLE_ROWS))
+        predicates = [table_filter.compile(header, sample)
+                      for table_filter in filters]
+        for row in itertools.chain(sample, rows):
+            row_dict = None
+            for predicate, table_filter, filtered in zip(
+                    predicates, filters, results):
+                if not predicate(row):
+                    continue
+                if row_dict is None:
+                    row_dict = dict(zip(header, row))
+                filtered.append(table_filter.transformRow(row_dict))
+    return results
+
+
+class ParallelScanEngine(FilterEngine):
+    """Parallel Scan Engine.
+
+    Runs filters bound to the same extracted data CSV over row aligned
+    byte ranges of the file in a process pool, merging the rows of each
+    range back in file order.  Files no bigger than a single range, and
+    CSVs read straight out of a zip, are scanned serially by ScanEngine.
+
+    If given, `executor' runs the ranges, otherwise a process pool of
+    `processes' workers is created for the scan.
+    """
+    def __init__(self, filters: List[FilterBase], executor: Executor = None,
+                 processes: int = None, chunk_size: int = None):
+        super().__init__(filters)
+        self._executor = executor
+        self._processes = processes
+        self._chunk_size = coalese(chunk_size, DEFAULT_PARALLEL_CHUNK_SIZE)
+
+    @property
+    def chunk_size(self) -> int:
+        return self._chunk_size
+
+    def Run(self) -> List[list]:
+        """Scan the whole file, returning the rows of every filter."""
+        results = [[] for _ in self._filters]
+        if len(self._filters) == 0:
+            return results
+        source = self._filters[0]
+        if (source.zip_member is not None or
+                path.getsize(source.path) <= self.chunk_size):
+            return self.scanAll()
+        with source.openCsv() as csvfile:
+            header = next(csv.reader(csvfile), None)
+        if header is None:
+            return results
+        ranges = split_csv(source.path, self.chunk_size)
+        logger.debug("Scanning %s for %d filters in %d parts",
+                     source.path, len(self._filters), len(ranges))
+        executor = self._executor
+        if executor is None:
+            executor = process_pool(self._processes)
+        try:
+            futures = [executor.submit(scan_range, self._filters,
+                                       source.path, header, start, end)
+                       for start, end in ranges]
+            for future in futures:
+                for rows, part_rows in zip(results, future.result()):
+                    rows.extend(part_rows)
+        finally:
+            if self._executor is None:
+                executor.shutdown()
+        return results
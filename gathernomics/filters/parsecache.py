@@ -0,0 +1,51 @@
+"""Restaurant Site - Gathernomics Parse Cache.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+from datetime import date as Date
+
+from gathernomics.utils import scalar_multiplier, tryint
+
+DATE_KEY = "REF_DATE"
+
+
+class ParseCache(object):
+    """Parse Cache.
+
+    Memoizes what a filter parses from the rows it keeps.  A table has a
+    few hundred distinct reference dates and a handful of scalar factors,
+    so each is parsed only the first time it is seen.  The indicator and
+    category strings of the facts are interned, so the facts of a scan
+    share one copy of each.
+
+    Dates are keyed by REF_DATE alone, so the filter's `getDate' must only
+    depend on REF_DATE, as it does for every filter.
+    """
+    def __init__(self):
+        self._dates = {}
+        self._multipliers = {}
+        self._strings = {}
+
+    def Date(self, table_filter, row: dict) -> Date:
+        ref_date = row[DATE_KEY]
+        if ref_date in self._dates:
+            return self._dates[ref_date]
+        date = self._dates[ref_date] = table_filter.getDate(row)
+        return date
+
+    def Multiplier(self, scalar: str) -> int:
+        multiplier = self._multipliers.get(scalar)
+        if multiplier is None:
+            multiplier = self._multipliers[scalar] = scalar_multiplier(scalar)
+        return multiplier
+
+    def Value(self, value_type: type, value: str, scalar: str) -> int:
+        """Parse and scale VALUE, see FilterBase.value_type."""
+        if value_type is int:
+            return tryint(value) * self.Multiplier(scalar)
+        return int(float(value) * self.Multiplier(scalar))
+
+    def String(self, value: str) -> str:
+        return self._strings.setdefault(value, value)
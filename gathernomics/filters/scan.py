@@ -0,0 +1,210 @@
+"""Restaurant Site - Gathernomics Filter Scan.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+from collections import deque
+import itertools
+import logging
+from typing import Iterator, List, Tuple
+
+from gathernomics.defaults import DEFAULT_SELECTIVITY_SAMPLE_ROWS
+from gathernomics.filters.base import FilterBase
+
+logger = logging.getLogger(name="gathernomics.filters.scan")
+
+
+class FilterEngine(object):
+    """Filter Engine.
+
+    Base of the engines running several filters bound to the same data
+    CSV, which `Run' returns the rows of each filter, in the order the
+    filters were given.
+    """
+    def __init__(self, filters: List[FilterBase]):
+        self._filters = list(filters)
+        for table_filter in self._filters[1:]:
+            if (table_filter.path != self._filters[0].path or
+                    table_filter.zip_member != self._filters[0].zip_member):
+                raise ValueError("Filters must share the same data CSV")
+
+    @property
+    def filters(self) -> List[FilterBase]:
+        return self._filters
+
+    def Run(self) -> List[list]:
+        raise NotImplementedError("Run")
+
+    def scanAll(self) -> List[list]:
+        """Rows of every filter, scanned by ScanEngine."""
+        return ScanEngine(self._filters).Run()
+
+    def scanRest(self, results: List[list], indices: List[int]):
+        """Scan the filters at `indices' by ScanEngine, into `results'."""
+        if len(indices) == 0:
+            return
+        rest_rows = ScanEngine([self._filters[i] for i in indices]).Run()
+        for i, rows in zip(indices, rest_rows):
+            results[i] = rows
+
+
+class ScanEngine(FilterEngine):
+    """Scan Engine.
+
+    Runs several filters bound to the same data CSV over a single pass of
+    the file.  Each line is parsed once and every row is sent to each
+    filter whose compiled predicate accepts it.
+
+    The rows of each filter are available as their own stream.  Streams
+    pull the shared scan forward as they are read and buffer the rows of
+    the other filters until those are read in turn, so streams read far
+    apart hold more rows in memory.  A closed stream stops buffering.
+
+    If given, `observer' is called with every CSV row and the list of rows
+    each filter produced from it (None where the filter rejected it).
+    """
+    def __init__(self, filters: List[FilterBase], observer=None):
+        super().__init__(filters)
+        self._observer = observer
+        self._buffers = [deque() for _ in self._filters]
+        self._active = [True] * len(self._filters)
+        self._csvfile = None
+        self._rows = None
+        self._header = None
+        self._predicates = None
+        self._done = len(self._filters) == 0
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def open(self):
+        source = self._filters[0]
+        logger.debug("Scanning %s for %d filters",
+                     source.path, len(self._filters))
+        self._csvfile = source.openCsv()
+        self._rows = source.readRows(self._csvfile)
+        self._header = next(self._rows, None)
+        if self._header is None:
+            self.close()
+            return
+        # Order the checks of each filter by how many of the first rows
+        # they reject.
+        sample = list(itertools.islice(
+            self._rows, DEFAULT_SELECTIVITY_SAMPLE_ROWS))
+        self._predicates = [table_filter.compile(self._header, sample)
+                            for table_filter in self._filters]
+        self._rows = itertools.chain(sample, self._rows)
+
+    def close(self):
+        self._done = True
+        if self._csvfile is not None:
+            self._csvfile.close()
+            self._csvfile = None
+        self._rows = None
+
+    def fill(self, index: int = None, limit: int = None):
+        """Advance the Scan.
+
+        Scans until the stream `index' has a buffered row, or a stream has
+        `limit' buffered rows, or to the end of the file if both are None.
+        """
+        if self._done:
+            return
+        if self._rows is None:
+            self.open()
+            if self._done:
+                return
+        header = self._header
+        observer = self._observer
+        targets = [(predicate, table_filter.transformRow, buffer)
+                   for predicate, table_filter, buffer, active in zip(
+                       self._predicates, self._filters, self._buffers,
+                       self._active)
+                   if active]
+        wanted = self._buffers[index] if index is not None else None
+        for row in self._rows:
+            full = False
+            row_dict = None
+            if observer is not None:
+                row_dict = dict(zip(header, row))
+                facts = []
+            for predicate, transform_row, buffer in targets:
+                if not predicate(row):
+                    if observer is not None:
+                        facts.append(None)
+                    continue
+                if row_dict is None:
+                    row_dict = dict(zip(header, row))
+                fact = transform_row(row_dict)
+                buffer.append(fact)
+                if limit is not None and len(buffer) >= limit:
+                    full = True
+                if observer is not None:
+                    facts.append(fact)
+            if observer is not None:
+                observer(row_dict, self.expandFacts(facts))
+            if wanted or full:
+                return
+        self.close()
+
+    def expandFacts(self, facts: list) -> list:
+        """Place the facts of the active filters at their filter's index."""
+        if all(self._active):
+            return facts
+        facts = iter(facts)
+        return [next(facts) if active else None for active in self._active]
+
+    def Stream(self, index: int) -> Iterator[dict]:
+        """Rows produced by the filter at `index'."""
+        buffer = self._buffers[index]
+        try:
+            while True:
+                while buffer:
+                    yield buffer.popleft()
+                if self._done:
+                    return
+                self.fill(index)
+        finally:
+            self._active[index] = False
+            buffer.clear()
+            if not any(self._active):
+                self.close()
+
+    def Streams(self) -> List[Iterator[dict]]:
+        """One stream for each filter, in the order the filters were given."""
+        return [self.Stream(i) for i in range(len(self._filters))]
+
+    def Batches(self, size: int) -> Iterator[Tuple[int, list]]:
+        """Batches of Rows.
+
+        Yields the index of a filter and a batch of `size' of its rows
+        whenever the scan has produced that many, then the remaining rows
+        of each filter, so no more than a batch of each is held.
+        """
+        while not self._done:
+            self.fill(limit=size)
+            for i, buffer in enumerate(self._buffers):
+                if len(buffer) >= size or (self._done and buffer):
+                    rows = list(buffer)
+                    buffer.clear()
+                    yield i, rows
+
+    def Run(self) -> List[list]:
+        """Scan the whole file, returning the rows of every filter."""
+        self.fill()
+        results = [list(buffer) for buffer in self._buffers]
+        for buffer in self._buffers:
+            buffer.clear()
+        return results
+
+
+def scan_filters(filters: List[FilterBase], observer=None) -> List[list]:
+    """Scan Filters.
+
+    Runs several filters bound to the same data CSV over a single pass of
+    the file.  Returns the rows of each filter, in the order the filters
+    were given.  See ScanEngine.
+    """
+    return ScanEngine(filters, observer).Run()
@@ -0,0 +1,93 @@
+"""Restaurant Site - Gathernomics Filter Selectivity.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information.
+"""
+
+import json
+import logging
+import os
+import os.path as path
+import threading
+
+from gathernomics.defaults import DEFAULT_SELECTIVITY_PATH
+from gathernomics.filters.base import FilterBase
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name="gathernomics.filters.selectivity")
+
+STATS_VERSION = 2
+
+
+def selectivity_key(table_filter: FilterBase) -> str:
+    """Key of a filter's rates, the filter class and its CSV's name."""
+    csv_name = path.basename(
+        coalese(table_filter.zip_member, table_filter.path))
+    return "{}:{}".format(type(table_filter).__name__, csv_name)
+
+
+class SelectivityStats(object):
+    """Selectivity Stats.
+
+    Persists the rejection rates filters measured for their checks between
+    runs, so engines which only see candidate rows, and so never sample
+    the table, still run the most rejecting checks first.
+    """
+    def __init__(self, stats_path: str = None):
+        self._stats_path = coalese(stats_path, DEFAULT_SELECTIVITY_PATH)
+        self._lock = threading.Lock()
+        self._rates = {}
+        self.load()
+
+    @property
+    def stats_path(self) -> str:
+        return self._stats_path
+
+    def load(self):
+        if not path.isfile(self.stats_path):
+            logger.debug("No selectivity stats found at %s", self.stats_path)
+            return
+        with open(self.stats_path) as f:
+            try:
+                data = json.load(f)
+            except json.decoder.JSONDecodeError:
+                logger.warning(
+                    "Selectivity stats %s is not a json file",
+                    self.stats_path)
+                return
+        if not isinstance(data, dict) or data.get("version") != STATS_VERSION:
+            logger.debug("> Ignoring selectivity stats with unknown version")
+            return
+        for key, rates in data.get("filters", {}).items():
+            if isinstance(rates, dict):
+                self._rates[key] = rates
+
+    def save(self):
+        data = {
+            "version": STATS_VERSION,
+            "filters": self._rates
+        }
+        stats_dir = path.dirname(self.stats_path)
+        if stats_dir and not path.isdir(stats_dir):
+            os.makedirs(stats_dir)
+        temp_path = "{}.tmp".format(self.stats_path)
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.stats_path)
+
+    def Get(self, table_filter: FilterBase) -> dict:
+        """Rejection rates of the filter's checks, or None."""
+        with self._lock:
+            rates = self._rates.get(selectivity_key(table_filter))
+            return dict(rates) if rates is not None else None
+
+    def Put(self, table_filter: FilterBase):
+        """Keep the rates the filter measured, if they changed."""
+        if table_filter.selectivity is None:
+            return
+        key = selectivity_key(table_filter)
+        with self._lock:
+            if self._rates.get(key) == table_filter.selectivity:
+                return
+            self._rates[key] = dict(table_filter.selectivity)
+            self.save()
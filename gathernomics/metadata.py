@@ -0,0 +1,179 @@
+"""Gathernomics - Table Metadata.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import csv
+import io
+import itertools
+import logging
+from typing import Dict, List
+import zipfile
+
+from gathernomics.utils import tryint
+
+logger = logging.getLogger(name=__name__)
+
+# The data CSV names the Geography dimension's column GEO.
+DIMENSION_COLUMNS = {
+    "Geography": "GEO"
+}
+# Dimensions of the coordinates given by the Web Data Service.
+PADDED_DIMENSIONS = 10
+
+
+class TableMetadata(object):
+    """Table Metadata.
+
+    The dimensions of a StatsCan table and the IDs of their members, read
+    from the MetaData CSV which comes with the table's data CSV.  Data
+    rows locate their series with a COORDINATE of member IDs, one for each
+    dimension in order, such as "1.2.1.7".
+    """
+    class Dimension(object):
+        def __init__(self, position: int, name: str):
+            self.position = position
+            self.name = name
+            # Several members of a dimension may share a name.
+            self.members = {}
+
+        @property
+        def column(self) -> str:
+            return DIMENSION_COLUMNS.get(self.name, self.name)
+
+        def AddMember(self, name: str, member_id: int):
+            self.members.setdefault(name, []).append(member_id)
+
+        def MemberIds(self, name: str) -> List[int]:
+            return self.members.get(name, [])
+
+        def AllMemberIds(self) -> List[int]:
+            return sorted(set(itertools.chain(*self.members.values())))
+
+    def __init__(self, product_id: int, dimensions: List[Dimension]):
+        self._product_id = product_id
+        self._dimensions = sorted(dimensions, key=lambda d: d.position)
+        self._columns = {dimension.column: dimension
+                         for dimension in self._dimensions}
+
+    @property
+    def product_id(self) -> int:
+        return self._product_id
+
+    @property
+    def dimensions(self) -> List[Dimension]:
+        return self._dimensions
+
+    def ColumnDimension(self, column: str) -> Dimension:
+        """The dimension shown in a data CSV column, or None."""
+        return self._columns.get(column)
+
+    def ResolveMembers(self, column: str, labels: List[str]) -> List[int]:
+        """Member IDs of the labels of a dimension.
+
+        Raises ValueError if a label is not a member of the dimension,
+        which happens when StatsCan renames a member.
+        """
+        dimension = self.ColumnDimension(column)
+        if dimension is None:
+            raise ValueError("Table {} has no dimension {}".format(
+                self.product_id, column))
+        member_ids = []
+        for label in labels:
+            ids = dimension.MemberIds(label)
+            if len(ids) == 0:
+                raise ValueError(
+                    "Table {} has no member \"{}\" of dimension {}".format(
+                        self.product_id, label, dimension.name))
+            member_ids.extend(ids)
+        return member_ids
+
+    def Coordinates(self, constraints: Dict[int, List[int]],
+                    limit: int) -> set:
+        """Coordinates of Constrained Members.
+
+        Returns every coordinate whose member IDs are within the
+        constraints, a map of dimension position to allowed member IDs,
+        both as in the data CSV and padded as given by the Web Data
+        Service.  Returns None if there would be more than `limit'.
+        """
+        choices = []
+        count = 1
+        for dimension in self.dimensions:
+            ids = constraints.get(
+                dimension.position, dimension.AllMemberIds())
+            choices.append([str(member_id) for member_id in ids])
+            count *= len(ids)
+            if count > limit:
+                return None
+        padding = [] if len(choices) >= PADDED_DIMENSIONS else \
+            ["0"] * (PADDED_DIMENSIONS - len(choices))
+        coordinates = set()
+        for members in itertools.product(*choices):
+            coordinates.add(".".join(members))
+            if padding:
+                coordinates.add(".".join(itertools.chain(members, padding)))
+        return coordinates
+
+    @staticmethod
+    def readSections(csvfile) -> List[List[list]]:
+        """Split the MetaData CSV into its blank line separated tables."""
+        sections = [[]]
+        for row in csv.reader(csvfile):
+            if len(row) == 0 or all(len(cell) == 0 for cell in row):
+                if len(sections[-1]) > 0:
+                    sections.append([])
+                continue
+            sections[-1].append(row)
+        return [section for section in sections if len(section) > 0]
+
+    @classmethod
+    def Load(cls, csv_path: str, zip_member: str = None):
+        """Load a MetaData CSV, from a zip when `zip_member' is given.
+
+        Returns None if it has no dimensions.
+        """
+        if zip_member is None:
+            csvfile = open(csv_path, mode="r", encoding="utf-8-sig")
+        else:
+            with zipfile.ZipFile(csv_path, "r") as zipref:
+                csvfile = io.TextIOWrapper(
+                    zipref.open(zip_member, "r"),
+                    encoding="utf-8-sig", newline="")
+        with csvfile:
+            sections = cls.readSections(csvfile)
+        product_id = None
+        dimensions = {}
+        members = None
+        for section in sections:
+            header = section[0]
+            if "Product Id" in header and len(section) > 1:
+                product_id = tryint(
+                    section[1][header.index("Product Id")].strip())
+            elif "Dimension name" in header:
+                id_index = header.index("Dimension ID")
+                name_index = header.index("Dimension name")
+                for row in section[1:]:
+                    if len(row) <= max(id_index, name_index):
+                        continue
+                    position = tryint(row[id_index].strip())
+                    dimensions[position] = cls.Dimension(
+                        position, row[name_index])
+            elif "Member ID" in header and "Member Name" in header:
+                members = section
+        if len(dimensions) == 0 or members is None:
+            logger.debug("No dimensions in %s", csv_path)
+            return None
+        header = members[0]
+        dimension_index = header.index("Dimension ID")
+        name_index = header.index("Member Name")
+        id_index = header.index("Member ID")
+        for row in members[1:]:
+            if len(row) <= max(dimension_index, name_index, id_index):
+                continue
+            dimension = dimensions.get(tryint(row[dimension_index].strip()))
+            if dimension is not None:
+                dimension.AddMember(
+                    row[name_index], tryint(row[id_index].strip()))
+        return cls(product_id, list(dimensions.values()))
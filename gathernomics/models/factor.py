@@ -4,10 +4,14 @@ Copyright (c) 2018 Alex Dale
 See LICENSE for information.
 """
 
+import itertools
 import logging
 from datetime import date as Date
 from enum import Enum
 
+import psycopg2.extras
+
+from gathernomics.factframe import FactFrame
 from gathernomics.models.base import ModelBase
 from gathernomics.models.sourcetbl import SourceTable
 
@@ -129,6 +133,50 @@ class FinancialFactor(ModelBase):
             factors.append(cls._CreateFromRow(row))
         return factors
 
+    @classmethod
+    def InsertFrame(cls, frame: FactFrame, source_table: SourceTable,
+                    page_size: int = 1000) -> int:
+        """Insert the Facts of a Frame.
+
+        Inserts every fact of a FactFrame as a Financial Factor of the
+        source table in one transaction, `page_size' rows per statement.
+        The rows are read off the frame's columns, looking the codes of
+        the dictionary encoded ones up in their values, so each distinct
+        frequency is turned into a string once.  Returns the number of
+        factors inserted.
+        """
+        if (source_table is None
+                or source_table.table_id is None
+                or not source_table.IsInDatabase()):
+            raise ValueError("Source Table must exist in DB")
+        if len(frame) == 0:
+            return 0
+
+        columns = frame.columns
+        frequencies = [str(frequency)
+                       for frequency in columns["frequency"].values]
+        rows = zip(
+            frame.values,
+            map(frequencies.__getitem__, columns["frequency"].codes),
+            map(columns["indicator"].values.__getitem__,
+                columns["indicator"].codes),
+            map(columns["category"].values.__getitem__,
+                columns["category"].codes),
+            frame.Dates(),
+            itertools.repeat(source_table.table_id))
+
+        connection = cls.CreateConnection()
+        cursor = connection.cursor()
+
+        psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO FinancialFactor (FiscalValue, Frequency, "
+            "Indicator, MainCategory, Date, TableID) VALUES %s",
+            rows, page_size=page_size)
+        connection.commit()
+        connection.close()
+        return len(frame)
+
     @classmethod
     def _CreateFromRow(cls, row: dict) -> ModelBase:
         """Create Financial Factor from Row Result."""
@@ -0,0 +1,192 @@
+"""Gathernomics - Row Pipeline.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from collections import deque
+import io
+from itertools import islice
+import logging
+import pickle
+import tempfile
+import threading
+from typing import Iterable, Iterator
+
+from gathernomics.defaults import DEFAULT_PIPELINE_BATCHES
+from gathernomics.factframe import FactFrame
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name=__name__)
+
+
+def iter_frames(rows: Iterable[dict], size: int) -> Iterator[FactFrame]:
+    """Pack rows into FactFrames of at most `size' rows."""
+    rows = iter(rows)
+    while True:
+        frame = FactFrame.FromFacts(islice(rows, size))
+        if len(frame) == 0:
+            return
+        yield frame
+
+
+class IncompleteTableError(Exception):
+    """A table failed after some of its rows were consumed."""
+    def __init__(self, index: int):
+        super().__init__(
+            "Table {} failed after some of its rows were consumed".format(
+                index))
+        self.index = index
+
+
+class TableQueue(object):
+    """Table Queue.
+
+    The batches of a table waiting to be consumed.  The first batches are
+    held in memory and, once more are put than `max_batches', those that
+    follow are pickled to a temporary file until the file is read back.
+    """
+    def __init__(self, max_batches: int):
+        self._max_batches = max_batches
+        self._batches = deque()
+        self._spill = None
+        self._spilled = 0
+        self._read = 0
+        self._read_offset = 0
+        self.finished = False
+        self.failed = False
+
+    def __len__(self) -> int:
+        return len(self._batches) + self._spilled - self._read
+
+    @property
+    def spilled(self) -> bool:
+        """Whether batches are waiting in the temporary file."""
+        return self._read < self._spilled
+
+    @property
+    def full(self) -> bool:
+        """Whether a batch put now would be spilled."""
+        return self.spilled or len(self._batches) >= self._max_batches
+
+    def Put(self, rows: FactFrame):
+        if not self.full:
+            self._batches.append(rows)
+            return
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(
+                prefix="gathernomics-", suffix=".spill")
+        self._spill.seek(0, io.SEEK_END)
+        pickle.dump(rows, self._spill, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spilled += 1
+
+    def Get(self) -> FactFrame:
+        """The oldest batch, or None if there is none."""
+        if self._batches:
+            return self._batches.popleft()
+        if not self.spilled:
+            return None
+        self._spill.seek(self._read_offset)
+        rows = pickle.load(self._spill)
+        self._read_offset = self._spill.tell()
+        self._read += 1
+        if not self.spilled:
+            # Reuse the file for the batches spilled from now on.
+            self._spill.seek(0)
+            self._spill.truncate()
+            self._spilled = self._read = self._read_offset = 0
+        return rows
+
+    def Clear(self):
+        self._batches.clear()
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        self._spilled = self._read = self._read_offset = 0
+
+
+class RowPipeline(object):
+    """Row Pipeline.
+
+    Hands batches of the rows of several tables, as FactFrames, produced
+    concurrently, to a single consumer in table order, so the output is
+    the same whichever table finishes first.  Producers `Put' the batches
+    of each table and `Finish' it, or `Fail' it, the consumer reads
+    `Batches'.
+
+    Every table holds at most `max_batches' in memory.  The producer of
+    the table being consumed waits for the consumer to catch up, while
+    the batches of tables further on are spilled to a temporary file
+    until their turn, as a producer waiting on one of them could hold up
+    the table being consumed.
+
+    The batches of a table which fails before its turn are dropped.  One
+    failing during its turn raises IncompleteTableError from `Batches',
+    as some of its rows were already consumed.
+    """
+    def __init__(self, count: int, max_batches: int = None):
+        self._max_batches = coalese(max_batches, DEFAULT_PIPELINE_BATCHES)
+        self._condition = threading.Condition()
+        self._tables = [TableQueue(self._max_batches) for _ in range(count)]
+        self._head = 0
+        self._head_consumed = False
+        self._closed = False
+
+    @property
+    def max_batches(self) -> int:
+        return self._max_batches
+
+    def Put(self, index: int, rows: FactFrame):
+        """Add a batch of the rows of table `index'."""
+        table = self._tables[index]
+        with self._condition:
+            while (not self._closed and index == self._head and
+                   table.full):
+                self._condition.wait()
+            if self._closed or table.failed:
+                return
+            table.Put(rows)
+            self._condition.notify_all()
+
+    def Finish(self, index: int):
+        """Mark table `index' as complete."""
+        with self._condition:
+            self._tables[index].finished = True
+            self._condition.notify_all()
+
+    def Fail(self, index: int):
+        """Mark table `index' as failed, dropping its batches."""
+        with self._condition:
+            table = self._tables[index]
+            table.failed = table.finished = True
+            table.Clear()
+            self._condition.notify_all()
+
+    def Close(self):
+        """Stop the pipeline, dropping any further batches."""
+        with self._condition:
+            self._closed = True
+            for table in self._tables:
+                table.Clear()
+            self._condition.notify_all()
+
+    def Batches(self) -> Iterator[FactFrame]:
+        """Batches of every table in table order, as they are produced."""
+        while True:
+            with self._condition:
+                if self._head >= len(self._tables):
+                    return
+                table = self._tables[self._head]
+                while len(table) == 0 and not table.finished:
+                    self._condition.wait()
+                if table.failed and self._head_consumed:
+                    raise IncompleteTableError(self._head)
+                rows = table.Get()
+                if rows is None:
+                    self._head += 1
+                    self._head_consumed = False
+                    self._condition.notify_all()
+                    continue
+                self._head_consumed = True
+                self._condition.notify_all()
+            yield rows
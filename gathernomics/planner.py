@@ -0,0 +1,61 @@
+"""Gathernomics - Run Planner.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from collections import OrderedDict
+import logging
+from typing import List
+
+from gathernomics.descriptor import TableDescriptor
+from gathernomics.models.sourcetbl import SourceTableType
+
+logger = logging.getLogger(name=__name__)
+
+
+class TableGroup(object):
+    """Table Group.
+
+    The configured tables which share a single source URL.  A group can
+    be handed to the downloader in place of a TableDescriptor, so the
+    source is fetched and extracted once for all of its tables.
+    """
+    def __init__(self, url: str, tables: List[TableDescriptor]):
+        self._url = url
+        self._tables = list(tables)
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def tables(self) -> List[TableDescriptor]:
+        return self._tables
+
+    @property
+    def name(self) -> str:
+        return self._tables[0].name
+
+    @property
+    def source(self) -> SourceTableType:
+        return self._tables[0].source
+
+
+def plan_tables(tables: List[TableDescriptor]) -> List[TableGroup]:
+    """Plan Tables.
+
+    Groups tables by URL, keeping groups in the order their first table
+    appears.
+    """
+    grouped = OrderedDict()
+    for table in tables:
+        grouped.setdefault(table.url, []).append(table)
+    groups = [TableGroup(url, group_tables)
+              for url, group_tables in grouped.items()]
+    for group in groups:
+        if len(group.tables) > 1:
+            logger.debug(
+                "Sharing %s between tables: %s", group.url,
+                ", ".join(table.name for table in group.tables))
+    return groups
@@ -0,0 +1,131 @@
+"""Gathernomics - Compression Directory Manager.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import logging
+import os
+import os.path as path
+import shutil
+import threading
+from typing import List, Tuple
+
+from gathernomics.defaults import DEFAULT_COMP_DIR_BUDGET
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name=__name__)
+
+
+def disk_usage(entry_path: str) -> int:
+    """Bytes used by a file, or by every file under a directory."""
+    if not path.isdir(entry_path):
+        return path.getsize(entry_path) if path.isfile(entry_path) else 0
+    total = 0
+    for dirpath, _, filenames in os.walk(entry_path):
+        for filename in filenames:
+            file_path = path.join(dirpath, filename)
+            if path.isfile(file_path):
+                total += path.getsize(file_path)
+    return total
+
+
+class CompressionDirManager(object):
+    """Compression Directory Manager.
+
+    Keeps the zips, extraction directories and partial downloads in the
+    compression directory within a byte budget.  Entries are evicted least
+    recently used first, using their modification time, which is bumped
+    every time an entry is used.  Entries acquired by this process are in
+    use and are never evicted.
+    """
+    def __init__(self, directory: str, budget: int = None):
+        self._directory = directory
+        self._budget = coalese(budget, DEFAULT_COMP_DIR_BUDGET)
+        self._pins = {}
+        self._lock = threading.RLock()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def budget(self) -> int:
+        return self._budget
+
+    @staticmethod
+    def Touch(entry_path: str):
+        """Mark an entry as just used."""
+        if path.exists(entry_path):
+            os.utime(entry_path)
+
+    def Acquire(self, entry_path: str):
+        """Mark an entry as in use, protecting it from eviction."""
+        with self._lock:
+            self._pins[entry_path] = self._pins.get(entry_path, 0) + 1
+        self.Touch(entry_path)
+
+    def Release(self, entry_path: str):
+        with self._lock:
+            count = self._pins.get(entry_path, 0) - 1
+            if count > 0:
+                self._pins[entry_path] = count
+            else:
+                self._pins.pop(entry_path, None)
+
+    def IsInUse(self, entry_path: str) -> bool:
+        with self._lock:
+            return entry_path in self._pins
+
+    def Remove(self, entry_path: str) -> bool:
+        """Remove an entry unless it is in use."""
+        with self._lock:
+            if self.IsInUse(entry_path):
+                logger.debug("Not removing %s, it is in use", entry_path)
+                return False
+            if path.isdir(entry_path):
+                shutil.rmtree(entry_path, ignore_errors=True)
+            elif path.exists(entry_path):
+                os.remove(entry_path)
+            return True
+
+    def Entries(self) -> List[Tuple[str, int, float]]:
+        """Path, size and last use of every entry, oldest first."""
+        entries = []
+        if not path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            entry_path = path.join(self.directory, name)
+            try:
+                last_used = path.getmtime(entry_path)
+            except OSError:
+                continue  # Removed by someone else.
+            entries.append((entry_path, disk_usage(entry_path), last_used))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def Usage(self) -> int:
+        return sum(size for _, size, _ in self.Entries())
+
+    def Evict(self) -> int:
+        """Evict Entries Until Within Budget.
+
+        Returns the number of bytes freed.
+        """
+        with self._lock:
+            entries = self.Entries()
+            usage = sum(size for _, size, _ in entries)
+            freed = 0
+            for entry_path, size, _ in entries:
+                if usage - freed <= self.budget:
+                    break
+                if self.IsInUse(entry_path):
+                    continue
+                logger.debug("Evicting %s (%d bytes)", entry_path, size)
+                if self.Remove(entry_path):
+                    freed += size
+        if usage - freed > self.budget:
+            logger.warning(
+                "Compression directory uses %d bytes, over its budget of %d",
+                usage - freed, self.budget)
+        return freed
@@ -4,7 +4,9 @@ Copyright (c) 2018 Alex Dale
 See LICENSE for information
 """
 
+import argparse
 from datetime import datetime as DateTime
+import functools
 import sys
 import time
 
@@ -35,6 +37,22 @@ def tryint(value: str) -> int:
     return 0
 
 
+def positive_int(value: str) -> int:
+    """Positive Int.
+
+    Argument type of options which must be a whole number above zero.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid int value: {!r}".format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "must be at least 1, not {}".format(number))
+    return number
+
+
 def packeddatestring() -> str:
     """Packed Date String."""
     dt = DateTime.fromtimestamp(time.time())
@@ -53,14 +71,18 @@ def name_to_filename(name: str) -> str:
     return alnum_name.replace(" ", "_")
 
 
+SCALAR_MULTIPLIERS = {
+    "thousands": 1000,
+    "thousand": 1000,
+    "millions": 1000000,
+    "million": 1000000,
+    "billions": 1000000000,
+    "billion": 1000000000,
+    "trillions": 1000000000000,
+    "trillion": 1000000000000
+}
+
+
+@functools.lru_cache(maxsize=64)
 def scalar_multiplier(scalar: str):
-    return {
-        "thousands": 1000,
-        "thousand": 1000,
-        "millions": 1000000,
-        "million": 1000000,
-        "billions": 1000000000,
-        "billion": 1000000000,
-        "trillions": 1000000000000,
-        "trillion": 1000000000000
-    }.get(scalar.lower(), 1)
+    return SCALAR_MULTIPLIERS.get(scalar.lower(), 1)
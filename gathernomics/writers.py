@@ -0,0 +1,734 @@
+"""Gathernomics - Output Writers.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from array import array
+import bz2
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import date as Date
+import gzip
+import hashlib
+import io
+import json
+import logging
+import lzma
+import os
+import os.path as path
+import re
+import sys
+import tempfile
+import threading
+
+from gathernomics.columnfile import (
+    ALIGNMENT, EPOCH_ORDINAL, HEADER_LENGTH, MAGIC, NO_DATE, VERSION, align)
+from gathernomics.defaults import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_COLUMNAR_BUFFER_ROWS,
+    DEFAULT_COMPRESS_BUFFER_SIZE, DEFAULT_OPEN_PARTITIONS,
+    DEFAULT_PIPELINE_BATCHES, DEFAULT_WRITERS)
+from gathernomics.factframe import (
+    DICTIONARY_FIELDS, FIELDS, NO_DATE as NO_ORDINAL, FactFrame)
+from gathernomics.utils import coalese
+
+logger = logging.getLogger(name=__name__)
+
+# Suffix, opener and name of the level argument of each --compress choice.
+COMPRESSIONS = {
+    "gzip": (".gz", gzip.open, "compresslevel"),
+    "xz": (".xz", lzma.open, "preset"),
+    "bz2": (".bz2", bz2.open, "compresslevel"),
+}
+# Lowest and highest --compress-level of each --compress choice.
+COMPRESSION_LEVELS = {
+    "gzip": (1, 9),
+    "xz": (0, 9),
+    "bz2": (1, 9),
+}
+
+
+def compression_of(output_path: str) -> str:
+    """Compression implied by the suffix of a path, or None."""
+    for name, (suffix, _, _) in COMPRESSIONS.items():
+        if output_path.endswith(suffix):
+            return name
+    return None
+
+
+class Compression(object):
+    """Compression.
+
+    Compresses an output file as it is written, with one of the
+    COMPRESSIONS at `level' (the module's default if None).  Writes are
+    gathered into `buffer_size' bytes before they are compressed.
+    """
+    def __init__(self, name: str, level: int = None,
+                 buffer_size: int = None):
+        if name not in COMPRESSIONS:
+            raise ValueError("Unknown compression {}".format(name))
+        lowest, highest = COMPRESSION_LEVELS[name]
+        if level is not None and not lowest <= level <= highest:
+            raise ValueError("The {} level must be {}-{}, not {}".format(
+                name, lowest, highest, level))
+        if buffer_size is not None and buffer_size < 1:
+            raise ValueError("The compression buffer must be positive")
+        self._name = name
+        self._level = level
+        self._buffer_size = coalese(buffer_size, DEFAULT_COMPRESS_BUFFER_SIZE)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def suffix(self) -> str:
+        return COMPRESSIONS[self._name][0]
+
+    def Open(self, file_path: str, binary: bool = False,
+             append: bool = False):
+        """Open a file to write through the compressor.
+
+        Appending adds a stream to the file, which the decompressors read
+        as the continuation of the earlier ones.
+        """
+        _, opener, level_argument = COMPRESSIONS[self._name]
+        arguments = {}
+        if self._level is not None:
+            arguments[level_argument] = self._level
+        file = io.BufferedWriter(
+            opener(file_path, "ab" if append else "wb", **arguments),
+            buffer_size=self._buffer_size)
+        if binary:
+            return file
+        return io.TextIOWrapper(file)
+
+
+class RowWriter(object):
+    """Row Writer.
+
+    Writes batches of output rows, as FactFrames, to a file as they are
+    produced.  The file is only created once there are rows to write, so
+    a run without any rows leaves no output.
+    """
+    # Suffix of the files of the format.
+    SUFFIX = ""
+
+    def __init__(self, output_path: str, compression: Compression = None):
+        self._output_path = output_path
+        self._compression = compression
+        self._rows = 0
+        self._opened = False
+        self._suspended = False
+
+    @property
+    def output_path(self) -> str:
+        return self._output_path
+
+    @property
+    def rows(self) -> int:
+        """Rows written so far."""
+        return self._rows
+
+    def openFile(self, binary: bool = False, append: bool = False):
+        """Open the output path, through its compression if any."""
+        if self._compression is not None:
+            return self._compression.Open(self.output_path, binary, append)
+        mode = "a" if append else "w"
+        return open(self.output_path, mode + "b" if binary else mode)
+
+    def open(self):
+        raise NotImplementedError("open")
+
+    def writeFrame(self, frame: FactFrame):
+        raise NotImplementedError("writeFrame")
+
+    def close(self):
+        raise NotImplementedError("close")
+
+    def abort(self):
+        raise NotImplementedError("abort")
+
+    def suspend(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def removeOutput(self):
+        if path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def WriteFrame(self, frame: FactFrame):
+        if len(frame) == 0:
+            return
+        if not self._opened:
+            logger.debug("Writing output to %s", self.output_path)
+            self.open()
+            self._opened = True
+        elif self._suspended:
+            self.resume()
+            self._suspended = False
+        self.writeFrame(frame)
+        self._rows += len(frame)
+
+    def Suspend(self):
+        """Close the file until more rows are written, appending those."""
+        if self._opened and not self._suspended:
+            self.suspend()
+            self._suspended = True
+
+    def Close(self):
+        if self._opened:
+            self.close()
+            self._opened = False
+            self._suspended = False
+            logger.debug("> Wrote %d rows", self.rows)
+
+    def Abort(self):
+        """Stop writing and remove the output written so far."""
+        if self._opened:
+            self.abort()
+            self._opened = False
+            self._suspended = False
+            logger.debug("> Removed %s", self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+
+class CsvRowWriter(RowWriter):
+    """CSV Row Writer."""
+    SUFFIX = ".csv"
+
+    def __init__(self, output_path: str, compression: Compression = None):
+        super().__init__(output_path, compression)
+        self._file = None
+        self._writer = None
+
+    def open(self):
+        self._file = self.openFile()
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(FIELDS)
+
+    def writeFrame(self, frame: FactFrame):
+        self._writer.writerows(frame.Rows())
+        if self._compression is None:
+            # Make each batch available to readers of the file as it
+            # comes, compressed output is gathered into larger blocks.
+            self._file.flush()
+
+    def suspend(self):
+        self._file.close()
+        self._file = None
+        self._writer = None
+
+    def resume(self):
+        self._file = self.openFile(append=True)
+        self._writer = csv.writer(self._file)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._writer = None
+
+    def abort(self):
+        self.close()
+        self.removeOutput()
+
+
+def little_endian(column: array) -> array:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+class SpilledSeries(object):
+    """Spilled Series.
+
+    The values and dates of a series of a ColumnarRowWriter gathered in
+    memory, and the offsets and number of rows of the blocks of them
+    already spilled.
+    """
+    def __init__(self):
+        self.values = array("q")
+        self.dates = array("i")
+        self.blocks = []
+        self.rows = 0
+
+
+class ColumnarRowWriter(RowWriter):
+    """Columnar Row Writer.
+
+    Writes the binary columnar format of gathernomics.columnfile.  Rows
+    are grouped by series, so the values and dates of each series are
+    gathered and, every `buffer_rows' rows, spilled a block per series to
+    a temporary file.  Closing copies the blocks of each series into the
+    columns of the file.  Suspending spills every series and closes the
+    temporary file until more rows come.
+    """
+    SUFFIX = ".gcol"
+
+    def __init__(self, output_path: str, compression: Compression = None,
+                 buffer_rows: int = None):
+        super().__init__(output_path, compression)
+        self._buffer_rows = coalese(buffer_rows, DEFAULT_COLUMNAR_BUFFER_ROWS)
+        self._file = None
+        self._spill = None
+        self._spill_path = None
+        self._series = {}
+        self._buffered = 0
+
+    def open(self):
+        handle, self._spill_path = tempfile.mkstemp(
+            prefix="gathernomics-", suffix=".gcol")
+        self._spill = os.fdopen(handle, "w+b")
+
+    def suspend(self):
+        self.spillSeries()
+        self._spill.close()
+        self._spill = None
+
+    def resume(self):
+        self._spill = open(self._spill_path, "r+b")
+        self._spill.seek(0, io.SEEK_END)
+
+    def writeFrame(self, frame: FactFrame):
+        codes = [frame.columns[field].codes for field in DICTIONARY_FIELDS]
+        frame_series = {}
+        for key, value, date in zip(zip(*codes), frame.values, frame.dates):
+            series = frame_series.get(key)
+            if series is None:
+                series = frame_series[key] = self.getSeries(frame, key)
+            series.values.append(value)
+            series.dates.append(date)
+        self._buffered += len(frame)
+        if self._buffered >= self._buffer_rows:
+            self.spillSeries()
+
+    def getSeries(self, frame: FactFrame, key: tuple) -> SpilledSeries:
+        """Series of the dictionary codes `key'."""
+        series_key = tuple(
+            None if value is None else str(value)
+            for value in (frame.columns[field].values[code]
+                          for field, code in zip(DICTIONARY_FIELDS, key)))
+        series = self._series.get(series_key)
+        if series is None:
+            series = self._series[series_key] = SpilledSeries()
+        return series
+
+    def spillSeries(self):
+        """Write the gathered rows of each series as a block."""
+        for series in self._series.values():
+            if len(series.values) == 0:
+                continue
+            series.blocks.append((self._spill.tell(), len(series.values)))
+            series.rows += len(series.values)
+            series.values.tofile(self._spill)
+            series.dates.tofile(self._spill)
+            series.values = array("q")
+            series.dates = array("i")
+        self._buffered = 0
+
+    def readBlock(self, offset: int, rows: int) -> tuple:
+        """Values and dates of a spilled block."""
+        self._spill.seek(offset)
+        values = array("q")
+        values.fromfile(self._spill, rows)
+        dates = array("i")
+        dates.fromfile(self._spill, rows)
+        return values, dates
+
+    def close(self):
+        if self._spill is None:
+            self.resume()
+        self.spillSeries()
+        dictionaries = {field: {} for field in DICTIONARY_FIELDS}
+        codes = []
+        for series_key in self._series:
+            codes.append(tuple(
+                dictionaries[field].setdefault(value, len(dictionaries[field]))
+                for field, value in zip(DICTIONARY_FIELDS, series_key)))
+        columns = [("value", "<i8", "q", None), ("date", "<M8[D]", "q", None)]
+        for field in DICTIONARY_FIELDS:
+            wide = len(dictionaries[field]) > 65536
+            columns.append((field, "<u4" if wide else "<u2",
+                            "I" if wide else "H", list(dictionaries[field])))
+        header, start = self.layout(columns)
+        self._file = self.openFile(binary=True)
+        self._file.write(MAGIC)
+        self._file.write(HEADER_LENGTH.pack(len(header)))
+        self._file.write(header)
+        for index, (name, _, typecode, _) in enumerate(columns):
+            self._file.write(b"\0" * (start - self._file.tell()))
+            for series, series_codes in zip(self._series.values(), codes):
+                if name not in ("value", "date"):
+                    column = array(typecode, [series_codes[index - 2]])
+                    column *= series.rows
+                    little_endian(column).tofile(self._file)
+                    continue
+                for offset, rows in series.blocks:
+                    values, dates = self.readBlock(offset, rows)
+                    if name == "value":
+                        column = values
+                    else:
+                        column = array("q", (
+                            NO_DATE if ordinal == NO_ORDINAL
+                            else ordinal - EPOCH_ORDINAL
+                            for ordinal in dates))
+                    little_endian(column).tofile(self._file)
+            start = align(self._file.tell())
+        self._file.close()
+        self._file = None
+        self.closeSpill()
+
+    def closeSpill(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+        if path.exists(self._spill_path):
+            os.remove(self._spill_path)
+        self._series = {}
+        self._buffered = 0
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.closeSpill()
+        self.removeOutput()
+
+    def layout(self, columns: list) -> tuple:
+        """Header of the file, padded, and the offset of its first column.
+
+        The offsets of the columns are in the header, so the header is
+        laid out again until it fits before the first column.
+        """
+        start = 0
+        while True:
+            offset = start
+            header = {"version": VERSION, "rows": self.rows,
+                      "alignment": ALIGNMENT, "columns": {}, "series": []}
+            for name, dtype, typecode, dictionary in columns:
+                header["columns"][name] = {"dtype": dtype, "offset": offset}
+                if dictionary is not None:
+                    header["columns"][name]["dictionary"] = dictionary
+                offset = align(offset + array(typecode).itemsize * self.rows)
+            row = 0
+            for series_key, series in self._series.items():
+                entry = dict(zip(DICTIONARY_FIELDS, series_key))
+                entry.update(start=row, rows=series.rows)
+                header["series"].append(entry)
+                row += series.rows
+            encoded = json.dumps(header).encode("utf-8")
+            end = len(MAGIC) + HEADER_LENGTH.size + len(encoded)
+            if end <= start:
+                return encoded + b" " * (start - end), start
+            start = align(end)
+
+
+# Writers of the --output-format choices.
+OUTPUT_FORMATS = {
+    "csv": CsvRowWriter,
+    "columnar": ColumnarRowWriter,
+}
+
+
+# Name of the manifest of a partitioned output directory.
+MANIFEST_NAME = "manifest.json"
+# Fields of the partitions of each --partition choice.
+PARTITION_FIELDS = {
+    "indicator": ["category", "indicator"],
+    "frequency": ["category", "indicator", "frequency"],
+}
+
+
+def partition_name(value) -> str:
+    """Part of a partition's file name for a value, safe on any system."""
+    if value is None:
+        return "none"
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", str(value)).strip(".-") or "-"
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(DEFAULT_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Partition(object):
+    """Partition.
+
+    The writer of one partition of a PartitionedRowWriter, with the
+    frames waiting to be written to it.  At most one task of the pool
+    writes a partition at a time, so its rows stay in order, and `lock'
+    is held while its file is written or suspended.
+    """
+    def __init__(self, key: dict, writer: RowWriter):
+        self.key = key
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.scheduled = False
+        self.first = None
+        self.last = None
+        self.sha256 = None
+
+    def Manifest(self, directory: str) -> dict:
+        entry = dict(self.key)
+        entry.update(
+            path=path.relpath(self.writer.output_path, directory),
+            rows=self.writer.rows,
+            since=(None if self.first is None
+                   else Date.fromordinal(self.first).isoformat()),
+            until=(None if self.last is None
+                   else Date.fromordinal(self.last).isoformat()),
+            sha256=self.sha256)
+        return entry
+
+
+class PartitionedRowWriter(RowWriter):
+    """Partitioned Row Writer.
+
+    Writes the rows of each partition, a distinct category and indicator
+    (and frequency), to a file of its own within the output directory,
+    `<category>/<indicator>[.<frequency>]<suffix>', in any of the
+    OUTPUT_FORMATS.  Frames are split by partition and the partitions
+    are written by a pool of `writers' threads as the rows come, at most
+    `max_batches' frames a writer behind.  Closing writes `manifest.json'
+    with the path, number of rows, date range and SHA-256 of each file.
+
+    At most `max_open' partitions keep their file open, and with it its
+    compressor, the least recently written one is suspended past those.
+    A suspended compressed file is continued with a new stream.
+    """
+    def __init__(self, output_path: str, output_format: str = None,
+                 partition: str = None, writers: int = None,
+                 max_batches: int = None, compression: Compression = None,
+                 max_open: int = None):
+        super().__init__(output_path, compression)
+        self._output_format = coalese(output_format, "csv")
+        self._fields = PARTITION_FIELDS[coalese(partition, "indicator")]
+        self._writers = coalese(writers, DEFAULT_WRITERS)
+        self._max_pending = self._writers * coalese(
+            max_batches, DEFAULT_PIPELINE_BATCHES)
+        self._max_open = coalese(max_open, DEFAULT_OPEN_PARTITIONS)
+        self._partitions = {}
+        self._paths = set()
+        # Partitions with an open file, the least recently written first.
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = None
+        self._executor = None
+        self._error = None
+
+    def open(self):
+        os.makedirs(self.output_path, exist_ok=True)
+        self._pending = threading.Semaphore(self._max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self._writers)
+
+    def partitionPath(self, key: tuple, suffix: str) -> str:
+        """Path of the file of a partition.
+
+        The names of distinct keys may collide, such as those of
+        "GDP (real)" and "GDP real", of a missing value and "none", or of
+        names differing only in case.  The first key keeps the name, the
+        others get a short hash of the key added to it.
+        """
+        names = [partition_name(value) for value in key]
+        base = path.join(self.output_path, names[0], ".".join(names[1:]))
+        file_path = base + suffix
+        if file_path.lower() in self._paths:
+            digest = hashlib.sha256(
+                json.dumps(list(key)).encode("utf-8")).hexdigest()
+            file_path = "{}-{}{}".format(base, digest[:8], suffix)
+        self._paths.add(file_path.lower())
+        return file_path
+
+    def getPartition(self, key: tuple) -> Partition:
+        partition = self._partitions.get(key)
+        if partition is None:
+            writer_type = OUTPUT_FORMATS[self._output_format]
+            suffix = writer_type.SUFFIX
+            if self._compression is not None:
+                suffix += self._compression.suffix
+            file_path = self.partitionPath(key, suffix)
+            os.makedirs(path.dirname(file_path), exist_ok=True)
+            partition = self._partitions[key] = Partition(
+                dict(zip(self._fields, key)),
+                writer_type(file_path, self._compression))
+        return partition
+
+    def writeFrame(self, frame: FactFrame):
+        self.checkError()
+        columns = [frame.columns[field] for field in self._fields]
+        frame_keys = {}
+        indices = {}
+        for row, codes in enumerate(zip(*[column.codes
+                                          for column in columns])):
+            if codes not in indices:
+                indices[codes] = []
+                frame_keys[codes] = tuple(
+                    None if column.values[code] is None
+                    else str(column.values[code])
+                    for column, code in zip(columns, codes))
+            indices[codes].append(row)
+        for codes, rows in indices.items():
+            partition = self.getPartition(frame_keys[codes])
+            self._pending.acquire()
+            with self._lock:
+                partition.pending.append(frame.Take(rows))
+                if partition.scheduled:
+                    continue
+                partition.scheduled = True
+            self._executor.submit(self.drain, partition)
+
+    def drain(self, partition: Partition):
+        """Write the pending frames of a partition, run by the pool."""
+        while True:
+            with self._lock:
+                if len(partition.pending) == 0:
+                    partition.scheduled = False
+                    return
+                frame = partition.pending.popleft()
+            try:
+                if self._error is None:
+                    self.writePartition(partition, frame)
+            except Exception as error:
+                logger.exception("Failed to write %s",
+                                 partition.writer.output_path)
+                self._error = error
+            finally:
+                self._pending.release()
+
+    def writePartition(self, partition: Partition, frame: FactFrame):
+        with partition.lock:
+            partition.writer.WriteFrame(frame)
+        self.suspendOldest(partition)
+        dates = [ordinal for ordinal in set(frame.dates)
+                 if ordinal != NO_ORDINAL]
+        if dates:
+            first, last = min(dates), max(dates)
+            if partition.first is None or first < partition.first:
+                partition.first = first
+            if partition.last is None or last > partition.last:
+                partition.last = last
+
+    def suspendOldest(self, partition: Partition):
+        """Mark a partition as written, suspending the oldest past max_open."""
+        suspended = []
+        with self._lock:
+            self._open.pop(partition, None)
+            self._open[partition] = True
+            while len(self._open) > self._max_open:
+                oldest, _ = self._open.popitem(last=False)
+                suspended.append(oldest)
+        for oldest in suspended:
+            with oldest.lock:
+                oldest.writer.Suspend()
+
+    def closePartition(self, partition: Partition):
+        partition.writer.Close()
+        partition.sha256 = file_sha256(partition.writer.output_path)
+
+    def checkError(self):
+        if self._error is not None:
+            raise RuntimeError("Failed to write partitioned output") \
+                from self._error
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        try:
+            self.checkError()
+            with ThreadPoolExecutor(max_workers=self._writers) as executor:
+                list(executor.map(self.closePartition,
+                                  self._partitions.values()))
+            manifest = {
+                "format": self._output_format,
+                "partition": self._fields,
+                "rows": self.rows,
+                "partitions": [
+                    partition.Manifest(self.output_path)
+                    for partition in self._partitions.values()],
+            }
+            with open(path.join(self.output_path, MANIFEST_NAME), "w") as file:
+                json.dump(manifest, file, indent=2)
+            logger.debug("> Wrote %d partitions", len(self._partitions))
+        finally:
+            for partition in self._partitions.values():
+                partition.writer.Close()
+            self._partitions = {}
+            self._paths = set()
+            self._open = OrderedDict()
+            self._executor = None
+
+    def abort(self):
+        self._executor.shutdown(wait=True)
+        directories = set()
+        for partition in self._partitions.values():
+            partition.writer.Abort()
+            directories.add(path.dirname(partition.writer.output_path))
+        for directory in directories:
+            if not os.listdir(directory):
+                os.rmdir(directory)
+        # A manifest of an earlier run no longer matches the directory.
+        manifest_path = path.join(self.output_path, MANIFEST_NAME)
+        if path.exists(manifest_path):
+            os.remove(manifest_path)
+        self._partitions = {}
+        self._paths = set()
+        self._open = OrderedDict()
+        self._executor = None
+
+
+def output_compression(output_path: str, output_format: str = None,
+                       partition: str = None, compress: str = None,
+                       compress_level: int = None,
+                       compress_buffer: int = None) -> Compression:
+    """Compression of the output, or None.
+
+    Files are compressed with `compress', or else, unless partitioned, by
+    the suffix of the path (`.gz', `.xz' or `.bz2').  Raises ValueError if
+    the level or buffer is invalid or given without a compression, or if
+    the format cannot be read back compressed.
+    """
+    if compress is None and partition is None and output_path is not None:
+        compress = compression_of(output_path)
+    if compress is None:
+        if compress_level is not None or compress_buffer is not None:
+            raise ValueError("A compression level or buffer needs a "
+                             "compressed output")
+        return None
+    if output_format == "columnar":
+        raise ValueError("The columnar format cannot be compressed, its "
+                         "columns are memory mapped by readers")
+    return Compression(compress, compress_level, compress_buffer)
+
+
+def make_writer(output_path: str, output_format: str = None,
+                partition: str = None, writers: int = None,
+                compress: str = None, compress_level: int = None,
+                compress_buffer: int = None) -> RowWriter:
+    """Writer of the output rows to a path, or None without a path.
+
+    With `partition' the path is a directory of a file per partition.
+    See output_compression for the compression of the files.
+    """
+    if output_path is None:
+        return None
+    compression = output_compression(
+        output_path, output_format, partition, compress, compress_level,
+        compress_buffer)
+    if partition is not None:
+        return PartitionedRowWriter(
+            output_path, output_format, partition, writers,
+            compression=compression)
+    return OUTPUT_FORMATS[output_format or "csv"](output_path, compression)
@@ -0,0 +1,186 @@
+"""Gathernomics - Test Fixtures.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import csv
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import threading
+import time
+import zipfile
+
+import pytest
+
+from gathernomics.filters.gdp import (
+    ADJUSTMENT_KEY, ADJUSTMENT_VALUE, NAICS_KEY, PRICE_KEY, PRICE_VALUE)
+
+
+def make_zip(rows: int = 2000) -> bytes:
+    """Table zip of a data CSV with `rows' rows, and its MetaData CSV."""
+    data = io.StringIO()
+    data.write('"REF_DATE","GEO","VALUE","SCALAR_FACTOR"\n')
+    for i in range(rows):
+        data.write('"{}-01","Canada","{}","millions"\n'.format(
+            1900 + i // 12, i))
+    body = io.BytesIO()
+    with zipfile.ZipFile(body, "w") as zip_file:
+        zip_file.writestr("36100434.csv", data.getvalue())
+        zip_file.writestr("36100434_MetaData.csv", '"Cube Title"\n')
+    return body.getvalue()
+
+
+class Table(object):
+    """A table zip served by the TableServer.
+
+    The first `drops' responses with a body close the connection after
+    `drop_after' bytes of it, as a dropped connection would.  The first
+    `resets' requests are closed before any response is sent, and every
+    response is held back `delay' seconds.
+    """
+    def __init__(self, body: bytes, etag: str = '"v1"',
+                 last_modified: str = None, drop_after: int = None,
+                 drops: int = 1, resets: int = 0, delay: float = None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.drop_after = drop_after
+        self.drops = drops
+        self.resets = resets
+        self.delay = delay
+
+
+class TableHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *_):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        server.peers.append(self.client_address)
+        table = server.tables.get(self.path)
+        if table is not None and table.resets > 0:
+            table.resets -= 1
+            self.close_connection = True
+            return
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if table is not None and table.delay is not None:
+                time.sleep(table.delay)
+            self.respond(table)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, table: Table):
+        if table is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        validators = [table.etag, table.last_modified]
+        if (table.etag is not None and
+                self.headers.get("If-None-Match") == table.etag):
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if (range_header is not None and range_header.startswith("bytes=")
+                and (if_range is None or if_range in validators)):
+            start = int(range_header[len("bytes="):].rstrip("-"))
+        body = table.body[start:]
+        self.send_response(206 if start > 0 else 200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(body)))
+        if start > 0:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                start, len(table.body) - 1, len(table.body)))
+        if table.etag is not None:
+            self.send_header("ETag", table.etag)
+        if table.last_modified is not None:
+            self.send_header("Last-Modified", table.last_modified)
+        self.end_headers()
+        if table.drop_after is not None and table.drops > 0:
+            table.drops -= 1
+            self.wfile.write(body[:table.drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class TableServer(ThreadingHTTPServer):
+    """Local stand-in for StatsCan, serving table zips by path."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), TableHandler)
+        self.tables = {}
+        self.requests = []
+        # Client address of every request, to tell connections apart.
+        self.peers = []
+        # Most requests handled at once.
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def Url(self, table_path: str) -> str:
+        return "http://127.0.0.1:{}{}".format(
+            self.server_address[1], table_path)
+
+
+@pytest.fixture
+def table_server():
+    server = TableServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Industries of the GDP test table.
+INDUSTRIES = ["All industries", "Retail trade", "Mining, quarrying",
+              'Arts "and" culture']
+
+
+def write_gdp_csv(csv_path: str, months: int = 240):
+    """GDP data CSV of every industry, adjustment and price, by month."""
+    with open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(["REF_DATE", "GEO", NAICS_KEY, ADJUSTMENT_KEY,
+                         PRICE_KEY, "SCALAR_FACTOR", "VECTOR", "COORDINATE",
+                         "VALUE"])
+        series = [(industry, adjustment, price)
+                  for industry in INDUSTRIES
+                  for adjustment in (ADJUSTMENT_VALUE, "Unadjusted")
+                  for price in (PRICE_VALUE, "Current prices")]
+        for month in range(months):
+            ref_date = "{}-{:02d}".format(1997 + month // 12, month % 12 + 1)
+            for n, (industry, adjustment, price) in enumerate(series):
+                writer.writerow([
+                    ref_date, "Canada", industry, adjustment, price,
+                    "millions", "v{}".format(1000 + n), "1.{}.{}.{}".format(
+                        INDUSTRIES.index(industry) + 1,
+                        1 if adjustment == ADJUSTMENT_VALUE else 2,
+                        1 if price == PRICE_VALUE else 2),
+                    str(month * 10 + n)])
+
+
+def make_gdp_zip(csv_path: str, months: int = 240) -> bytes:
+    """Table zip of the GDP data CSV, written to `csv_path' first."""
+    write_gdp_csv(csv_path, months)
+    body = io.BytesIO()
+    with zipfile.ZipFile(body, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.write(csv_path, "36100434.csv")
+        zip_file.writestr("36100434_MetaData.csv", '"Cube Title"\n')
+    return body.getvalue()
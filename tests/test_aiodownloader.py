@@ -0,0 +1,124 @@
+"""Gathernomics - Asynchronous Data Downloader Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import asyncio
+
+import pytest
+
+from gathernomics.aiodownloader import (
+    AsyncHttpError, AsyncStatsCanTableDownloader, open_request)
+
+from tests.conftest import Table, make_zip
+
+
+def download(table_server, tmpdir, table_path: str) -> bytes:
+    async def run():
+        downloader = AsyncStatsCanTableDownloader(
+            compression_dir=str(tmpdir.join("zips")), chunk_size=1024)
+        ctx = downloader.Context("Table", table_server.Url(table_path))
+        return await downloader.downloadZipFileAsync(ctx)
+    zip_path = asyncio.run(run())
+    assert zip_path is not None
+    with open(zip_path, "rb") as f:
+        return f.read()
+
+
+def test_short_body_raises(table_server):
+    table_server.tables["/t.zip"] = Table(make_zip(), drop_after=5000)
+
+    async def run():
+        response = await open_request("GET", table_server.Url("/t.zip"))
+        try:
+            return await response.read()
+        finally:
+            response.close()
+    with pytest.raises(AsyncHttpError):
+        asyncio.run(run())
+
+
+def test_dropped_connection_resumes(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(body, drop_after=5000)
+    assert download(table_server, tmpdir, "/t.zip") == body
+    assert len(table_server.requests) == 2
+    headers = table_server.requests[1][1]
+    assert headers["Range"] == "bytes=5000-"
+    assert headers["If-Range"] == '"v1"'
+
+
+def test_repeatedly_dropped_connection_resumes(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(body, drop_after=3000, drops=3)
+    assert download(table_server, tmpdir, "/t.zip") == body
+    ranges = [headers.get("Range") for _, headers in table_server.requests]
+    assert ranges == [None, "bytes=3000-", "bytes=6000-", "bytes=9000-"]
+
+
+def raw_response(response: bytes, method: str = "GET",
+                 chunk_size: int = 65536) -> list:
+    """Chunks of a raw response read by open_request.
+
+    The server keeps the connection open after the response, as a server
+    keeping it alive would, so reading must stop at the end of the body.
+    """
+    async def run():
+        done = asyncio.Event()
+
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(response)
+            await writer.drain()
+            await done.wait()
+            writer.close()
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = "http://127.0.0.1:{}/t.zip".format(
+            server.sockets[0].getsockname()[1])
+        try:
+            http_response = await open_request(method, url)
+            try:
+                return [chunk async for chunk
+                        in http_response.stream(chunk_size)]
+            finally:
+                http_response.close()
+        finally:
+            done.set()
+            server.close()
+    return asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_chunked_body_is_read_to_its_last_chunk():
+    chunks = raw_response(
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"5;name=value\r\nhello\r\n6\r\n world\r\n"
+        b"0\r\nX-Checksum: 1\r\n\r\n", chunk_size=4)
+    assert b"".join(chunks) == b"hello world"
+    assert all(len(chunk) <= 4 for chunk in chunks)
+
+
+def test_kept_alive_body_is_read_to_its_length():
+    body = make_zip(rows=100)
+    assert b"".join(raw_response(
+        b"HTTP/1.1 200 OK\r\nContent-Length: " +
+        str(len(body)).encode() + b"\r\n\r\n" + body, chunk_size=1000)) == body
+
+
+def test_responses_without_a_body_are_not_read():
+    head = b"HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n"
+    assert raw_response(head, method="HEAD") == []
+    assert raw_response(
+        b"HTTP/1.1 304 Not Modified\r\nETag: \"v1\"\r\n\r\n") == []
+
+
+def test_connection_pool_is_not_made(table_server, tmpdir):
+    table_server.tables["/t.zip"] = Table(make_zip())
+
+    async def run():
+        downloader = AsyncStatsCanTableDownloader(
+            compression_dir=str(tmpdir.join("zips")))
+        ctx = downloader.Context("Table", table_server.Url("/t.zip"))
+        assert await downloader.downloadZipFileAsync(ctx) is not None
+        return downloader
+    assert asyncio.run(run())._http is None
@@ -0,0 +1,72 @@
+"""Gathernomics - Download Cache Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import hashlib
+import os.path as path
+
+from gathernomics.cache import DownloadCache
+from gathernomics.descriptor import TableDescriptor
+from gathernomics.downloader import StatsCanTableDownloader
+
+from tests.conftest import Table, make_zip
+
+
+def download(table_server, tmpdir, table_path: str) -> str:
+    cache = DownloadCache(str(tmpdir.join("cache.json")))
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")), cache=cache)
+    ctx = downloader.Context("Table", table_server.Url(table_path))
+    return downloader.downloadZipFile(ctx), cache
+
+
+def test_not_modified_reuses_cached_zip(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(body)
+    first, _ = download(table_server, tmpdir, "/t.zip")
+    second, cache = download(table_server, tmpdir, "/t.zip")
+    assert second == first
+    assert table_server.requests[-1][1].get("If-None-Match") == '"v1"'
+    assert cache.Get(table_server.Url("/t.zip")).sha256 == \
+        hashlib.sha256(body).hexdigest()
+
+
+def test_corrupt_cached_zip_is_downloaded_again(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(body)
+    first, _ = download(table_server, tmpdir, "/t.zip")
+    # Same size, so only the hash tells the zip changed.
+    with open(first, "r+b") as f:
+        f.seek(10)
+        f.write(b"\xff")
+    second, cache = download(table_server, tmpdir, "/t.zip")
+    assert second is not None and second != first
+    with open(second, "rb") as f:
+        assert f.read() == body
+    assert "If-None-Match" not in table_server.requests[-1][1]
+    entry = cache.Get(table_server.Url("/t.zip"))
+    assert entry.zip_filepath == second
+    assert DownloadCache.Verify(entry)
+    assert not path.isfile(first)
+
+
+def test_evicted_cached_zip_is_downloaded_again(table_server, tmpdir):
+    table_server.tables["/t.zip"] = Table(make_zip())
+    table = TableDescriptor.CreateFromDict({
+        "name": "Table", "url": table_server.Url("/t.zip"),
+        "category": "gdp", "indicator": "GDP", "frequency": "monthly"})
+    cache = DownloadCache(str(tmpdir.join("cache.json")))
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")), cache=cache, budget=1)
+    ctx = downloader.DownloadTable(table)
+    zip_path = ctx.zip_filepath
+    # The zip is kept while the table is in use, even over budget.
+    assert downloader.storage.Evict() == 0
+    assert cache.Get(table.url) is not None
+    downloader.Release(ctx)
+    assert not path.exists(zip_path)
+    assert cache.Get(table.url) is None
+    downloader.Release(downloader.DownloadTable(table))
+    assert "If-None-Match" not in table_server.requests[-1][1]
@@ -0,0 +1,196 @@
+"""Gathernomics - Incremental Ingestion Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from datetime import date as Date
+import json
+
+from gathernomics.delta import (
+    DeltaState, IncrementalIngestor, LocalDeltaSource, TableSnapshot)
+from gathernomics.descriptor import TableDescriptor
+from gathernomics.filters.daterange import DateRange
+from gathernomics.filters.gdp import (
+    ADJUSTMENT_KEY, ADJUSTMENT_VALUE, NAICS_KEY, NAICS_VALUE, PRICE_KEY,
+    PRICE_VALUE, GDPFilter)
+from gathernomics.models.factor import TemporalFrequency
+from gathernomics.planner import TableGroup
+
+URL = "http://127.0.0.1/36100434-eng.zip"
+PRODUCT_ID = 36100434
+
+
+def gdp_row(vector: str, coordinate: str, ref_date: str, value: str) -> dict:
+    return {
+        "REF_DATE": ref_date,
+        "VECTOR": vector,
+        "COORDINATE": coordinate,
+        "VALUE": value,
+        "SCALAR_FACTOR": "millions",
+        NAICS_KEY: NAICS_VALUE,
+        ADJUSTMENT_KEY: ADJUSTMENT_VALUE,
+        PRICE_KEY: PRICE_VALUE,
+    }
+
+
+ROWS = [
+    gdp_row("v1000", "1.1.1", "2018-01", "10"),
+    gdp_row("v1000", "1.1.1", "2018-02", "11"),
+    gdp_row("v2000", "1.2.1", "2018-01", "5"),
+]
+
+
+class Run(object):
+    """An incremental run of the GDP table on `date'."""
+    def __init__(self, tmpdir, date: Date, release: str = None,
+                 changes: list = None, date_range: DateRange = None):
+        delta_dir = tmpdir.join("delta-{}".format(date.isoformat()))
+        delta_dir.ensure(dir=True)
+        series = [{"responseStatusCode": 0, "vectorId": vid,
+                   "productId": PRODUCT_ID, "coordinate": coordinate,
+                   "releaseTime": release}
+                  for vid, coordinate, _ in changes or []]
+        if release is not None:
+            # The list has the series of every table released that day.
+            series.append({"responseStatusCode": 0, "vectorId": 1,
+                           "productId": 99999999, "coordinate": "1",
+                           "releaseTime": release})
+        delta_dir.join("getChangedSeriesList.json").write(json.dumps({
+            "status": "SUCCESS", "object": series}))
+        delta_dir.join("getChangedSeriesDataFromVector.json").write(
+            json.dumps([{"status": "SUCCESS", "object": {
+                "vectorId": vid,
+                "vectorDataPoint": [
+                    {"refPer": ref_period, "value": value, "decimals": 0,
+                     "scalarFactorCode": 6}
+                    for ref_period, value in points]}}
+                for vid, _, points in changes or []]))
+        self.table = TableDescriptor(
+            "GDP", URL, "gdp", "gdp", TemporalFrequency.MONTHLY)
+        self.state = DeltaState(str(tmpdir.join("delta")))
+        self.date_range = date_range
+        self.ingestor = IncrementalIngestor(
+            LocalDeltaSource(str(delta_dir), date=date), self.state,
+            lambda table: self.makeFilter(), date_range)
+        self.full_pulls = 0
+
+    def makeFilter(self) -> GDPFilter:
+        table_filter = GDPFilter(None, "gdp", "gdp", TemporalFrequency.MONTHLY)
+        table_filter.date_range = self.date_range
+        return table_filter
+
+    def fullPull(self, observer):
+        self.full_pulls += 1
+        table_filter = self.makeFilter()
+        facts = []
+        for row in ROWS:
+            fact = None
+            if table_filter.isValid(row):
+                fact = table_filter.transformRow(row)
+                facts.append(fact)
+            observer(row, [fact])
+        return [facts]
+
+    def Ingest(self) -> list:
+        group = TableGroup(URL, [self.table])
+        rows, = self.ingestor.IngestGroup(group, self.fullPull)
+        return [(fact["date"].isoformat(), fact["value"]) for fact in rows]
+
+    @property
+    def synced(self) -> Date:
+        return self.state.Get("GDP").synced
+
+
+def test_applies_change_list(tmpdir):
+    first = Run(tmpdir, Date(2018, 6, 1), release="2018-06-01T08:30")
+    first.Ingest()
+    assert first.full_pulls == 1
+    assert first.synced == Date(2018, 6, 1)
+    second = Run(tmpdir, Date(2018, 6, 2), release="2018-06-02T08:30",
+                 changes=[(1000, "1.1.1.0.0", [("2018-02-01", 12),
+                                               ("2018-03-01", 13)])])
+    rows = second.Ingest()
+    assert second.full_pulls == 0
+    assert rows == [("2018-01-01", 10000000), ("2018-01-01", 5000000),
+                    ("2018-02-01", 12000000), ("2018-03-01", 13000000)]
+    assert second.synced == Date(2018, 6, 2)
+
+
+def test_missed_release_pulls_in_full(tmpdir):
+    Run(tmpdir, Date(2018, 6, 1), release="2018-06-01T08:30").Ingest()
+    late = Run(tmpdir, Date(2018, 6, 4), release="2018-06-04T08:30",
+               changes=[(1000, "1.1.1", [("2018-02-01", 12)])])
+    late.Ingest()
+    assert late.full_pulls == 1
+    assert late.synced == Date(2018, 6, 4)
+
+
+def test_moved_series_pulls_in_full(tmpdir):
+    Run(tmpdir, Date(2018, 6, 1), release="2018-06-01T08:30").Ingest()
+    moved = Run(tmpdir, Date(2018, 6, 2), release="2018-06-02T08:30",
+                changes=[(1000, "1.1.2", [("2018-02-01", 12)])])
+    rows = moved.Ingest()
+    assert moved.full_pulls == 1
+    assert ("2018-02-01", 11000000) in rows
+
+
+def test_run_before_release_is_synced_as_of_last_release(tmpdir):
+    Run(tmpdir, Date(2018, 6, 1), release="2018-06-01T08:30").Ingest()
+    # Before the release of the 2nd, the list is still the one of the 1st.
+    early = Run(tmpdir, Date(2018, 6, 2), release="2018-06-01T08:30")
+    early.Ingest()
+    assert early.full_pulls == 0
+    assert early.synced == Date(2018, 6, 1)
+    # The list of the 2nd was never applied, so the 3rd cannot follow on.
+    later = Run(tmpdir, Date(2018, 6, 3), release="2018-06-03T08:30",
+                changes=[(1000, "1.1.1", [("2018-02-01", 12)])])
+    later.Ingest()
+    assert later.full_pulls == 1
+
+
+def test_unknown_release_is_synced_as_of_the_day_before(tmpdir):
+    first = Run(tmpdir, Date(2018, 6, 2))
+    first.Ingest()
+    assert first.full_pulls == 1
+    assert first.synced == Date(2018, 6, 1)
+
+
+def test_other_date_range_pulls_in_full(tmpdir):
+    since = DateRange("2018-02")
+    first = Run(tmpdir, Date(2018, 6, 1), release="2018-06-01T08:30",
+                date_range=since)
+    assert first.Ingest() == [("2018-02-01", 11000000)]
+    # The snapshot lacks the rows before 2018-02.
+    every_date = Run(tmpdir, Date(2018, 6, 2), release="2018-06-02T08:30",
+                     changes=[(1000, "1.1.1", [("2018-02-01", 12)])])
+    rows = every_date.Ingest()
+    assert every_date.full_pulls == 1
+    assert ("2018-01-01", 5000000) in rows
+    same = Run(tmpdir, Date(2018, 6, 3), release="2018-06-03T08:30",
+               changes=[(1000, "1.1.1", [("2018-01-01", 9),
+                                         ("2018-02-01", 13)])],
+               date_range=DateRange("2018-02"))
+    assert same.Ingest() == [("2018-02-01", 11000000)]
+    assert same.full_pulls == 1
+    again = Run(tmpdir, Date(2018, 6, 4), release="2018-06-04T08:30",
+                changes=[(1000, "1.1.1", [("2018-01-01", 9),
+                                          ("2018-02-01", 13)])],
+                date_range=DateRange("2018-02"))
+    assert again.Ingest() == [("2018-02-01", 13000000)]
+    assert again.full_pulls == 0
+
+
+def test_snapshots_are_stored_per_table(tmpdir):
+    state = DeltaState(str(tmpdir.join("delta")))
+    gdp = TableSnapshot(PRODUCT_ID, Date(2018, 6, 1), vectors={1000: "1.1"})
+    state.Put("GDP", gdp)
+    gdp_file = tmpdir.join("delta").listdir()[0]
+    written = gdp_file.mtime(), gdp_file.read()
+    state.Put("GDP (real)", TableSnapshot(PRODUCT_ID, Date(2018, 6, 2)))
+    assert len(tmpdir.join("delta").listdir()) == 2
+    assert (gdp_file.mtime(), gdp_file.read()) == written
+    loaded = DeltaState(str(tmpdir.join("delta")))
+    assert loaded.Get("GDP").vectors == {1000: "1.1"}
+    assert loaded.Get("GDP (real)").synced == Date(2018, 6, 2)
+    assert loaded.Get("GDP real") is None
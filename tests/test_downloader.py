@@ -0,0 +1,132 @@
+"""Gathernomics - Data Downloader Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import os
+
+from gathernomics.__main__ import prepare_filter
+from gathernomics.descriptor import TableDescriptor
+from gathernomics.downloader import StatsCanTableDownloader
+from gathernomics.filters.gdp import GDPFilter
+from gathernomics.models.factor import TemporalFrequency
+
+from tests.conftest import Table, make_gdp_zip, make_zip
+
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+def download(table_server, tmpdir, table_path: str) -> bytes:
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")), chunk_size=1024)
+    ctx = downloader.Context("Table", table_server.Url(table_path))
+    zip_path = downloader.downloadZipFile(ctx)
+    assert zip_path is not None
+    with open(zip_path, "rb") as f:
+        return f.read()
+
+
+def resumed_from(table_server) -> int:
+    """Offset the second request resumed from, 0 if it did not."""
+    headers = table_server.requests[1][1]
+    if "Range" not in headers:
+        return 0
+    return int(headers["Range"][len("bytes="):].rstrip("-"))
+
+
+def test_dropped_connection_resumes(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(body, drop_after=5000)
+    assert download(table_server, tmpdir, "/t.zip") == body
+    assert len(table_server.requests) == 2
+    assert 0 < resumed_from(table_server) <= 5000
+    assert table_server.requests[1][1]["If-Range"] == '"v1"'
+
+
+def test_weak_etag_resumes_on_last_modified(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(
+        body, etag='W/"v1"', last_modified=LAST_MODIFIED, drop_after=5000)
+    assert download(table_server, tmpdir, "/t.zip") == body
+    assert resumed_from(table_server) > 0
+    assert table_server.requests[1][1]["If-Range"] == LAST_MODIFIED
+
+
+def test_weak_etag_alone_downloads_again(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(
+        body, etag='W/"v1"', drop_after=5000)
+    assert download(table_server, tmpdir, "/t.zip") == body
+    assert resumed_from(table_server) == 0
+    assert "If-Range" not in table_server.requests[1][1]
+
+
+def test_changed_table_starts_over(table_server, tmpdir):
+    body = make_zip()
+    new_body = make_zip(rows=2500)
+    table_server.tables["/t.zip"] = Table(new_body, etag='"v2"')
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")), chunk_size=1024)
+    ctx = downloader.Context("Table", table_server.Url("/t.zip"))
+    # Part of the table as it was before it was republished.
+    part_path = downloader.partPath(ctx)
+    with open(part_path, "wb") as f:
+        f.write(body[:4096])
+    downloader.savePartInfo(part_path, {
+        "url": ctx.url, "etag": '"v1"', "last_modified": None,
+        "total": len(body)})
+    zip_path = downloader.downloadZipFile(ctx)
+    with open(zip_path, "rb") as f:
+        assert f.read() == new_body
+    assert table_server.requests[0][1]["If-Range"] == '"v1"'
+
+
+def test_no_extract_reads_the_csv_out_of_the_zip(table_server, tmpdir):
+    csv_path = str(tmpdir.join("gdp.csv"))
+    table_server.tables["/t.zip"] = Table(make_gdp_zip(csv_path))
+    table = TableDescriptor.CreateFromDict({
+        "name": "GDP", "url": table_server.Url("/t.zip"),
+        "data_filter": "gdp", "category": "gdp", "indicator": "GDP",
+        "frequency": "monthly"})
+    compression_dir = str(tmpdir.join("zips"))
+    downloader = StatsCanTableDownloader(
+        compression_dir=compression_dir, extract=False)
+    with downloader:
+        ctx = downloader.DownloadTable(table)
+        assert ctx.extract_dirpath is None and ctx.data_csv_path is None
+        assert ctx.data_csv_member == "36100434.csv"
+        assert ctx.meta_csv_member == "36100434_MetaData.csv"
+        assert os.listdir(compression_dir) == [
+            os.path.basename(ctx.zip_filepath)]
+        table_filter = prepare_filter(table, ctx)
+        assert (table_filter.path, table_filter.zip_member) == (
+            ctx.zip_filepath, ctx.data_csv_member)
+        rows = list(table_filter)
+    assert len(rows) == 240
+    assert rows == list(GDPFilter(
+        csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY))
+
+
+def test_pool_retries_a_dropped_connection(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/t.zip"] = Table(body, resets=1)
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")))
+    response = downloader.http.request("GET", table_server.Url("/t.zip"))
+    assert (response.status, response.data) == (200, body)
+    assert [request[0] for request in table_server.requests] == \
+        ["/t.zip", "/t.zip"]
+
+
+def test_tables_share_a_keep_alive_connection(table_server, tmpdir):
+    body = make_zip()
+    table_server.tables["/a.zip"] = Table(body)
+    table_server.tables["/b.zip"] = Table(body)
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")))
+    for table_path in ("/a.zip", "/b.zip"):
+        ctx = downloader.Context(table_path, table_server.Url(table_path))
+        assert downloader.downloadZipFile(ctx) is not None
+    assert len(table_server.requests) == 2
+    assert len(set(table_server.peers)) == 1
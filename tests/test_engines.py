@@ -0,0 +1,370 @@
+"""Gathernomics - Filter Engine Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import itertools
+
+import pytest
+
+from gathernomics.__main__ import parse_args
+from gathernomics.defaults import DEFAULT_INDEX_MAX_VALUES
+from gathernomics.filters.columnar import (
+    ColumnarScanEngine, columnar_available)
+from gathernomics.filters.daterange import DateRange
+from gathernomics.filters import ieport
+from gathernomics.filters.gdp import (
+    ADJUSTMENT_KEY, ADJUSTMENT_VALUE, NAICS_KEY, NAICS_VALUE, PRICE_KEY,
+    PRICE_VALUE, GDPFilter)
+from gathernomics.filters.index import DimensionIndex, IndexedScanEngine
+from gathernomics.filters.mmapscan import MmapScanEngine
+from gathernomics.filters.parallel import ParallelScanEngine, process_pool
+from gathernomics.filters.scan import ScanEngine
+from gathernomics.metadata import TableMetadata
+from gathernomics.models.factor import TemporalFrequency
+
+from tests.conftest import INDUSTRIES, write_gdp_csv
+
+
+def make_engine(name: str, filters: list, tmpdir):
+    if name == "scan":
+        return ScanEngine(filters)
+    if name == "columnar":
+        if not columnar_available():
+            pytest.skip("NumPy is not installed")
+        return ColumnarScanEngine(filters, batch_rows=500)
+    if name == "parallel":
+        return ParallelScanEngine(
+            filters, executor=ThreadPoolExecutor(2), chunk_size=16384)
+    if name == "mmap":
+        return MmapScanEngine(filters)
+    for table_filter in filters:
+        table_filter.source_hash = "0" * 64
+    return IndexedScanEngine(filters, index_dir=str(tmpdir.join("index")))
+
+
+def gdp_filters(csv_path: str) -> list:
+    filters = []
+    for industry in INDUSTRIES:
+        table_filter = GDPFilter(
+            csv_path, "gdp", industry, TemporalFrequency.MONTHLY)
+        table_filter.filters[NAICS_KEY] = industry
+        filters.append(table_filter)
+    ranged = GDPFilter(csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+    ranged.date_range = DateRange("2005-06", "2009")
+    filters.append(ranged)
+    return filters
+
+
+def gdp_metadata(industries: list) -> TableMetadata:
+    """Metadata of the GDP test table, naming its industries as given."""
+    members = [("Geography", ["Canada"]), (NAICS_KEY, industries),
+               (ADJUSTMENT_KEY, [ADJUSTMENT_VALUE, "Unadjusted"]),
+               (PRICE_KEY, [PRICE_VALUE, "Current prices"])]
+    dimensions = []
+    for position, (name, labels) in enumerate(members, 1):
+        dimension = TableMetadata.Dimension(position, name)
+        for member_id, label in enumerate(labels, 1):
+            dimension.AddMember(label, member_id)
+        dimensions.append(dimension)
+    return TableMetadata(36100434, dimensions)
+
+
+ENGINE_NAMES = ["scan", "columnar", "parallel", "mmap", "index"]
+
+
+@pytest.mark.parametrize("name", ENGINE_NAMES)
+def test_engine_rows_match_the_filters(name, tmpdir):
+    csv_path = str(tmpdir.join("gdp.csv"))
+    write_gdp_csv(csv_path)
+    expected = [list(table_filter) for table_filter in gdp_filters(csv_path)]
+    assert all(len(rows) > 0 for rows in expected)
+    engine = make_engine(name, gdp_filters(csv_path), tmpdir)
+    assert engine.Run() == expected
+
+
+def test_columnar_engine_scans_multiline_rows_by_rows(tmpdir):
+    csv_path = str(tmpdir.join("gdp.csv"))
+    write_gdp_csv(csv_path)
+    with open(csv_path, encoding="utf-8", newline="") as csv_file:
+        lines = csv_file.readlines()
+    # Past the sampled rows, a blank line and a row spanning two lines.
+    lines.insert(2000, "\r\n")
+    lines[3000] = lines[3000].replace('"Canada"', '"Canada\r\nEast"')
+    with open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+        csv_file.writelines(lines)
+    expected = [list(table_filter) for table_filter in gdp_filters(csv_path)]
+    engine = make_engine("columnar", gdp_filters(csv_path), tmpdir)
+    assert engine.Run() == expected
+
+
+def test_columnar_engine_scans_by_rows_when_most_rows_match(tmpdir):
+    csv_path = str(tmpdir.join("gdp.csv"))
+    write_gdp_csv(csv_path)
+
+    def filters() -> list:
+        every_row = GDPFilter(
+            csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+        every_row.filters = {}
+        return gdp_filters(csv_path) + [every_row]
+    expected = [list(table_filter) for table_filter in filters()]
+    assert len(expected[-1]) == 240 * 16
+    assert make_engine("columnar", filters(), tmpdir).Run() == expected
+
+
+def write_series_csv(csv_path: str, series: int, months: int = 24):
+    """Data CSV of `series' series, by vector and coordinate, by month."""
+    with open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
+        writer.writerow(["REF_DATE", "GEO", "Series", "SCALAR_FACTOR",
+                         "VECTOR", "COORDINATE", "VALUE"])
+        for month in range(months):
+            for n in range(series):
+                writer.writerow([
+                    "{}-{:02d}".format(2000 + month // 12, month % 12 + 1),
+                    "Canada", "Series {}".format(n + 1), "units",
+                    "v{}".format(1000 + n), "1.{}".format(n + 1),
+                    str(month * series + n)])
+
+
+def series_filters(csv_path: str, vectors: list,
+                   coordinates: list) -> list:
+    by_vector = GDPFilter(csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+    by_vector.vectors = vectors
+    by_coordinate = GDPFilter(
+        csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+    by_coordinate.filters = {"COORDINATE": coordinates}
+    return [by_vector, by_coordinate]
+
+
+def test_mmap_engine_searches_each_value_of_short_lists(tmpdir, monkeypatch):
+    csv_path = str(tmpdir.join("series.csv"))
+    write_series_csv(csv_path, 50)
+    vectors = ["v1003", "v1017", "v1042"]
+    coordinates = ["1.7", "1.23", "1.38"]
+    expected = [list(table_filter) for table_filter in series_filters(
+        csv_path, vectors, coordinates)]
+    assert [len(rows) for rows in expected] == [24 * 3, 24 * 3]
+
+    def scan(_):
+        raise AssertionError("Scanned by ScanEngine")
+    monkeypatch.setattr(ScanEngine, "Run", scan)
+    engine = MmapScanEngine(series_filters(csv_path, vectors, coordinates))
+    assert engine.Run() == expected
+
+
+def test_mmap_engine_scans_common_needles_by_rows(tmpdir, monkeypatch):
+    csv_path = str(tmpdir.join("series.csv"))
+    write_series_csv(csv_path, 50)
+    # Each list is in a third of the lines.
+    vectors = ["v{}".format(1000 + n) for n in range(0, 50, 3)]
+    coordinates = ["1.{}".format(n + 1) for n in range(0, 50, 3)]
+    expected = [list(table_filter) for table_filter in series_filters(
+        csv_path, vectors, coordinates)]
+    scans = []
+    run = ScanEngine.Run
+
+    def scan(engine):
+        scans.append(len(engine.filters))
+        return run(engine)
+    monkeypatch.setattr(ScanEngine, "Run", scan)
+    engine = MmapScanEngine(series_filters(csv_path, vectors, coordinates))
+    assert engine.Run() == expected
+    assert scans == [2]
+
+
+def test_index_looks_up_coordinates_of_many_series(tmpdir):
+    csv_path = str(tmpdir.join("series.csv"))
+    series = DEFAULT_INDEX_MAX_VALUES + 100
+    write_series_csv(csv_path, series, months=2)
+    geography = TableMetadata.Dimension(1, "Geography")
+    geography.AddMember("Canada", 1)
+    labels = TableMetadata.Dimension(2, "Series")
+    for n in range(series):
+        labels.AddMember("Series {}".format(n + 1), n + 1)
+    metadata = TableMetadata(36100434, [geography, labels])
+
+    def filters() -> list:
+        table_filter = GDPFilter(
+            csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+        table_filter.filters = {"Series": ["Series 7", "Series 4150"]}
+        table_filter.metadata = metadata
+        return [table_filter]
+    index = DimensionIndex.Build(csv_path)
+    assert not index.IsIndexed("VALUE")
+    assert index.Candidates(filters()[0]) == [
+        6, 4149, series + 6, series + 4149]
+    expected = [list(table_filter) for table_filter in filters()]
+    assert len(expected[0]) == 4
+    assert make_engine("index", filters(), tmpdir).Run() == expected
+
+
+def test_index_keeps_the_rows_of_many_dates(tmpdir):
+    csv_path = str(tmpdir.join("series.csv"))
+    months = DEFAULT_INDEX_MAX_VALUES + 100
+    write_series_csv(csv_path, 2, months=months)
+
+    def filters() -> list:
+        by_date = GDPFilter(csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+        by_date.filters = {}
+        by_vector = GDPFilter(
+            csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+        by_vector.vectors = ["v1001"]
+        for table_filter in (by_date, by_vector):
+            table_filter.date_range = DateRange("2300-11", "2301-02")
+        return [by_date, by_vector]
+    index = DimensionIndex.Build(csv_path)
+    assert not index.IsIndexed("REF_DATE")
+    # The rows of 2300-11 to 2301-02, two series by month.
+    first = (300 * 12 + 10) * 2
+    by_date, by_vector = filters()
+    assert index.Candidates(by_date) == list(range(first, first + 8))
+    assert index.Candidates(by_vector) == list(range(first + 1, first + 8, 2))
+    expected = [list(table_filter) for table_filter in filters()]
+    assert [len(rows) for rows in expected] == [8, 4]
+    # Built, then loaded from the saved index.
+    for _ in range(2):
+        assert make_engine("index", filters(), tmpdir).Run() == expected
+
+
+@pytest.mark.parametrize("name", ENGINE_NAMES)
+def test_engines_match_resolved_coordinates(name, tmpdir):
+    csv_path = str(tmpdir.join("gdp.csv"))
+    write_gdp_csv(csv_path)
+    # The metadata names an industry unlike the data CSV, so only rows
+    # matched on their COORDINATE are found.
+    industries = ["Retail sales" if industry == "Retail trade" else industry
+                  for industry in INDUSTRIES]
+    metadata = gdp_metadata(industries)
+
+    def resolved_filters() -> list:
+        filters = []
+        for industry in industries:
+            table_filter = GDPFilter(
+                csv_path, "gdp", industry, TemporalFrequency.MONTHLY)
+            table_filter.filters[NAICS_KEY] = industry
+            table_filter.metadata = metadata
+            filters.append(table_filter)
+        return filters
+    expected = [list(table_filter) for table_filter in resolved_filters()]
+    assert all(len(rows) > 0 for rows in expected)
+    assert make_engine(name, resolved_filters(), tmpdir).Run() == expected
+
+    unknown = resolved_filters()
+    unknown[1].filters[NAICS_KEY] = "Retail trade"
+    with pytest.raises(ValueError):
+        make_engine(name, unknown, tmpdir).Run()
+
+
+@pytest.mark.parametrize("name", ENGINE_NAMES)
+def test_engine_rejects_filters_of_other_csvs(name, tmpdir):
+    filters = [GDPFilter(str(tmpdir.join(csv_name)), "gdp", "GDP",
+                         TemporalFrequency.MONTHLY)
+               for csv_name in ("a.csv", "b.csv")]
+    with pytest.raises(ValueError):
+        make_engine(name, filters, tmpdir)
+
+
+@pytest.mark.parametrize("args", [
+    ["--columnar", "--mmap"], ["--index", "--processes", "4"],
+    ["--mmap", "--index"], ["--incremental", "--mmap"],
+    ["--incremental", "--processes", "2"], ["--index", "--incremental"],
+    ["--columnar", "--incremental"]])
+def test_engine_options_are_exclusive(args):
+    with pytest.raises(SystemExit):
+        parse_args(args)
+
+
+@pytest.mark.parametrize("args", [["--jobs", "0"], ["--processes", "0"]])
+def test_worker_counts_must_be_positive(args):
+    with pytest.raises(SystemExit):
+        parse_args(args)
+
+
+# Set in the test process only, so workers forked from it would see it.
+PARENT_STATE = None
+
+
+def parent_state():
+    return PARENT_STATE
+
+
+def test_process_pool_workers_are_not_forked(tmpdir, monkeypatch):
+    monkeypatch.setitem(globals(), "PARENT_STATE", "set")
+    with process_pool(1) as executor:
+        assert executor.submit(parent_state).result() is None
+    csv_path = str(tmpdir.join("gdp.csv"))
+    write_gdp_csv(csv_path)
+    expected = [list(table_filter) for table_filter in gdp_filters(csv_path)]
+    engine = ParallelScanEngine(
+        gdp_filters(csv_path), processes=2, chunk_size=16384)
+    assert engine.Run() == expected
+
+
+def test_sampled_rates_leave_out_ref_date(tmpdir):
+    csv_path = str(tmpdir.join("gdp.csv"))
+    write_gdp_csv(csv_path)
+    table_filter = GDPFilter(csv_path, "gdp", "GDP", TemporalFrequency.MONTHLY)
+    table_filter.date_range = DateRange("2010", "2012")
+    rows = list(table_filter)
+    # The rows sampled are all of 1997, out of the range.
+    assert set(table_filter.selectivity) == {
+        NAICS_KEY, ADJUSTMENT_KEY, PRICE_KEY}
+    assert [row["date"].year for row in rows] == sorted(
+        [2010, 2011, 2012] * 12)
+
+
+# The checks GDPFilter and ImportExportFilter made by hand before their
+# filters were compiled.
+def hand_written_gdp_check(row: dict) -> bool:
+    return (row.get(NAICS_KEY) == NAICS_VALUE and
+            row.get(ADJUSTMENT_KEY) == ADJUSTMENT_VALUE and
+            row.get(PRICE_KEY) == PRICE_VALUE and
+            all(key in row for key in ("VALUE", "SCALAR_FACTOR", "REF_DATE")))
+
+
+def hand_written_ieport_check(row: dict) -> bool:
+    return (row.get(ieport.ADJUSTMENT_KEY) == ieport.ADJUSTMENT_VALUE and
+            row.get(ieport.GEO_KEY) == ieport.GEO_VALUE and
+            row.get(ieport.BASIS_KEY) == ieport.BASIS_VALUE and
+            row.get(ieport.PARTNERS_KEY) == ieport.PARTNERS_VALUE and
+            row.get(ieport.TRADE_KEY) in ieport.TRADE_VALUES and
+            all(key in row for key in ("VALUE", "SCALAR_FACTOR", "REF_DATE")))
+
+
+@pytest.mark.parametrize("filter_cls, check, choices", [
+    (GDPFilter, hand_written_gdp_check, {
+        NAICS_KEY: [NAICS_VALUE, "Retail trade", ""],
+        ADJUSTMENT_KEY: [ADJUSTMENT_VALUE, "Unadjusted"],
+        PRICE_KEY: [PRICE_VALUE, "Current prices"]}),
+    (ieport.ImportExportFilter, hand_written_ieport_check, {
+        ieport.ADJUSTMENT_KEY: [ieport.ADJUSTMENT_VALUE, "Unadjusted"],
+        ieport.GEO_KEY: [ieport.GEO_VALUE, "Ontario"],
+        ieport.BASIS_KEY: [ieport.BASIS_VALUE, "Customs"],
+        ieport.PARTNERS_KEY: [ieport.PARTNERS_VALUE, "United States"],
+        ieport.TRADE_KEY: ["Import", "Export", "Trade balance"]}),
+])
+def test_compiled_filters_match_the_hand_written_checks(
+        filter_cls, check, choices):
+    table_filter = filter_cls(
+        None, "trade", "trade", TemporalFrequency.MONTHLY)
+    keys = list(choices) + ["REF_DATE", "VALUE", "SCALAR_FACTOR"]
+    rows = [list(values) + ["2018-01", "1", "units"]
+            for values in itertools.product(*choices.values())]
+    # Every header missing one of the columns, and the whole header.
+    headers = [keys[:i] + keys[i + 1:] for i in range(len(keys))] + [keys]
+    accepted = 0
+    for header in headers:
+        predicate = table_filter.compile(header)
+        for row in rows:
+            row_dict = dict(zip(keys, row))
+            row = [row_dict[key] for key in header]
+            row_dict = dict(zip(header, row))
+            expected = check(row_dict)
+            assert predicate(row) == table_filter.isValid(row_dict) == \
+                expected
+            accepted += expected
+    assert accepted == (1 if filter_cls is GDPFilter else 2)
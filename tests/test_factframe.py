@@ -0,0 +1,16 @@
+"""Gathernomics - Fact Frame Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from gathernomics.factframe import DictionaryColumn
+
+
+def test_dictionary_column_widens_past_65536_values():
+    column = DictionaryColumn()
+    for value in range(70000):
+        column.Append(str(value))
+    column.Append("0")
+    assert column.codes.typecode == "I"
+    assert column.Decode() == [str(value) for value in range(70000)] + ["0"]
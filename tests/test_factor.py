@@ -0,0 +1,87 @@
+"""Gathernomics - Financial Factor Model Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from datetime import date as Date
+
+import pytest
+
+from gathernomics.factframe import FactFrame
+from gathernomics.models.factor import FinancialFactor, TemporalFrequency
+from gathernomics.models.sourcetbl import SourceTable, SourceTableType
+
+
+class RecordingCursor(object):
+    """Cursor recording the rows and statements of `execute_values'."""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def mogrify(self, template: bytes, args: tuple) -> bytes:
+        self.connection.rows.append(args)
+        return repr(args).encode("utf-8")
+
+    def execute(self, sql: bytes):
+        self.connection.statements.append(sql)
+
+
+class RecordingConnection(object):
+    encoding = "UTF8"
+
+    def __init__(self):
+        self.rows = []
+        self.statements = []
+        self.committed = False
+        self.closed = False
+
+    def cursor(self):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        self.closed = True
+
+
+def make_facts(count: int) -> list:
+    frequencies = [TemporalFrequency.MONTHLY, TemporalFrequency.ANNUALLY]
+    return [{"value": n * 1000000, "indicator": "gdp-{}".format(n % 3),
+             "category": "gdp", "date": Date(1997 + n // 12, n % 12 + 1, 1),
+             "frequency": frequencies[n % 2]}
+            for n in range(count)]
+
+
+def source_table(table_id: int = 7) -> SourceTable:
+    return SourceTable(table_id, SourceTableType.STATSCAN, Date(2018, 6, 1),
+                       from_db=True)
+
+
+def test_insert_frame_inserts_every_fact(monkeypatch):
+    connection = RecordingConnection()
+    monkeypatch.setattr(FinancialFactor, "CreateConnection",
+                        classmethod(lambda cls: connection))
+    facts = make_facts(25)
+    frame = FactFrame.FromFacts(facts)
+    assert FinancialFactor.InsertFrame(
+        frame, source_table(), page_size=10) == 25
+    assert connection.rows == [
+        (fact["value"], str(fact["frequency"]), fact["indicator"],
+         fact["category"], fact["date"], 7) for fact in facts]
+    assert len(connection.statements) == 3
+    assert all(statement.startswith(b"INSERT INTO FinancialFactor ")
+               for statement in connection.statements)
+    assert connection.committed and connection.closed
+
+
+def test_insert_frame_needs_a_stored_source_table(monkeypatch):
+    monkeypatch.setattr(FinancialFactor, "CreateConnection",
+                        classmethod(lambda cls: RecordingConnection()))
+    frame = FactFrame.FromFacts(make_facts(1))
+    with pytest.raises(ValueError):
+        FinancialFactor.InsertFrame(frame, None)
+    with pytest.raises(ValueError):
+        FinancialFactor.InsertFrame(frame, SourceTable(
+            None, SourceTableType.STATSCAN, Date(2018, 6, 1), from_db=True))
+    assert FinancialFactor.InsertFrame(FactFrame(), source_table()) == 0
@@ -0,0 +1,86 @@
+"""Gathernomics - Parse Cache Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+from datetime import datetime as DateTime
+import itertools
+
+from gathernomics.filters.gdp import GDPFilter
+from gathernomics.filters.ieport import ImportExportFilter
+from gathernomics.models.factor import TemporalFrequency
+from gathernomics.utils import scalar_multiplier, tryint
+
+SCALARS = ["units", "thousands", "Millions", "billions"]
+VALUES = ["1234", "0", "..", "", "12.5", "-3"]
+
+
+def make_rows() -> list:
+    return [{"REF_DATE": "{}-{:02d}".format(year, month), "VALUE": value,
+             "SCALAR_FACTOR": scalar, "Trade": trade}
+            for year, month, value, scalar, trade in itertools.product(
+                (1997, 2018), (1, 12), VALUES, SCALARS, ("Import", "Export"))]
+
+
+def uncached_fact(table_filter, row: dict) -> dict:
+    """Fact of a row, parsing everything again as before the cache."""
+    multiplier = scalar_multiplier(row["SCALAR_FACTOR"])
+    if table_filter.value_type is int:
+        value = tryint(row["VALUE"]) * multiplier
+    else:
+        value = int(float(row["VALUE"]) * multiplier)
+    return {
+        "value": value,
+        "indicator": table_filter.getIndicator(row),
+        "category": table_filter.getCategory(row),
+        "date": DateTime.strptime(row["REF_DATE"], "%Y-%m").date(),
+        "frequency": table_filter.getFrequency(row)
+    }
+
+
+class CountingFilter(GDPFilter):
+    """GDP Filter counting the dates it parses."""
+    def __init__(self):
+        super().__init__("gdp.csv", "gdp", "GDP", TemporalFrequency.MONTHLY)
+        self.parsed = []
+
+    def getDate(self, row: dict):
+        self.parsed.append(row["REF_DATE"])
+        return super().getDate(row)
+
+
+def test_cached_facts_match_uncached_parsing():
+    table_filter = GDPFilter(
+        "gdp.csv", "gdp", "GDP", TemporalFrequency.MONTHLY)
+    rows = make_rows()
+    assert [table_filter.transformRow(row) for row in rows] == \
+        [uncached_fact(table_filter, row) for row in rows]
+
+
+def test_cached_float_facts_match_uncached_parsing():
+    table_filter = ImportExportFilter(
+        "trade.csv", "trade", "trade", TemporalFrequency.MONTHLY)
+    rows = [row for row in make_rows() if row["VALUE"] not in ("..", "")]
+    assert [table_filter.transformRow(row) for row in rows] == \
+        [uncached_fact(table_filter, row) for row in rows]
+
+
+def test_each_date_is_parsed_once():
+    table_filter = CountingFilter()
+    rows = make_rows()
+    dates = [table_filter.transformRow(row)["date"] for row in rows]
+    assert sorted(table_filter.parsed) == [
+        "1997-01", "1997-12", "2018-01", "2018-12"]
+    assert len(set(map(id, dates))) == 4
+
+
+def test_fact_strings_are_shared():
+    table_filter = ImportExportFilter(
+        "trade.csv", "trade", "trade", TemporalFrequency.MONTHLY)
+    rows = [row for row in make_rows()
+            if row["Trade"] == "Import" and row["VALUE"] == "1234"]
+    # Each row's indicator is lowered into a new string.
+    facts = [table_filter.transformRow(row) for row in rows]
+    assert all(fact["indicator"] == "import" for fact in facts)
+    assert len({id(fact["indicator"]) for fact in facts}) == 1
@@ -0,0 +1,127 @@
+"""Gathernomics - Row Pipeline Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import csv
+from datetime import date as Date
+import threading
+
+import pytest
+
+from gathernomics.__main__ import ingest_tables, parse_args
+from gathernomics.descriptor import TableDescriptor
+from gathernomics.downloader import StatsCanTableDownloader
+from gathernomics.factframe import FactFrame
+from gathernomics.models.factor import TemporalFrequency
+from gathernomics.pipeline import IncompleteTableError, RowPipeline
+from gathernomics.writers import CsvRowWriter
+
+from tests.conftest import Table, make_gdp_zip
+
+
+def frame(value: int) -> FactFrame:
+    return FactFrame.FromFacts([{
+        "value": value, "indicator": "GDP", "category": "gdp",
+        "date": Date(2018, 1, 1), "frequency": TemporalFrequency.MONTHLY}])
+
+
+def values(batches) -> list:
+    return [value for rows in batches for value in rows.values]
+
+
+def test_tables_ahead_spill_and_keep_their_order():
+    pipeline = RowPipeline(2, max_batches=2)
+    for value in range(100, 150):
+        pipeline.Put(1, frame(value))
+    pipeline.Finish(1)
+    assert len(pipeline._tables[1]._batches) == 2
+
+    def produce_head():
+        for value in range(10):
+            pipeline.Put(0, frame(value))
+        pipeline.Finish(0)
+
+    producer = threading.Thread(target=produce_head)
+    producer.start()
+    assert values(pipeline.Batches()) == \
+        list(range(10)) + list(range(100, 150))
+    producer.join()
+
+
+def test_table_failing_before_its_turn_is_dropped():
+    pipeline = RowPipeline(3, max_batches=1)
+    for value in range(5):
+        pipeline.Put(1, frame(100 + value))
+        pipeline.Put(2, frame(200 + value))
+    pipeline.Fail(1)
+    pipeline.Put(1, frame(199))
+    for index in range(3):
+        pipeline.Finish(index)
+    assert values(pipeline.Batches()) == list(range(200, 205))
+
+
+def test_table_failing_during_its_turn_raises():
+    pipeline = RowPipeline(2, max_batches=4)
+    pipeline.Put(0, frame(0))
+    pipeline.Put(1, frame(100))
+    pipeline.Finish(1)
+    batches = pipeline.Batches()
+    assert values([next(batches)]) == [0]
+    pipeline.Fail(0)
+    with pytest.raises(IncompleteTableError) as error:
+        next(batches)
+    assert error.value.index == 0
+
+
+def gdp_table(table_server, name: str, table_path: str) -> TableDescriptor:
+    return TableDescriptor.CreateFromDict({
+        "name": name, "url": table_server.Url(table_path),
+        "data_filter": "gdp", "category": "gdp", "indicator": name,
+        "frequency": "monthly"})
+
+
+def ingest(table_server, tmpdir, tables: list, jobs: int, args=()):
+    """Rows written by a run over the tables, and those which failed."""
+    output_path = str(tmpdir.join("out-{}.csv".format(jobs)))
+    downloader = StatsCanTableDownloader(
+        compression_dir=str(tmpdir.join("zips")), pool_size=jobs)
+    writer = CsvRowWriter(output_path)
+    with downloader:
+        _, failed = ingest_tables(
+            parse_args(list(args)), downloader, tables, jobs, writer)
+    writer.Close()
+    with open(output_path) as output_file:
+        return list(csv.reader(output_file)), failed
+
+
+def test_jobs_ingest_concurrently_in_config_order(table_server, tmpdir):
+    body = make_gdp_zip(str(tmpdir.join("gdp.csv")), months=24)
+    for table_path in ("/a.zip", "/b.zip", "/c.zip"):
+        table_server.tables[table_path] = Table(body, delay=0.2)
+    tables = [gdp_table(table_server, "A", "/a.zip"),
+              gdp_table(table_server, "Missing", "/missing.zip"),
+              gdp_table(table_server, "B", "/b.zip"),
+              gdp_table(table_server, "C", "/c.zip")]
+    serial_rows, serial_failed = ingest(table_server, tmpdir, tables, 1)
+    assert table_server.max_active == 1
+    rows, failed = ingest(table_server, tmpdir, tables, 4)
+    assert table_server.max_active > 1
+    assert failed == serial_failed == ["Missing"]
+    assert rows == serial_rows
+    assert [row[1] for row in rows[1:]] == ["A"] * 24 + ["B"] * 24 + \
+        ["C"] * 24
+
+
+def test_tables_sharing_a_source_download_it_once(table_server, tmpdir):
+    body = make_gdp_zip(str(tmpdir.join("gdp.csv")), months=24)
+    table_server.tables["/shared.zip"] = Table(body)
+    tables = [gdp_table(table_server, "A", "/shared.zip"),
+              gdp_table(table_server, "B", "/shared.zip")]
+    rows, failed = ingest(table_server, tmpdir, tables, 2)
+    assert failed == []
+    assert [request[0] for request in table_server.requests] == \
+        ["/shared.zip"]
+    assert [row[1] for row in rows[1:]] == ["A"] * 24 + ["B"] * 24
+    assert [row[0] for row in rows[1:25]] == [row[0] for row in rows[25:]]
@@ -0,0 +1,65 @@
+"""Gathernomics - Compression Directory Manager Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import os
+import os.path as path
+
+import pytest
+
+from gathernomics.__main__ import parse_args
+from gathernomics.storage import CompressionDirManager
+
+
+def make_entries(tmpdir, names: list) -> list:
+    """Entries of 100 bytes each."""
+    entry_paths = []
+    for name in names:
+        entry = tmpdir.join(name)
+        entry.write(b"x" * 100, mode="wb")
+        entry_paths.append(str(entry))
+    return entry_paths
+
+
+def age_entries(entry_paths: list):
+    """Mark each entry as used a minute after the one before."""
+    for minute, entry_path in enumerate(entry_paths):
+        os.utime(entry_path, (60.0 * minute, 60.0 * minute))
+
+
+def test_least_recently_used_entries_are_evicted(tmpdir):
+    entries = make_entries(tmpdir, ["c.zip", "a.zip", "b.zip"])
+    age_entries(entries)
+    storage = CompressionDirManager(str(tmpdir), budget=250)
+    assert storage.Usage() == 300
+    assert storage.Evict() == 100
+    assert sorted(os.listdir(str(tmpdir))) == ["a.zip", "b.zip"]
+    # Using an entry makes it the most recent.
+    storage.Touch(entries[1])
+    storage = CompressionDirManager(str(tmpdir), budget=150)
+    assert storage.Evict() == 100
+    assert os.listdir(str(tmpdir)) == ["a.zip"]
+
+
+def test_entries_in_use_are_not_evicted(tmpdir):
+    entries = make_entries(tmpdir, ["a.zip", "b.zip", "c.d"])
+    storage = CompressionDirManager(str(tmpdir), budget=50)
+    storage.Acquire(entries[0])
+    storage.Acquire(entries[0])
+    age_entries(entries)
+    assert storage.Evict() == 200
+    assert os.listdir(str(tmpdir)) == ["a.zip"]
+    assert not storage.Remove(entries[0])
+    storage.Release(entries[0])
+    assert storage.Evict() == 0
+    storage.Release(entries[0])
+    assert storage.Evict() == 100
+    assert not path.exists(entries[0])
+
+
+@pytest.mark.parametrize("budget", ["0", "-1"])
+def test_budget_must_be_positive(budget):
+    with pytest.raises(SystemExit):
+        parse_args(["--comp-dir-budget", budget])
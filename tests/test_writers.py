@@ -0,0 +1,142 @@
+"""Gathernomics - Output Writer Tests.
+
+Copyright (c) 2018 Alex Dale
+See LICENSE for information
+"""
+
+import csv
+from datetime import date as Date
+import gzip
+import hashlib
+import json
+import os
+import os.path as path
+
+import pytest
+
+from gathernomics.columnfile import load_columns, read_header
+from gathernomics.factframe import FIELDS, FactFrame
+from gathernomics.writers import (
+    MANIFEST_NAME, ColumnarRowWriter, Compression, CsvRowWriter,
+    PartitionedRowWriter, output_compression)
+
+
+def fact(category, indicator, value: int, month: int) -> dict:
+    return {"value": value, "indicator": indicator, "category": category,
+            "date": Date(2018, month, 1), "frequency": "Monthly"}
+
+
+def test_partition_names_do_not_collide(tmpdir):
+    output_dir = str(tmpdir.join("out"))
+    keys = [("c-a-t", "GDP (real)"), ("c a t", "GDP real"),
+            ("c-a-t", "gdp real"), (None, "GDP"), ("none", "GDP")]
+    facts = [fact(category, indicator, 10 * n + month, month)
+             for n, (category, indicator) in enumerate(keys)
+             for month in (1, 2, 3)]
+    with PartitionedRowWriter(output_dir, writers=2) as writer:
+        writer.WriteFrame(FactFrame.FromFacts(facts[:7]))
+        writer.WriteFrame(FactFrame.FromFacts(facts[7:]))
+    with open(path.join(output_dir, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    partitions = manifest["partitions"]
+    assert manifest["rows"] == len(facts)
+    assert sorted([(entry["category"], entry["indicator"])
+                   for entry in partitions], key=str) == sorted(keys, key=str)
+    paths = [entry["path"] for entry in partitions]
+    assert len(set(file_path.lower() for file_path in paths)) == len(keys)
+    on_disk = sorted(
+        path.relpath(path.join(directory, name), output_dir)
+        for directory, _, names in os.walk(output_dir) for name in names
+        if name != MANIFEST_NAME)
+    assert on_disk == sorted(paths)
+    for entry in partitions:
+        file_path = path.join(output_dir, entry["path"])
+        with open(file_path, "rb") as file:
+            assert hashlib.sha256(file.read()).hexdigest() == entry["sha256"]
+        with open(file_path) as file:
+            rows = list(csv.DictReader(file))
+        assert len(rows) == entry["rows"] == 3
+        assert {row["indicator"] for row in rows} == {entry["indicator"]}
+        assert (entry["since"], entry["until"]) == ("2018-01-01",
+                                                    "2018-03-01")
+
+
+def test_abort_removes_partial_output(tmpdir):
+    output_path = str(tmpdir.join("out.csv"))
+    writer = CsvRowWriter(output_path)
+    writer.WriteFrame(FactFrame.FromFacts([fact("gdp", "GDP", 1, 1)]))
+    writer.Abort()
+    writer.Close()
+    assert not path.exists(output_path)
+    output_dir = str(tmpdir.join("out"))
+    tmpdir.join("out", MANIFEST_NAME).write("{}", ensure=True)
+    writer = PartitionedRowWriter(output_dir)
+    writer.WriteFrame(FactFrame.FromFacts([fact("gdp", "GDP", 1, 1)]))
+    writer.Abort()
+    writer.Close()
+    assert os.listdir(output_dir) == []
+
+
+def test_suspended_compressed_partitions_read_back_whole(tmpdir):
+    output_dir = str(tmpdir.join("out"))
+    writer = PartitionedRowWriter(
+        output_dir, writers=1, compression=Compression("gzip"), max_open=1)
+    with writer:
+        for month in range(1, 13):
+            writer.WriteFrame(FactFrame.FromFacts([
+                fact("gdp", indicator, month, month)
+                for indicator in ("GDP", "CPI", "Wages")]))
+    with open(path.join(output_dir, MANIFEST_NAME)) as file:
+        partitions = json.load(file)["partitions"]
+    assert len(partitions) == 3
+    for entry in partitions:
+        with gzip.open(path.join(output_dir, entry["path"]), "rt") as file:
+            rows = list(csv.reader(file))
+        assert rows[0] == FIELDS
+        assert [int(row[0]) for row in rows[1:]] == list(range(1, 13))
+
+
+@pytest.mark.parametrize("output_path, options", [
+    ("out.csv", {"compress": "bz2", "compress_level": 0}),
+    ("out.csv", {"compress": "gzip", "compress_level": 12}),
+    ("out.csv.xz", {"compress_level": 10}),
+    ("out.csv", {"compress": "gzip", "compress_buffer": 0}),
+    ("out.csv", {"compress_level": 5}),
+    ("out.gcol.gz", {"output_format": "columnar"}),
+])
+def test_invalid_compression_is_rejected(output_path, options):
+    with pytest.raises(ValueError):
+        output_compression(output_path, **options)
+
+
+def test_compression_levels():
+    assert output_compression("out.csv.xz", compress_level=0).name == "xz"
+    assert output_compression(
+        "out", partition="indicator", compress="bz2",
+        compress_level=9).suffix == ".bz2"
+    assert output_compression("out.csv") is None
+
+
+@pytest.mark.parametrize("suspend", [False, True])
+def test_columnar_series_spill_and_read_back(tmpdir, suspend):
+    numpy = pytest.importorskip("numpy")
+    output_path = str(tmpdir.join("out.gcol"))
+    indicators = ["GDP", "CPI", "Wages"]
+    with ColumnarRowWriter(output_path, buffer_rows=4) as writer:
+        for month in range(1, 13):
+            writer.WriteFrame(FactFrame.FromFacts([
+                fact("gdp", indicator, 100 * n + month, month)
+                for n, indicator in enumerate(indicators)]))
+            if suspend:
+                writer.Suspend()
+    header, _ = read_header(output_path)
+    assert header["rows"] == 36
+    for n, entry in enumerate(header["series"]):
+        assert entry["indicator"] == indicators[n]
+        columns = load_columns(output_path, series=n)
+        assert columns["value"].tolist() == [
+            100 * n + month for month in range(1, 13)]
+        assert columns["date"].tolist() == [
+            Date(2018, month, 1) for month in range(1, 13)]
+        assert numpy.all(columns["indicator"] == columns["indicator"][0])
+    assert not path.exists(writer._spill_path)